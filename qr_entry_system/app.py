@@ -1,30 +1,89 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, make_response, Response, stream_with_context, send_file, g
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
-from db import get_db, close_db
-import qrcode
+from db import get_db, close_db, pool as db_pool, query_stats
+from descriptors import parse_descriptor, encode_descriptor, stored_descriptor, HAS_FACE
+from face_index import face_index, get_face_index
+from face_feed import record_face_change, feed_state, fetch_faces, changes_since, pack_faces
+from log_export import stream_logs_csv
+from log_columnar import export_columnar, resolve_format, available_formats, MIMETYPES as COLUMNAR_MIMETYPES
+from work_days import refresh_around
+from scans import (record_scan, record_batch, recent_scans, seen_keys, result as scan_result,
+                   VALID_ACTIONS, MAX_BATCH, KEY_PATTERN)
+from scan_journal import scan_journal, WRITE_BEHIND
+from jobs import JobQueue, JobLimit
+from reports import JOB_KINDS
+from report_cache import report_cache, cache_key, watermark, pdf_watermark
+from log_queries import (log_filters, build_log_where, decode_cursor, encode_cursor, keyset_page,
+                         estimate_count, PAGE_SIZE, MAX_PAGE_SIZE, TIMESTAMP_FORMAT)
+from qr_images import qr_images, qr_version, MIMETYPES as QR_MIMETYPES
+from qr_tokens import qr_tokens, is_signed, InvalidToken, KeystoreError, REVOKE_ALL
+from user_cache import user_cache, record_user_change
+from user_status import status_mirror, touch_status, InvalidTransition, POLICY as TRANSITION_POLICY
+from metrics import metrics
 import os
-import io
-import csv
+import re
 import base64
 import pymysql
-from xhtml2pdf import pisa
+import time
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 app = Flask(__name__)
 # Use a static secret key from environment or fallback to random (random breaks sessions in multi-worker Gunicorn)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(16))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=5)
 
+app.add_template_filter(qr_version)
+
+# PDF reports are generated in background worker processes (see jobs.py)
+report_jobs = JobQueue(JOB_KINDS)
+
 @app.before_request
 def make_session_permanent():
     session.permanent = True
 
+@app.before_request
+def start_request_metrics():
+    metrics.start()
+    # Unknown URLs share one label instead of one series per path
+    g.metrics_labels = {'endpoint': request.endpoint or 'unmatched', 'method': request.method}
+    g.metrics_started = time.perf_counter()
+    metrics.gauge_add('http_requests_in_flight', {'endpoint': g.metrics_labels['endpoint']})
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    # Statements run so far (a streamed body may run more), for devtools and the load driver
+    count, seconds = query_stats.request_tally()
+    response.headers['Server-Timing'] = f'db;desc="{count} queries";dur={seconds * 1000:.1f}'
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    # Runs after a streamed body (CSV export) has been sent, and after errors
+    labels = g.pop('metrics_labels', None)
+    if labels is None:
+        return
+    metrics.observe('http_request_duration_seconds', time.perf_counter() - g.metrics_started, labels)
+    status = g.pop('metrics_status', 500 if exception else 200)
+    metrics.inc('http_requests_total', dict(labels, status=str(status)))
+    metrics.gauge_add('http_requests_in_flight', {'endpoint': labels['endpoint']}, -1)
+
 @app.teardown_appcontext
 def teardown_db(exception):
     close_db(exception)
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format, every gunicorn worker included (see metrics.py)."""
+    # An admin session, or a scraper with METRICS_TOKEN; nothing else unless configured
+    token = os.environ.get('METRICS_TOKEN')
+    scraper = bool(token) and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not scraper and session.get('role') != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -104,12 +163,26 @@ def register_user():
     cedula = request.form.get('cedula')
     area = request.form.get('area')
     face_descriptor = request.form.get('face_descriptor') 
-    qr_data = f"user:{username}:{secrets.token_hex(4)}"
+    # Placeholder until the signed token, which embeds the new id, is issued
+    qr_data = f"pending:{secrets.token_hex(16)}"
     
     db = get_db()
     
     # ... duplicate checks ...
 
+    # Face Uniqueness Check
+    face_vector = None
+    if face_descriptor and face_descriptor.strip():
+        try:
+            face_vector = parse_descriptor(face_descriptor)
+            duplicate = get_face_index().find_duplicate(face_vector)
+        except ValueError as e:
+            flash(f'Error procesando biometría: {e}')
+            return redirect(url_for('dashboard'))
+        if duplicate:
+            flash(f'Error: Rostro ya registrado por "{duplicate[1]}".')
+            return redirect(url_for('dashboard'))
+
     # Password Logic: Only hash if provided
     pwd_hash = None
     if password and password.strip():
@@ -120,12 +193,24 @@ def register_user():
     try:
         with db.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO users (username, password_hash, role, cedula, area, qr_code_data, face_descriptor) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                (username, pwd_hash, role, cedula, area, qr_data, face_descriptor)
+                "INSERT INTO users (username, password_hash, role, cedula, area, qr_code_data, face_vector) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (username, pwd_hash, role, cedula, area, qr_data,
+                 encode_descriptor(face_vector) if face_vector is not None else None)
             )
+            new_user_id = cursor.lastrowid
+            cursor.execute("UPDATE users SET qr_code_data = %s WHERE id = %s",
+                           (qr_tokens.issue(new_user_id), new_user_id))
+            if face_vector is not None:
+                record_face_change(cursor, new_user_id)
+            record_user_change(cursor)
         db.commit()
+        user_cache.clear()
+        if face_vector is not None:
+            face_index.upsert(new_user_id, username, face_vector)
         flash('Usuario registrado exitosamente.')
-    except pymysql.MySQLError as e:
+    except (pymysql.MySQLError, KeystoreError) as e:
+        # Nothing half-created: the user row goes with the failed token
+        db.rollback()
         flash(f'Error al registrar usuario: {e}')
         
     return redirect(url_for('dashboard'))
@@ -147,7 +232,16 @@ def update_profile():
                               (username, generate_password_hash(password), user_id))
             else:
                 cursor.execute("UPDATE users SET username = %s WHERE id = %s", (username, user_id))
+            # Username is the face label kiosks display (nothing to relabel without a face)
+            cursor.execute(f"SELECT 1 FROM users WHERE id = %s AND {HAS_FACE}", (user_id,))
+            if cursor.fetchone():
+                record_face_change(cursor, user_id)
+            record_user_change(cursor)
         db.commit()
+        user_cache.clear()
+        face_index.rename(user_id, username)
+        # Cached reports show usernames; a rename does not touch the logs watermark
+        report_cache.clear()
         return {'status': 'success', 'message': 'Perfil actualizado correctmente'}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
@@ -157,6 +251,10 @@ def generate_qr_image():
     if 'user_id' not in session:
         return redirect(url_for('login'))
         
+    fmt = request.args.get('format', 'png')
+    if fmt not in QR_MIMETYPES:
+        return "Formato no soportado", 400
+
     db = get_db()
     with db.cursor() as cursor:
         cursor.execute("SELECT qr_code_data FROM users WHERE id = %s", (session['user_id'],))
@@ -164,12 +262,17 @@ def generate_qr_image():
         
     if not user or not user['qr_code_data']:
         return "No QR code data found", 404
-        
-    img = qrcode.make(user['qr_code_data'])
-    buf = io.BytesIO()
-    img.save(buf)
-    buf.seek(0)
-    return Flask.response_class(buf.getvalue(), mimetype='image/png')
+
+    image, etag = qr_images.get(user['qr_code_data'], fmt)
+    response = make_response(image)
+    response.mimetype = QR_MIMETYPES[fmt]
+    response.set_etag(etag)
+    if request.args.get('v') == qr_version(user['qr_code_data']):
+        # Versioned URL (see the qr_version filter): a new QR code gets a new URL
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/scanner')
 def scanner():
@@ -187,58 +290,220 @@ def log_scan():
     qr_data = data.get('qr_data')
     username = data.get('username')
     action_type = data.get('action_type')
+    # Same key again (a retried request) returns the first result
+    key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
     
     if not action_type or (not qr_data and not username):
         return {'status': 'error', 'message': 'Missing data'}, 400
+    if key is not None and (not isinstance(key, str) or not KEY_PATTERN.match(key)):
+        return {'status': 'error', 'message': 'idempotency_key inválida'}, 400
+    if qr_data and not isinstance(qr_data, str):
+        return {'status': 'error', 'message': 'qr_data inválido'}, 400
         
     db = get_db()
-    with db.cursor() as cursor:
-        user = None
-        if qr_data:
-            cursor.execute("SELECT id, username FROM users WHERE qr_code_data = %s", (qr_data,))
-            user = cursor.fetchone()
-        elif username:
-            cursor.execute("SELECT id, username FROM users WHERE username = %s", (username,))
-            user = cursor.fetchone()
-        
-        if not user:
-             return {'status': 'error', 'message': 'Usuario no encontrado'}, 404
-
-        # Log action
-        valid_actions = ['entry', 'exit', 'start_lunch', 'end_lunch']
-        if action_type not in valid_actions:
-             return {'status': 'error', 'message': 'Acción inválida'}, 400
-
-        cursor.execute(
-            "INSERT INTO logs (user_id, type) VALUES (%s, %s)",
-            (user['id'], action_type)
-        )
-        db.commit()
-    
-    return {'status': 'success', 'message': f'Registro exitoso: {user["username"]} - {action_type}'}
+    if qr_data and is_signed(qr_data):
+        # Signed token: the user id comes from the verified token itself
+        try:
+            user_id = qr_tokens.ensure_current(db).verify(qr_data)[0]
+        except InvalidToken as e:
+            return {'status': 'error', 'message': str(e)}, 404
+        user = user_cache.get(db, 'id', user_id)
+    elif qr_data:
+        # Codes issued before signed tokens (user:<name>:<hex>)
+        user = user_cache.get(db, 'qr', qr_data)
+    else:
+        user = user_cache.get(db, 'username', username)
+
+    if not user:
+         return {'status': 'error', 'message': 'Usuario no encontrado'}, 404
+
+    # Log action
+    if action_type not in VALID_ACTIONS:
+         return {'status': 'error', 'message': 'Acción inválida'}, 400
+
+    # A repeat (face loop, QR read twice) within the debounce window is not logged again
+    original = recent_scans.original(user['id'], action_type, key)
+    if original:
+        return scan_response(original, duplicate=True)
+
+    reject = TRANSITION_POLICY == 'reject'
+    if WRITE_BEHIND:
+        # Checked against this worker's mirror of user_status; the flusher
+        # records the status (and flags) once it writes the scan
+        problem = status_mirror.ensure_current(db).problem(user['id'], action_type, datetime.now())
+        if problem and reject:
+            metrics.inc('scans_total', {'action': action_type, 'result': 'rejected'})
+            return {'status': 'error', 'message': f'Registro rechazado: {problem}'}, 409
+        # Acknowledged once journaled; written to logs by the flusher (scan_journal.py),
+        # which also applies the cross-worker debounce
+        record = scan_journal.append(user['id'], action_type, key=key)
+        timestamp, created = datetime.strptime(record['t'], TIMESTAMP_FORMAT), True
+    else:
+        with db.cursor() as cursor:
+            try:
+                timestamp, created, problem = record_scan(cursor, user['id'], action_type, key, reject)
+                db.commit()
+            except InvalidTransition as e:
+                db.rollback()
+                metrics.inc('scans_total', {'action': action_type, 'result': 'rejected'})
+                return {'status': 'error', 'message': f'Registro rechazado: {e}'}, 409
+            except pymysql.IntegrityError:
+                db.rollback()
+                original = seen_keys(cursor, [key]).get(key) if key else None
+                if original is None:
+                    # Deleted on another worker since this one cached the user
+                    user_cache.clear()
+                    return {'status': 'error', 'message': 'Usuario no encontrado'}, 404
+                # The same key committed by a concurrent request
+                timestamp, created, problem = original['timestamp'], False, None
+
+    result = scan_result('created' if created else 'duplicate', user['username'], action_type, timestamp)
+    if created:
+        if problem:
+            result['warning'] = problem
+        status_mirror.apply(user['id'], action_type, timestamp, problem)
+        recent_scans.remember(user['id'], action_type, key, result)
+    return scan_response(result, duplicate=not created)
+
+def scan_response(result, duplicate=False):
+    metrics.inc('scans_total', {'action': result['action_type'], 'result': 'duplicate' if duplicate else 'created'})
+    response = {'status': 'success', 'timestamp': result['timestamp'],
+                'message': f'Registro exitoso: {result["username"]} - {result["action_type"]}'}
+    if duplicate:
+        # Already logged at `timestamp`; nothing new was recorded
+        response['duplicate'] = True
+    if result.get('warning'):
+        # Logged, but out of sequence (e.g. an exit without an entry)
+        response['warning'] = result['warning']
+    return response
+
+@app.route('/api/log_scan/batch', methods=['POST'])
+def log_scan_batch():
+    """Upload many scans at once (kiosk backlog after being offline).
+
+    Body: {"scans": [{qr_data | username, action_type, client_timestamp,
+    idempotency_key}, ...]}. client_timestamp (ISO 8601) is when the scan was
+    taken; a scan whose idempotency_key was already recorded is not logged
+    again. Returns one result per scan, in order.
+    """
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+
+    data = request.get_json(silent=True) or {}
+    items = data.get('scans')
+    if not items or not isinstance(items, list):
+        return {'status': 'error', 'message': 'Missing data'}, 400
+    if len(items) > MAX_BATCH:
+        return {'status': 'error', 'message': f'Máximo {MAX_BATCH} registros por solicitud'}, 400
+
+    try:
+        results = record_batch(get_db(), items)
+    except pymysql.MySQLError as e:
+        return {'status': 'error', 'message': str(e)}, 500
+    for item, r in zip(items, results):
+        action_type = item.get('action_type') if isinstance(item, dict) else None
+        metrics.inc('scans_total', {'action': action_type if action_type in VALID_ACTIONS else 'invalid',
+                                    'result': r['status']})
+    created = sum(1 for r in results if r['status'] == 'created')
+    return {'status': 'success', 'created': created, 'results': results}
 
 @app.route('/api/users/faces')
 def get_user_faces():
+    """Versioned descriptor feed.
+
+    ?since=<version> returns only the faces added/changed and the ids removed
+    after that version, plus those of the few versions before it (a change
+    can commit after a higher version): apply every entry as an upsert. The
+    ETag follows the feed state, so an unchanged feed is a 304. ?format=binary (or Accept: application/octet-stream) returns packed
+    float32 vectors plus a label table, see face_feed.pack_faces.
+    """
     if 'user_id' not in session:
          return {'status': 'error', 'message': 'Unauthorized'}, 403
 
+    since = request.args.get('since', type=int)
+    binary = (request.args.get('format') == 'binary' or
+              request.accept_mimetypes.best == 'application/octet-stream')
+
     db = get_db()
     with db.cursor() as cursor:
-        cursor.execute("SELECT username, face_descriptor FROM users WHERE face_descriptor IS NOT NULL")
-        users = cursor.fetchall()
-    
-    import json
-    result = []
-    for u in users:
+        version, recent = feed_state(cursor)
+        # A client ahead of the server (e.g. restored database) needs a full resync
+        full = since is None or since > version
+        etag = f"faces-{version}.{recent}-{'full' if full else since}-{'bin' if binary else 'json'}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        if full:
+            rows, removed = fetch_faces(cursor), []
+        else:
+            rows, removed = changes_since(cursor, since)
+
+    faces = []
+    for u in rows:
         try:
-             desc = u['face_descriptor']
-             if isinstance(desc, str):
-                 desc = json.loads(desc)
-             result.append({'username': u['username'], 'descriptor': desc})
-        except:
-            continue
-            
-    return {'status': 'success', 'users': result}
+            faces.append((u['id'], u['username'], parse_descriptor(stored_descriptor(u)), u.get('existed')))
+        except (ValueError, TypeError):
+            if not full:
+                removed.append(u['id'])
+
+    if binary:
+        payload = pack_faces(version, full, [f[:3] for f in faces], removed)
+        response = make_response(payload)
+        response.mimetype = 'application/octet-stream'
+    else:
+        result = []
+        for user_id, username, vector, existed in faces:
+            entry = {'id': user_id, 'username': username, 'descriptor': vector.astype(float).round(6).tolist()}
+            if not full:
+                entry['change'] = 'changed' if existed else 'added'
+            result.append(entry)
+        response = make_response({'status': 'success', 'version': version, 'full': full,
+                                  'users': result, 'removed': removed})
+
+    response.set_etag(etag)
+    # Always revalidate: a 304 costs one indexed MAX() query
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Frames (or kiosks) that can be matched in a single identify call
+MAX_IDENTIFY_BATCH = 32
+
+@app.route('/api/faces/identify', methods=['POST'])
+def identify_faces():
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+
+    data = request.get_json(silent=True) or {}
+    descriptors = data.get('descriptors')
+    if descriptors is None and data.get('descriptor') is not None:
+        descriptors = [data['descriptor']]
+
+    if not descriptors or not isinstance(descriptors, list):
+        return {'status': 'error', 'message': 'Missing data'}, 400
+    if len(descriptors) > MAX_IDENTIFY_BATCH:
+        return {'status': 'error', 'message': f'Máximo {MAX_IDENTIFY_BATCH} descriptores por solicitud'}, 400
+
+    try:
+        matches = get_face_index().identify(descriptors)
+    except (ValueError, TypeError) as e:
+        return {'status': 'error', 'message': f'Error procesando biometría: {str(e)}'}, 400
+
+    results = []
+    for user_id, username, distance in matches:
+        metrics.inc('face_matches_total', {'outcome': 'matched' if username else 'unknown'})
+        results.append({
+            'label': username or 'unknown',
+            'username': username,
+            'distance': round(distance, 4) if distance is not None else None
+        })
+
+    # Best recognised face across the batch (several frames of the same person)
+    known = [r for r in results if r['username']]
+    best = min(known, key=lambda r: r['distance']) if known else None
+
+    return {'status': 'success', 'matches': results, 'best': best}
 
 
 # --- User Management APIs ---
@@ -280,26 +545,15 @@ def update_user(user_id):
     db = get_db()
 
     # Face Uniqueness Check (if updating face)
+    face_vector = None
     if face_descriptor and face_descriptor.strip():
-        import json
-        import math
         try:
-            new_desc = json.loads(face_descriptor)
-            with db.cursor() as cursor:
-                # Get all OTHER users' faces
-                cursor.execute("SELECT username, face_descriptor FROM users WHERE face_descriptor IS NOT NULL AND id != %s", (user_id,))
-                other_users = cursor.fetchall()
-            
-            for other in other_users:
-                try:
-                    stored_desc = json.loads(other['face_descriptor'])
-                    distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(new_desc, stored_desc)))
-                    if distance < 0.5:
-                         return {'status': 'error', 'message': f'Rostro ya registrado por "{other["username"]}".'}
-                except:
-                    continue
+            face_vector = parse_descriptor(face_descriptor)
+            duplicate = get_face_index().find_duplicate(face_vector, exclude_id=user_id)
         except Exception as e:
             return {'status': 'error', 'message': f'Error procesando biometría: {str(e)}'}
+        if duplicate:
+            return {'status': 'error', 'message': f'Rostro ya registrado por "{duplicate[1]}".'}
     
     try:
         with db.cursor() as cursor:
@@ -311,17 +565,30 @@ def update_user(user_id):
                 query += ", password_hash = %s"
                 params.append(generate_password_hash(password))
             
-            if face_descriptor:
-                if not face_descriptor.strip():
-                     face_descriptor = None
-                query += ", face_descriptor = %s"
-                params.append(face_descriptor)
+            if face_vector is not None:
+                query += ", face_vector = %s, face_descriptor = NULL"
+                params.append(encode_descriptor(face_vector))
+            elif face_descriptor:
+                # A blank descriptor clears the enrolled face
+                query += ", face_vector = NULL, face_descriptor = NULL"
                 
             query += " WHERE id = %s"
             params.append(user_id)
             
             cursor.execute(query, tuple(params))
+            record_face_change(cursor, user_id)
+            record_user_change(cursor)
+            # The area may have changed: occupancy mirrors re-read the row
+            touch_status(cursor, user_id)
         db.commit()
+        user_cache.clear()
+        if face_vector is not None:
+            face_index.upsert(user_id, username, face_vector)
+        elif face_descriptor:
+            face_index.remove(user_id)
+        else:
+            face_index.rename(user_id, username)
+        report_cache.clear()
         return {'status': 'success', 'message': 'Usuario actualizado'}
     except pymysql.MySQLError as e:
         if e.args[0] == 1062:
@@ -340,14 +607,96 @@ def delete_user(user_id):
     db = get_db()
     try:
         with db.cursor() as cursor:
-            # Cascading delete usually handled by DB, but let's be safe
+            # logs is partitioned, so it has no foreign key to cascade (migration 0014)
             cursor.execute("DELETE FROM logs WHERE user_id = %s", (user_id,))
             cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            record_face_change(cursor, user_id, deleted=True)
+            qr_tokens.revoke(cursor, user_id, REVOKE_ALL)
+            record_user_change(cursor)
         db.commit()
+        user_cache.clear()
+        qr_tokens.sync(db)
+        face_index.remove(user_id)
+        status_mirror.remove(user_id)
         return {'status': 'success', 'message': 'Usuario eliminado'}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}, 500
 
+@app.route('/api/users/<int:user_id>/reissue_qr', methods=['POST'])
+def reissue_qr(user_id):
+    """Replace a user's QR code (lost or shared badge); the old one stops scanning."""
+    if 'user_id' not in session or session['role'] != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+
+    db = get_db()
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT qr_code_data FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
+            if not user:
+                return {'status': 'error', 'message': 'Usuario no encontrado'}, 404
+            qr_tokens.reissue(cursor, user_id)
+            record_user_change(cursor)
+        db.commit()
+        user_cache.clear()
+        qr_tokens.sync(db)
+        qr_images.invalidate(user['qr_code_data'])
+        return {'status': 'success', 'message': 'Código QR regenerado'}
+    except (pymysql.MySQLError, KeystoreError) as e:
+        db.rollback()
+        return {'status': 'error', 'message': str(e)}, 500
+
+@app.route('/api/admin/db_pool')
+def db_pool_stats():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    # Per worker process: each gunicorn worker owns its own pool
+    return {'status': 'success', 'pid': os.getpid(), 'pool': db_pool.stats()}
+
+@app.route('/api/admin/queries')
+def query_stats_endpoint():
+    """Statements by total time in this worker; ?clear=1 starts over."""
+    if 'user_id' not in session or session['role'] != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    stats = query_stats.stats(top=request.args.get('top', 20, type=int))
+    if request.args.get('clear') == '1':
+        query_stats.clear()
+    return {'status': 'success', 'pid': os.getpid(), 'queries': stats}
+
+@app.route('/api/admin/user_cache')
+def user_cache_stats():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    # Per worker process, like the pool stats
+    return {'status': 'success', 'pid': os.getpid(), 'user_cache': user_cache.stats()}
+
+@app.route('/api/admin/scan_journal')
+def scan_journal_stats():
+    if 'user_id' not in session or session['role'] != 'admin':
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    return {'status': 'success', 'pid': os.getpid(), 'scan_journal': scan_journal.stats()}
+
+# --- Occupancy ---
+
+@app.route('/api/occupancy')
+def occupancy():
+    """How many people are inside (or at lunch) right now, per area."""
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    areas, totals = status_mirror.ensure_current(get_db()).occupancy()
+    return {'status': 'success', 'inside': totals['in'], 'lunch': totals['lunch'],
+            'areas': [{'area': area, 'inside': n['in'], 'lunch': n['lunch']} for area, n in sorted(areas.items())]}
+
+@app.route('/api/occupancy/present')
+def occupancy_present():
+    """Who is inside right now (?area= to narrow it down), with flagged scans."""
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    people = status_mirror.ensure_current(get_db()).present(request.args.get('area'))
+    return {'status': 'success', 'count': len(people), 'users': [
+        {'id': p['id'], 'username': p['username'], 'area': p['area'], 'state': p['state'],
+         'since': p['last_at'].strftime(TIMESTAMP_FORMAT), 'flag': p['flag']} for p in people]}
+
 # --- Admin Logs Management APIs ---
 
 @app.route('/api/logs/search')
@@ -355,41 +704,40 @@ def search_logs():
     if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
         return {'status': 'error', 'message': 'Unauthorized'}, 403
 
-    username = request.args.get('username', '')
-    action_type = request.args.get('action_type', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    query = """
+    order = request.args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        return {'status': 'error', 'message': 'Orden inválido'}, 400
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return {'status': 'error', 'message': 'Límite inválido'}, 400
+
+    try:
+        where, params = build_log_where(log_filters(request.args))
+        token = request.args.get('cursor')
+        after = decode_cursor(token, order) if token else None
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    keyset, keyset_params, order_by = keyset_page(order, after)
+
+    # One extra row tells whether there is a next page
+    query = f"""
         SELECT logs.id, logs.type, logs.timestamp, users.username 
         FROM logs 
         JOIN users ON logs.user_id = users.id 
-        WHERE 1=1
+        WHERE {where}{keyset}
+        {order_by} LIMIT %s
     """
-    params = []
-    
-    if username:
-        query += " AND users.username LIKE %s"
-        params.append(f"%{username}%")
-        
-    if action_type:
-        query += " AND logs.type = %s"
-        params.append(action_type)
-        
-    if date_from:
-        query += " AND DATE(logs.timestamp) >= %s"
-        params.append(date_from)
-        
-    if date_to:
-        query += " AND DATE(logs.timestamp) <= %s"
-        params.append(date_to)
-        
-    query += " ORDER BY logs.timestamp DESC LIMIT 100"
     
     db = get_db()
     with db.cursor() as cursor:
-        cursor.execute(query, tuple(params))
+        cursor.execute(query, (*params, *keyset_params, limit + 1))
         logs = cursor.fetchall()
+        # Exact COUNT(*) would scan the whole range; the first page gets the optimizer estimate
+        total = estimate_count(cursor, where, params) if after is None and request.args.get('include_total') == '1' else None
+
+    has_more = len(logs) > limit
+    logs = logs[:limit]
         
     # Convert datetime to string for JSON
     results = []
@@ -400,8 +748,16 @@ def search_logs():
             'type': log['type'],
             'timestamp': log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
         })
-        
-    return {'status': 'success', 'logs': results}
+
+    response = {
+        'status': 'success',
+        'logs': results,
+        'next_cursor': encode_cursor(logs[-1], order) if has_more else None,
+    }
+    if total is not None:
+        response['total'] = max(total, len(results))
+        response['total_is_estimate'] = True
+    return response
 
 @app.route('/api/logs/delete/<int:log_id>', methods=['POST'])
 def delete_log(log_id):
@@ -411,192 +767,139 @@ def delete_log(log_id):
     db = get_db()
     try:
         with db.cursor() as cursor:
-            cursor.execute("DELETE FROM logs WHERE id = %s", (log_id,))
+            cursor.execute("SELECT user_id, timestamp FROM logs WHERE id = %s", (log_id,))
+            log = cursor.fetchone()
+            if log:
+                # With the timestamp only its month's partition is searched
+                cursor.execute("DELETE FROM logs WHERE id = %s AND timestamp = %s", (log_id, log['timestamp']))
+                refresh_around(cursor, log['user_id'], log['timestamp'])
         db.commit()
         return {'status': 'success', 'message': 'Registro eliminado'}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}, 500
 
-@app.route('/api/logs/export_pdf')
+@app.route('/api/logs/export_pdf', methods=['GET', 'POST'])
 def export_logs_pdf():
+    """Queue the payroll PDF; poll /api/reports/<id> and fetch it from .../download."""
     if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
-        return redirect(url_for('login'))
-        
-    # Reuse Search Logic
-    username = request.args.get('username', '')
-    action_type = request.args.get('action_type', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    query = """
-        SELECT logs.id, users.username, logs.type, logs.timestamp
-        FROM logs 
-        JOIN users ON logs.user_id = users.id 
-        WHERE 1=1
-    """
-    params = []
-    
-    if username:
-        query += " AND users.username LIKE %s"
-        params.append(f"%{username}%")
-    if action_type:
-        query += " AND logs.type = %s"
-        params.append(action_type)
-    if date_from:
-        query += " AND DATE(logs.timestamp) >= %s"
-        params.append(date_from)
-    if date_to:
-        query += " AND DATE(logs.timestamp) <= %s"
-        params.append(date_to)
-        
-    query += " ORDER BY logs.timestamp DESC"
-    
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+
+    filters = log_filters(request.values)
+    try:
+        # Reject bad filters now rather than in the worker
+        where, params = build_log_where(filters)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+
+    # Same filters, logs and rollup in range as when it was generated: no job needed
+    key = report_key(filters, 'pdf', where, params)
+    if report_cache.get(key, 'pdf'):
+        return {'status': 'success', 'job': {
+            'id': None, 'state': 'done', 'progress': 1, 'message': 'Listo', 'error': None,
+            'download_url': url_for('cached_pdf', key=key),
+        }}
+
+    try:
+        job_id = report_jobs.submit('payroll_pdf', filters, owner_id=session['user_id'])
+    except JobLimit as e:
+        return {'status': 'error', 'message': str(e)}, 429
+    return {'status': 'success', 'job': job_info(report_jobs.get(job_id))}, 202
+
+def report_key(filters, fmt, where, params):
+    """Cache key of the report for the current logs in range."""
     db = get_db()
     with db.cursor() as cursor:
-        cursor.execute(query, tuple(params))
-        logs = cursor.fetchall()
+        mark = pdf_watermark(cursor, filters) if fmt == 'pdf' else watermark(cursor, where, params)
+    return cache_key(filters, fmt, mark)
 
-    
-    # --- COLOMBIAN PAYROLL LOGIC ---
-    from datetime import datetime, timedelta
-
-    # Hardcoded Holidays 2024-2025 (Simplified List)
-    HOLIDAYS = [
-        '2024-01-01', '2024-03-25', '2024-03-28', '2024-03-29', '2024-05-01', 
-        '2024-05-13', '2024-06-03', '2024-06-10', '2024-07-01', '2024-07-20', 
-        '2024-08-07', '2024-08-19', '2024-10-14', '2024-11-04', '2024-11-11', 
-        '2024-12-08', '2024-12-25',
-        '2025-01-01' 
-    ]
-
-    def is_sunday_or_holiday(date_obj):
-        if date_obj.weekday() == 6: return True # Sunday
-        if date_obj.strftime('%Y-%m-%d') in HOLIDAYS: return True
-        return False
-
-    # Group logs by User
-    user_logs = {}
-    for log in logs:
-        uid = log['username'] # Group by username for report
-        if uid not in user_logs: user_logs[uid] = []
-        user_logs[uid].append(log)
+def send_report(f, mimetype, download_name, as_attachment=False):
+    """send_file of an open report file (ReportCache.open), with its length."""
+    response = send_file(f, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name)
+    response.content_length = os.fstat(f.fileno()).st_size
+    return response
 
-    payroll_summary = {}
-
-    for username, u_logs in user_logs.items():
-        # Sort by time ASC for processing
-        sorted_logs = sorted(u_logs, key=lambda x: x['timestamp'])
-        
-        total_hours = 0
-        sunday_holiday_hours = 0
-        overtime_hours = 0
-        
-        # Session Logic: Pair Entry -> Exit
-        i = 0
-        while i < len(sorted_logs):
-            current = sorted_logs[i]
-            
-            if current['type'] == 'entry':
-                # Look for next exit
-                next_log = None
-                for j in range(i+1, len(sorted_logs)):
-                    if sorted_logs[j]['type'] == 'exit':
-                        next_log = sorted_logs[j]
-                        i = j # Advance main loop
-                        break
-                
-                if next_log:
-                    # Calculate Duration
-                    start = current['timestamp']
-                    end = next_log['timestamp']
-                    duration = (end - start).total_seconds() / 3600 # Hours
-                    
-                    # 1. Total
-                    total_hours += duration
-                    
-                    # 2. Sunday/Holiday Check (Check Start Date)
-                    if is_sunday_or_holiday(start):
-                        sunday_holiday_hours += duration
-                        
-                    # 3. Daily Overtime ( Simplified: >8h in a single session, or check daily total? 
-                    # Real law is daily total, but for this summary session-based > 8 is a good approximation or we track by day)
-                    # Let's simple check: if session > 8h
-                    if duration > 8:
-                        overtime_hours += (duration - 8)
-            
-            i += 1
-            
-        payroll_summary[username] = {
-            'total_hours': round(total_hours, 2),
-            'sunday_holiday_hours': round(sunday_holiday_hours, 2),
-            'overtime_hours': round(overtime_hours, 2)
-        }
-
-    # Render HTML for PDF
-    html_content = render_template('pdf_report.html', logs=logs, summary=payroll_summary)
-    
-    pdf_output = io.BytesIO()
-    pisa_status = pisa.CreatePDF(
-        src=html_content,    # the HTML to convert
-        dest=pdf_output      # file handle to recieve result
-    )
-
-    if pisa_status.err:
-        return f"Error generating PDF", 500
-        
-    pdf_output.seek(0)
-    return Flask.response_class(pdf_output.getvalue(), mimetype='application/pdf')
+@app.route('/api/reports/cached/<key>.pdf')
+def cached_pdf(key):
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return redirect(url_for('login'))
+    f = report_cache.open(key, 'pdf') if re.fullmatch(r'[0-9a-f]{64}', key) else None
+    if f is None:
+        return "Reporte no disponible", 404
+    return send_report(f, 'application/pdf', 'reporte_nomina.pdf')
+
+def job_info(job):
+    info = {
+        'id': job['id'],
+        'state': job['state'],
+        'progress': round(job['progress'], 2),
+        'message': job['message'],
+        'error': job['error'],
+        'status_url': url_for('report_status', job_id=job['id']),
+    }
+    if job['state'] == 'done':
+        info['download_url'] = url_for('report_download', job_id=job['id'])
+    return info
+
+def visible_job(job_id):
+    """The job if the current user may see it (its owner, or any admin)."""
+    job = report_jobs.get(job_id)
+    if job is None or (job['owner_id'] != session['user_id'] and session['role'] != 'admin'):
+        return None
+    return job
+
+@app.route('/api/reports/<job_id>')
+def report_status(job_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return {'status': 'error', 'message': 'Unauthorized'}, 403
+    job = visible_job(job_id)
+    if job is None:
+        return {'status': 'error', 'message': 'Reporte no encontrado'}, 404
+    if job['state'] == 'queued':
+        # The worker that queued it may have restarted; any worker can start it
+        report_jobs.dispatch()
+        job = report_jobs.get(job_id)
+    return {'status': 'success', 'job': job_info(job)}
+
+@app.route('/api/reports/<job_id>/download')
+def report_download(job_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
+        return redirect(url_for('login'))
+    job = visible_job(job_id)
+    if job is None or job['state'] != 'done' or not os.path.exists(job['file_path']):
+        return "Reporte no disponible", 404
+    return send_file(job['file_path'], mimetype=job['mimetype'], download_name=job['filename'])
 
 @app.route('/api/logs/export')
 def export_logs():
     if 'user_id' not in session or session['role'] not in ['admin', 'supervisor']:
         return redirect(url_for('login'))
         
-    # Reuse Search Logic (Clean Code Refactoring would be better, but duplication is acceptable for now)
-    username = request.args.get('username', '')
-    action_type = request.args.get('action_type', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
-    
-    query = """
-        SELECT logs.id, users.username, logs.type, logs.timestamp
-        FROM logs 
-        JOIN users ON logs.user_id = users.id 
-        WHERE 1=1
-    """
-    params = []
-    
-    if username:
-        query += " AND users.username LIKE %s"
-        params.append(f"%{username}%")
-    if action_type:
-        query += " AND logs.type = %s"
-        params.append(action_type)
-    if date_from:
-        query += " AND DATE(logs.timestamp) >= %s"
-        params.append(date_from)
-    if date_to:
-        query += " AND DATE(logs.timestamp) <= %s"
-        params.append(date_to)
-        
-    query += " ORDER BY logs.timestamp DESC"
-    
-    db = get_db()
-    with db.cursor() as cursor:
-        cursor.execute(query, tuple(params))
-        logs = cursor.fetchall()
-        
-    # Generate CSV
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['ID', 'Usuario', 'Tipo Accion', 'Fecha y Hora'])
+    # Reuse Search Logic
+    filters = log_filters(request.args)
+    try:
+        where, params = build_log_where(filters)
+    except ValueError as e:
+        return str(e), 400
+
+    fmt = request.args.get('format', 'csv')
+    if fmt != 'csv':
+        # Columnar (Parquet / npz) for analytics: written whole, then sent
+        columnar = resolve_format(fmt)
+        if columnar not in available_formats():
+            return f"Formato no disponible: {fmt} (disponibles: csv, {', '.join(available_formats())})", 400
+        f = (report_cache.open(report_key(filters, columnar, where, params), columnar)
+             or export_columnar(where, params, filters, columnar))
+        return send_report(f, COLUMNAR_MIMETYPES[columnar], f'registros_acceso.{columnar}', as_attachment=True)
+
+    cached = report_cache.open(report_key(filters, 'csv', where, params), 'csv')
+    if cached:
+        return send_report(cached, 'text/csv', 'registros_acceso.csv', as_attachment=True)
     
-    for log in logs:
-        cw.writerow([log['id'], log['username'], log['type'], log['timestamp']])
-        
-    output = make_response(si.getvalue())
+    # Rows are read from an unbuffered cursor and sent as they are encoded
+    # (chunked transfer), so a year-long export never sits in worker memory
+    output = Response(stream_with_context(stream_logs_csv(where, params, filters=filters)), mimetype='text/csv')
     output.headers["Content-Disposition"] = "attachment; filename=registros_acceso.csv"
-    output.headers["Content-type"] = "text/csv"
+    output.headers["X-Accel-Buffering"] = "no"
     return output
 
 if __name__ == '__main__':
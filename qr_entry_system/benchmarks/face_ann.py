@@ -0,0 +1,69 @@
+"""Recall and latency of the IVF face index against exact search.
+
+Synthetic descriptors: every identity is a random point, and queries are
+that identity plus capture noise, which is how repeated face-api.js
+captures of one person behave.
+
+Run from the project folder:  python -m benchmarks.face_ann [N]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from descriptors import DESCRIPTOR_SIZE
+from face_ann import ExactBackend, IVFBackend
+from face_index import FaceIndex
+
+QUERIES = 1000
+NOISE = 0.025
+
+
+def synthetic(n, rng):
+    # Roughly the spread of real descriptors: components around +-0.1
+    identities = rng.normal(0, 0.1, size=(n, DESCRIPTOR_SIZE)).astype(np.float32)
+    picked = rng.choice(n, QUERIES, replace=False)
+    queries = identities[picked] + rng.normal(0, NOISE, size=(QUERIES, DESCRIPTOR_SIZE)).astype(np.float32)
+    return identities, queries
+
+
+def run(index, queries):
+    latencies, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        match = index.nearest(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(match[0])
+    return np.array(found), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(7)
+    identities, queries = synthetic(n, rng)
+    rows = [(i, f'user{i}', v) for i, v in enumerate(identities)]
+
+    exact = FaceIndex(ExactBackend())
+    exact.load(rows)
+    truth, p50, p99 = run(exact, queries)
+    print(f"N={n}  queries={QUERIES}")
+    print(f"{'backend':<16} {'recall@1':>9} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    print(f"{'exact':<16} {1.0:>9.3f} {p50:>8.3f} {p99:>8.3f} {'-':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'face_index.npz')
+        for nprobe in (4, 8, 12, 24):
+            index = FaceIndex(IVFBackend(nprobe=nprobe, min_size=0, path=path))
+            start = time.perf_counter()
+            index.load(rows)
+            build = time.perf_counter() - start
+            found, p50, p99 = run(index, queries)
+            recall = float(np.mean(found == truth))
+            # Only the first build trains; later ones reuse the centroids saved on disk
+            print(f"{f'ivf nprobe={nprobe}':<16} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f} {build:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Face uniqueness check: pure-Python loop vs. the FaceIndex matrix.
+
+Run from the project folder:  python -m benchmarks.face_matrix
+"""
+import json
+import math
+import time
+
+import numpy as np
+
+from descriptors import DESCRIPTOR_SIZE
+from face_ann import ExactBackend
+from face_index import FaceIndex
+
+SIZES = [1000, 10000, 100000]
+QUERIES = 20
+
+
+def legacy_check(rows, new_desc):
+    # The loop update_user used to run: json.loads + math.sqrt(sum(...)) per row
+    for username, stored in rows:
+        stored_desc = json.loads(stored)
+        distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(new_desc, stored_desc)))
+        if distance < 0.5:
+            return username
+    return None
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    rng = np.random.default_rng(42)
+    print(f"{'N':>8} {'legacy ms':>12} {'matrix ms':>12} {'load ms':>10}")
+    for n in SIZES:
+        vectors = rng.normal(0, 0.1, size=(n, DESCRIPTOR_SIZE)).astype(np.float32)
+        query = rng.normal(0, 0.1, size=DESCRIPTOR_SIZE).astype(np.float32)
+
+        rows = [(f'user{i}', json.dumps(v.tolist())) for i, v in enumerate(vectors)]
+        legacy_ms = timed(lambda: legacy_check(rows, query.tolist()), 1)
+
+        # The exact matrix: the default IVF backend would train (and overwrite the app's index file)
+        index = FaceIndex(ExactBackend())
+        start = time.perf_counter()
+        index.load((i, f'user{i}', v) for i, v in enumerate(vectors))
+        load_ms = (time.perf_counter() - start) * 1000
+        matrix_ms = timed(lambda: index.find_duplicate(query), QUERIES)
+
+        print(f"{n:>8} {legacy_ms:>12.2f} {matrix_ms:>12.3f} {load_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""HTTP load driver: throughput and latency of the main endpoints, as JSON.
+
+Each scenario runs for DURATION seconds with CONCURRENCY threads, one
+logged-in session per thread, against a running app (flask run, gunicorn
+or docker compose) loaded with benchmarks.seed:
+
+  log_scan     POST /api/log_scan for a random seed employee and action
+  search       GET /api/logs/search, first page, random filters
+  export       GET /api/logs/export (CSV) of EXPORT_DAYS, body read to the end
+  export_pdf   POST /api/logs/export_pdf for one employee's month, polled
+               until the PDF is ready and downloaded (one request = all of it)
+  faces        GET /api/users/faces?format=binary (full descriptor feed)
+
+Prints (or writes to --output) one JSON document: per scenario the
+requests, errors, requests per second, HTTP status counts and p50/p95/p99
+latency in milliseconds, so runs of different releases can be diffed.
+
+Run from the project folder:
+    python -m benchmarks.load --url http://127.0.0.1:5000 --concurrency 16 --duration 30
+    python -m benchmarks.load --scenarios log_scan,search --label v1.4 --output load.json
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import requests
+import urllib3
+
+from benchmarks.seed import ADMIN, PASSWORD, PREFIX
+from jobs import DONE, FAILED
+from scans import VALID_ACTIONS
+
+URL = 'http://127.0.0.1:5000'
+CONCURRENCY = 8
+DURATION = 30
+EXPORT_DAYS = 7
+# Days back the random search and export ranges fall in
+HISTORY_DAYS = 90
+PDF_TIMEOUT = 300
+PDF_POLL = 0.25
+
+
+class LoadError(Exception):
+    """The app answered, but not with what the scenario expects."""
+
+
+def login(url, username, password, verify):
+    session = requests.Session()
+    session.verify = verify
+    try:
+        response = session.post(f'{url}/login', data={'username': username, 'password': password})
+    except requests.ConnectionError:
+        raise SystemExit(f"No app answering at {url}")
+    # A failed login renders the form again instead of redirecting
+    if response.status_code != 200 or response.url.rstrip('/').endswith('/login'):
+        raise SystemExit(f"Login as {username} failed at {url}")
+    return session
+
+
+def date_range(rng, days):
+    end = date.today() - timedelta(days=rng.randint(0, max(HISTORY_DAYS - days, 0)))
+    return {'date_from': (end - timedelta(days=days - 1)).isoformat(), 'date_to': end.isoformat()}
+
+
+def expect_json(response):
+    if response.status_code >= 400:
+        return response
+    if response.json().get('status') != 'success':
+        raise LoadError(response.json().get('message'))
+    return response
+
+
+def log_scan(session, url, rng, ctx):
+    return expect_json(session.post(f'{url}/api/log_scan', json={
+        'username': rng.choice(ctx['usernames']), 'action_type': rng.choice(VALID_ACTIONS),
+        'idempotency_key': f'load-{uuid.uuid4().hex}'}))
+
+
+def search(session, url, rng, ctx):
+    params = date_range(rng, rng.choice((1, 7, 30)))
+    if rng.random() < 0.5:
+        params['username'] = rng.choice(ctx['usernames'])
+    if rng.random() < 0.3:
+        params['action_type'] = rng.choice(VALID_ACTIONS)
+    return expect_json(session.get(f'{url}/api/logs/search', params=params))
+
+
+def export(session, url, rng, ctx):
+    with session.get(f'{url}/api/logs/export', params=date_range(rng, EXPORT_DAYS), stream=True) as response:
+        for _ in response.iter_content(65536):
+            pass
+    return response
+
+
+def export_pdf(session, url, rng, ctx):
+    params = dict(date_range(rng, 30), username=rng.choice(ctx['usernames']))
+    response = expect_json(session.post(f'{url}/api/logs/export_pdf', data=params))
+    if response.status_code >= 400:
+        return response
+    job = response.json()['job']
+    deadline = time.monotonic() + PDF_TIMEOUT
+    while job['state'] not in (DONE, FAILED):
+        if time.monotonic() > deadline:
+            raise LoadError('PDF timeout')
+        time.sleep(PDF_POLL)
+        response = expect_json(session.get(f"{url}{job['status_url']}"))
+        if response.status_code >= 400:
+            return response
+        job = response.json()['job']
+    if job['state'] == FAILED:
+        raise LoadError(job['error'])
+    response = session.get(f"{url}{job['download_url']}")
+    response.content  # the whole PDF, like a browser download
+    return response
+
+
+def faces(session, url, rng, ctx):
+    return session.get(f'{url}/api/users/faces', params={'format': 'binary'})
+
+
+SCENARIOS = {'log_scan': log_scan, 'search': search, 'export': export, 'export_pdf': export_pdf, 'faces': faces}
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run_scenario(name, sessions, url, duration, ctx, seed):
+    latencies = [[] for _ in sessions]
+    statuses = [Counter() for _ in sessions]
+    errors = [0] * len(sessions)
+    deadline = time.perf_counter() + duration
+
+    def worker(n):
+        rng = random.Random(f'{seed}-{name}-{n}')
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = SCENARIOS[name](sessions[n], url, rng, ctx).status_code
+            except (requests.RequestException, LoadError, ValueError):
+                status = 'failed'
+            latencies[n].append((time.perf_counter() - started) * 1000)
+            statuses[n][str(status)] += 1
+            if status == 'failed' or status >= 400:
+                errors[n] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(len(sessions))]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(ms for thread in latencies for ms in thread)
+    return {
+        'requests': len(ordered),
+        'errors': sum(errors),
+        'seconds': round(elapsed, 2),
+        'throughput_rps': round(len(ordered) / elapsed, 2),
+        'status_codes': dict(sum(statuses, Counter())),
+        'latency_ms': {
+            'mean': round(sum(ordered) / len(ordered), 2) if ordered else None,
+            **{f'p{p}': round(percentile(ordered, p), 2) if ordered else None for p in (50, 95, 99)},
+            'max': round(ordered[-1], 2) if ordered else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=URL)
+    parser.add_argument('--username', default=ADMIN)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated, run in this order')
+    parser.add_argument('--label', default='', help='release or commit the run is for, copied to the output')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--insecure', action='store_true', help='accept self-signed certificates (ssl_context=adhoc)')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}")
+    url = args.url.rstrip('/')
+    if args.insecure:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    sessions = [login(url, args.username, args.password, not args.insecure) for _ in range(args.concurrency)]
+    users = sessions[0].get(f'{url}/api/users').json().get('users', [])
+    usernames = [u['username'] for u in users if u['username'].startswith(PREFIX) and u['role'] == 'employee']
+    if not usernames:
+        raise SystemExit("No seed employees found: run `python -m benchmarks.seed` first.")
+    ctx = {'usernames': usernames}
+
+    report = {
+        'label': args.label,
+        'url': url,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'seed_users': len(usernames),
+        'python': platform.python_version(),
+        'scenarios': {},
+    }
+    for name in names:
+        print(f"{name}...", file=sys.stderr)
+        report['scenarios'][name] = run_scenario(name, sessions, url, args.duration, ctx, args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Payroll summary: the old nested-loop pairing vs. the payroll module.
+
+Run from the project folder:  python -m benchmarks.payroll
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from payroll import payroll_summary
+
+USERS = 1000
+DAYS = 250          # x 4 logs per working day = 1M logs
+WORST_CASE = [2000, 5000, 10000]
+
+
+def legacy_summary(logs):
+    # The loop export_logs_pdf used to run: each entry scans forward for its exit
+    user_logs = {}
+    for log in logs:
+        user_logs.setdefault(log['username'], []).append(log)
+    summary = {}
+    for username, u_logs in user_logs.items():
+        sorted_logs = sorted(u_logs, key=lambda x: x['timestamp'])
+        total_hours = 0
+        i = 0
+        while i < len(sorted_logs):
+            if sorted_logs[i]['type'] == 'entry':
+                next_log = None
+                for j in range(i + 1, len(sorted_logs)):
+                    if sorted_logs[j]['type'] == 'exit':
+                        next_log = sorted_logs[j]
+                        i = j
+                        break
+                if next_log:
+                    total_hours += (next_log['timestamp'] - sorted_logs[i]['timestamp']).total_seconds() / 3600
+            i += 1
+        summary[username] = total_hours
+    return summary
+
+
+def workday_logs(users, days, seed=7):
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    logs = []
+    for day in range(days):
+        base = start + timedelta(days=day)
+        for u in range(users):
+            entry = base + timedelta(hours=7, minutes=rng.randint(0, 90))
+            lunch = entry + timedelta(hours=4, minutes=rng.randint(0, 60))
+            logs.append({'username': f'user{u}', 'type': 'entry', 'timestamp': entry})
+            logs.append({'username': f'user{u}', 'type': 'start_lunch', 'timestamp': lunch})
+            logs.append({'username': f'user{u}', 'type': 'end_lunch', 'timestamp': lunch + timedelta(hours=1)})
+            logs.append({'username': f'user{u}', 'type': 'exit', 'timestamp': lunch + timedelta(hours=5)})
+    # Same order as the report query
+    logs.reverse()
+    return logs
+
+
+def entries_without_exits(n):
+    # An employee who never scanned out: every legacy entry scans to the end
+    start = datetime(2024, 1, 1, 8)
+    return [{'username': 'olvidadizo', 'type': 'entry', 'timestamp': start + timedelta(hours=i)}
+            for i in range(n)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    logs = workday_logs(USERS, DAYS)
+    print(f"{len(logs)} logs, {USERS} users, {DAYS} days")
+    print(f"  legacy  {timed(lambda: legacy_summary(logs)):>10.0f} ms")
+    print(f"  payroll {timed(lambda: payroll_summary(logs)):>10.0f} ms")
+
+    print(f"\n{'worst case N':>12} {'legacy ms':>12} {'payroll ms':>12}")
+    for n in WORST_CASE:
+        logs = entries_without_exits(n)
+        print(f"{n:>12} {timed(lambda: legacy_summary(logs)):>12.1f} {timed(lambda: payroll_summary(logs)):>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""QR resolution on the scan path: qr_code_data lookup vs. signed tokens.
+
+Always measures in-memory token verification. With a MySQL server (DB_*
+settings) it also times resolving scans against a temporary copy of the
+users table: the old lookup by qr_code_data, without and with the index
+added in migration 0007, and the signed token verified in memory followed
+by the primary key read log_scan still does for the username.
+
+Run from the project folder:  python -m benchmarks.qr_tokens [USERS]
+"""
+import random
+import sys
+import time
+
+import pymysql
+
+from db import DB_CONFIG
+from qr_tokens import QRTokens
+
+USERS = 5000
+SCANS = 5000
+
+
+def per_second(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def mysql_rates(conn, tokens, legacy, signed, scans):
+    rng = random.Random(3)
+    picks = [rng.randrange(len(legacy)) for _ in range(scans)]
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE bench_users ("
+            "  id int NOT NULL PRIMARY KEY, username varchar(50) NOT NULL, qr_code_data varchar(255) NOT NULL)")
+        cursor.executemany("INSERT INTO bench_users VALUES (%s, %s, %s)",
+                           [(i + 1, f'user{i}', code) for i, code in enumerate(legacy)])
+        conn.commit()
+
+        def by_code(i):
+            cursor.execute("SELECT id, username FROM bench_users WHERE qr_code_data = %s", (legacy[i],))
+            cursor.fetchone()
+
+        def by_token(i):
+            user_id = tokens.verify(signed[i])[0]
+            cursor.execute("SELECT id, username FROM bench_users WHERE id = %s", (user_id,))
+            cursor.fetchone()
+
+        # The unindexed scan is slow: a tenth of the scans is plenty
+        rates = {'qr_code_data, no index': per_second(by_code, picks[:max(1, scans // 10)])}
+        cursor.execute("CREATE UNIQUE INDEX bench_qr ON bench_users (qr_code_data)")
+        rates['qr_code_data, unique index'] = per_second(by_code, picks)
+        rates['signed token + PK read'] = per_second(by_token, picks)
+        cursor.execute("DROP TEMPORARY TABLE bench_users")
+    return rates
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else USERS
+    tokens = QRTokens('k1', {'k1': b'benchmark-secret'})
+    legacy = [f'user:user{i}:{random.getrandbits(32):08x}' for i in range(users)]
+    signed = [tokens.issue(i + 1) for i in range(users)]
+
+    print(f"{users} users, {SCANS} scans")
+    print(f"  {'verify in memory':<28} {per_second(tokens.verify, signed[:SCANS] * 10):>10.0f} scans/s")
+    try:
+        conn = pymysql.connect(**DB_CONFIG)
+    except pymysql.MySQLError as e:
+        print(f"  (MySQL not available, skipping lookups: {e})")
+        return
+    try:
+        for label, rate in mysql_rates(conn, tokens, legacy, signed, SCANS).items():
+            print(f"  {label:<28} {rate:>10.0f} scans/s")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
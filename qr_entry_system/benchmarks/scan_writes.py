@@ -0,0 +1,121 @@
+"""Sustained scan inserts per second: direct commits vs. the write-behind journal.
+
+THREADS concurrent scanners record scans for SECONDS in each mode:
+
+  direct   record_scan + commit per scan (what log_scan does by default)
+  journal  scan_journal append (fsync'd), flushed to logs in batches; the
+           rate counts the scans committed to MySQL, including the final drain
+
+Without a MySQL server only the journal's own acknowledgement rate is
+measured. Each thread scans its own throwaway user; the users are deleted
+afterwards with their logs.
+
+Run from the project folder:  python -m benchmarks.scan_writes [THREADS] [SECONDS]
+"""
+import sys
+import tempfile
+import threading
+import time
+
+import pymysql
+
+import scans
+from db import DB_CONFIG, pool
+from scan_journal import ScanJournal, write_records
+from scans import record_scan
+
+THREADS = 16
+SECONDS = 10
+BENCH_USER = 'bench_scan_writes'
+ACTIONS = ('entry', 'start_lunch', 'end_lunch', 'exit')
+
+
+def run_for(seconds, threads, scan):
+    """Call scan(thread, i) from `threads` threads for `seconds`; returns the number of calls."""
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(n):
+        i = 0
+        while time.perf_counter() < deadline:
+            scan(n, i)
+            i += 1
+        counts[n] = i
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts)
+
+
+def direct_scan(user_ids):
+    def scan(n, i):
+        conn = pool.acquire()
+        try:
+            with conn.cursor() as cursor:
+                record_scan(cursor, user_ids[n], ACTIONS[i % 4])
+            conn.commit()
+        finally:
+            pool.release(conn)
+    return scan
+
+
+def journal_rate(threads, seconds, user_ids, write):
+    with tempfile.TemporaryDirectory() as directory:
+        journal = ScanJournal(directory, write=write)
+        start = time.perf_counter()
+        acked = run_for(seconds, threads, lambda n, i: journal.append(user_ids[n], ACTIONS[i % 4]))
+        acked_in = time.perf_counter() - start
+        journal.close()
+        total = time.perf_counter() - start
+        stats = journal.stats()
+    return acked / acked_in, stats['flushed'] / total, stats
+
+
+def main():
+    # Every scan counts: the benchmark repeats actions faster than any real person
+    scans.DEBOUNCE_SECONDS = 0
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else THREADS
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else SECONDS
+    print(f"{threads} threads, {seconds:.0f} s per mode")
+
+    try:
+        conn = pymysql.connect(**DB_CONFIG)
+    except pymysql.MySQLError as e:
+        print(f"  (MySQL not available, journal only: {e})")
+        acked, _, stats = journal_rate(threads, seconds, range(threads), lambda records: len(records))
+        print(f"  {'journal acks':<16} {acked:>10.0f} scans/s  ({stats['fsyncs']} fsyncs for {stats['appended']} scans)")
+        return
+
+    pool.max_size = threads
+    try:
+        user_ids = []
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE logs FROM logs JOIN users ON users.id = logs.user_id "
+                           "WHERE users.username LIKE %s", (BENCH_USER + '%',))
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (BENCH_USER + '%',))
+            for n in range(threads):
+                cursor.execute("INSERT INTO users (username, role, qr_code_data) VALUES (%s, 'employee', %s)",
+                               (f'{BENCH_USER}{n}', f'bench:{BENCH_USER}{n}'))
+                user_ids.append(cursor.lastrowid)
+        conn.commit()
+
+        direct = run_for(seconds, threads, direct_scan(user_ids)) / seconds
+        print(f"  {'direct':<16} {direct:>10.0f} inserts/s")
+        acked, committed, stats = journal_rate(threads, seconds, user_ids, write_records)
+        print(f"  {'journal':<16} {committed:>10.0f} inserts/s  (acks {acked:.0f}/s, "
+              f"{stats['batches']} transactions, {stats['fsyncs']} journal fsyncs)")
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE logs FROM logs JOIN users ON users.id = logs.user_id "
+                           "WHERE users.username LIKE %s", (BENCH_USER + '%',))
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (BENCH_USER + '%',))
+        conn.commit()
+        conn.close()
+        pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Bulk-load a realistic dataset for the load tests (benchmarks.load).
+
+Creates USERS employees (seed_00001, ...) with signed QR codes, areas and,
+for most of them, a face descriptor, plus DAYS of shift-pattern logs up to
+yesterday: morning, day, afternoon and night shifts (crossing midnight),
+lunch breaks, a few absences and the odd forgotten exit. 5000 users over
+1000 days is about 20M logs. Also creates the seed_admin account the load
+driver logs in with, then fills work_days and user_status for the new
+users.
+
+Logs go in with multi-row INSERTs of CHUNK rows, or with LOAD DATA LOCAL
+INFILE (--infile, the server must allow local_infile). Run against a
+database created by setup_db.py (or migrate.py):
+
+    python -m benchmarks.seed --users 5000 --days 1000
+    python -m benchmarks.seed --clean        # remove the seed users and their logs
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pymysql
+from werkzeug.security import generate_password_hash
+
+import migrate
+from db import DB_CONFIG
+from descriptors import DESCRIPTOR_SIZE
+from qr_tokens import qr_tokens
+from rebuild_work_days import rebuild
+from report_cache import report_cache
+from user_cache import record_user_change
+
+USERS = 500
+DAYS = 90
+CHUNK = 20000
+PREFIX = 'seed_'
+ADMIN = 'seed_admin'
+PASSWORD = 'seed'
+AREAS = ['Producción', 'Bodega', 'Despachos', 'Mantenimiento', 'Calidad', 'Oficina', 'Seguridad']
+# Shift start (hour) and length with lunch (hours); night shifts end the next day
+SHIFTS = [(6, 9), (8, 9), (14, 9), (22, 8)]
+FACE_SHARE = 0.8
+ABSENCE = 0.04
+NO_LUNCH = 0.1
+FORGOT_EXIT = 0.01
+
+
+def jitter(rng, minutes):
+    return timedelta(seconds=int(rng.gauss(0, minutes * 60)))
+
+
+def shift_logs(rng, user_id, shift, day):
+    """The scans of one user on one working day, in time order."""
+    hour, length = shift
+    entry = datetime.combine(day, datetime.min.time()) + timedelta(hours=hour) + jitter(rng, 8)
+    logs = [(user_id, 'entry', entry)]
+    # Night shifts take no lunch break
+    if hour < 20 and rng.random() >= NO_LUNCH:
+        lunch = entry + timedelta(hours=4) + jitter(rng, 20)
+        logs.append((user_id, 'start_lunch', lunch))
+        logs.append((user_id, 'end_lunch', lunch + timedelta(minutes=rng.choice((30, 45, 60))) + jitter(rng, 3)))
+    if rng.random() >= FORGOT_EXIT:
+        logs.append((user_id, 'exit', entry + timedelta(hours=length) + jitter(rng, 10)))
+    return logs
+
+
+def generate_logs(rng, users, first_day, days):
+    """(user_id, type, timestamp) rows, day by day like the live table fills up."""
+    now = datetime.now()
+    for d in range(days):
+        day = first_day + timedelta(days=d)
+        for user_id, shift, weekdays in users:
+            if day.weekday() < weekdays and rng.random() >= ABSENCE:
+                # Last night's shift may not be over yet
+                yield from (log for log in shift_logs(rng, user_id, shift, day) if log[2] <= now)
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert_users(conn, rng, count, password_hash):
+    """Create the admin and `count` employees; returns [(id, shift, working weekdays)]."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM users")
+        first_id = cursor.fetchone()['id'] + 1
+        # Explicit ids: the signed QR code embeds the id
+        admin = (first_id, ADMIN, password_hash, 'admin', None, None, qr_tokens.issue(first_id), None)
+        rows, users = [admin], []
+        for n in range(1, count + 1):
+            user_id = first_id + n
+            face = None
+            if rng.random() < FACE_SHARE:
+                face = np.asarray([rng.gauss(0, 0.09) for _ in range(DESCRIPTOR_SIZE)], dtype='<f4').tobytes()
+            rows.append((user_id, f'{PREFIX}{n:05d}', password_hash, 'employee', f'9{n:09d}',
+                         rng.choice(AREAS), qr_tokens.issue(user_id), face))
+            users.append((user_id, rng.choice(SHIFTS), rng.choice((5, 6))))
+        for chunk in chunks(rows, 1000):
+            cursor.executemany(
+                "INSERT INTO users (id, username, password_hash, role, cedula, area, qr_code_data, face_vector) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", chunk)
+        cursor.executemany("INSERT INTO face_changes (user_id, deleted) VALUES (%s, 0)",
+                           [(r[0],) for r in rows if r[7] is not None])
+        record_user_change(cursor)
+    conn.commit()
+    return users
+
+
+def insert_logs(conn, rows, infile=False):
+    """Load rows (CHUNK per statement and transaction); returns (rows, last scan per user)."""
+    total, last = 0, {}
+    with conn.cursor() as cursor:
+        for chunk in chunks(rows, CHUNK):
+            for user_id, action_type, ts in chunk:
+                last[user_id] = (action_type, ts)
+            if infile:
+                with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+                    csv.writer(f).writerows(chunk)
+                try:
+                    cursor.execute(
+                        "LOAD DATA LOCAL INFILE %s INTO TABLE logs FIELDS TERMINATED BY ',' "
+                        "OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\r\\n' (user_id, type, timestamp)",
+                        (f.name,))
+                finally:
+                    os.remove(f.name)
+            else:
+                cursor.executemany("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)", chunk)
+            conn.commit()
+            total += len(chunk)
+            if total % (CHUNK * 50) == 0:
+                print(f"  {total} logs")
+    return total, last
+
+
+def insert_status(conn, last):
+    states = {'entry': 'in', 'end_lunch': 'in', 'start_lunch': 'lunch', 'exit': 'out'}
+    with conn.cursor() as cursor:
+        for chunk in chunks(sorted(last.items()), 1000):
+            cursor.executemany(
+                "INSERT INTO user_status (user_id, state, last_action, last_at) VALUES (%s, %s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE state = VALUES(state), last_action = VALUES(last_action), "
+                "last_at = VALUES(last_at)",
+                [(user_id, states[action], action, ts) for user_id, (action, ts) in chunk])
+    conn.commit()
+
+
+def clean(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE username LIKE %s OR username = %s",
+                       (PREFIX.replace('_', '\\_') + '%', ADMIN))
+        user_ids = [r['id'] for r in cursor.fetchall()]
+    for chunk in chunks(user_ids, 50):
+        with conn.cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(chunk))
+            # Logs in batches of 50k rows: short transactions keep the undo log small
+            while cursor.execute(f"DELETE FROM logs WHERE user_id IN ({placeholders}) LIMIT 50000", chunk):
+                conn.commit()
+            cursor.execute(f"DELETE FROM users WHERE id IN ({placeholders})", chunk)
+            cursor.executemany("INSERT INTO face_changes (user_id, deleted) VALUES (%s, 1)", [(u,) for u in chunk])
+            record_user_change(cursor)
+        conn.commit()
+    report_cache.clear()
+    return len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=USERS)
+    parser.add_argument('--days', type=int, default=DAYS)
+    parser.add_argument('--seed', type=int, default=7, help='random seed (same seed, same data)')
+    parser.add_argument('--password', default=PASSWORD, help='password of every seed account')
+    parser.add_argument('--infile', action='store_true', help='load logs with LOAD DATA LOCAL INFILE')
+    parser.add_argument('--skip-rollup', action='store_true', help='do not fill work_days (rebuild_work_days.py later)')
+    parser.add_argument('--clean', action='store_true', help='remove the seed users and their logs, then exit')
+    args = parser.parse_args()
+
+    try:
+        conn = pymysql.connect(**DB_CONFIG, local_infile=args.infile)
+    except pymysql.err.OperationalError as e:
+        raise SystemExit(f"Cannot connect to MySQL: {e}")
+    try:
+        migrate.run(conn, verbose=False)
+        if args.clean:
+            print(f"Removed {clean(conn)} seed user(s).")
+            return
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS n FROM users WHERE username = %s", (ADMIN,))
+            if cursor.fetchone()['n']:
+                raise SystemExit("Seed data already loaded: run with --clean first.")
+
+        rng = random.Random(args.seed)
+        started = time.perf_counter()
+        # One hash for every account: werkzeug's hashing is deliberately slow
+        users = insert_users(conn, rng, args.users, generate_password_hash(args.password))
+        print(f"{len(users)} users in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        first_day = date.today() - timedelta(days=args.days)
+        total, last = insert_logs(conn, generate_logs(rng, users, first_day, args.days), args.infile)
+        elapsed = time.perf_counter() - started
+        print(f"{total} logs in {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f}/s)")
+        insert_status(conn, last)
+
+        if not args.skip_rollup:
+            started = time.perf_counter()
+            days = sum(rebuild(conn, user_id) for user_id, _, _ in users)
+            print(f"{days} work day(s) in {time.perf_counter() - started:.1f} s")
+        report_cache.clear()
+        print(f"Log in as {ADMIN} / {args.password} to run benchmarks.load.")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from werkzeug.security import generate_password_hash
 from db import get_db, close_db
+from qr_tokens import qr_tokens
 from flask import Flask
 import secrets
 
@@ -13,7 +14,7 @@ def create_admin():
         username = 'admin'
         password = 'admin123'  # Default password
         role = 'admin'
-        qr_data = f"user:{username}:{secrets.token_hex(4)}"
+        qr_data = f"pending:{secrets.token_hex(16)}"
 
         try:
             with db.cursor() as cursor:
@@ -21,6 +22,8 @@ def create_admin():
                     "INSERT INTO users (username, password_hash, role, qr_code_data) VALUES (%s, %s, %s, %s)",
                     (username, generate_password_hash(password), role, qr_data)
                 )
+                cursor.execute("UPDATE users SET qr_code_data = %s WHERE id = %s",
+                               (qr_tokens.issue(cursor.lastrowid), cursor.lastrowid))
             db.commit()
             print(f"Admin user created successfully.\nUsername: {username}\nPassword: {password}")
         except Exception as e:
@@ -1,7 +1,12 @@
 import pymysql
 import pymysql.cursors
+import logging
 import os
-from flask import g
+import re
+import threading
+import time
+from collections import deque
+from flask import g, has_request_context
 
 DB_CONFIG = {
     'host': os.environ.get('DB_HOST', '127.0.0.1'),
@@ -12,12 +17,338 @@ DB_CONFIG = {
     'cursorclass': pymysql.cursors.DictCursor
 }
 
+POOL_CONFIG = {
+    # Connections kept open per worker process even when idle
+    'min_size': int(os.environ.get('DB_POOL_MIN', 1)),
+    'max_size': int(os.environ.get('DB_POOL_MAX', 8)),
+    # Extra connections allowed under bursts, closed as soon as they are returned
+    'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW', 4)),
+    # Seconds to wait for a free connection before giving up
+    'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    # Recycle connections older than this (below MySQL's wait_timeout)
+    'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    # Ping connections that sat idle longer than this before handing them out
+    'ping_after': float(os.environ.get('DB_POOL_PING_AFTER', 5)),
+    # Close connections above min_size after this many idle seconds
+    'idle_timeout': float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+}
+
+
+QUERY_CONFIG = {
+    # Statements slower than this (ms) are logged with their EXPLAIN plan; 0 disables
+    'slow_ms': float(os.environ.get('DB_SLOW_QUERY_MS', 200)),
+    # Statements one request may run; more raises QueryBudgetExceeded (dev and tests). 0 disables
+    'budget': int(os.environ.get('DB_QUERY_BUDGET', 0)),
+    # Distinct statement fingerprints kept in the per-process totals
+    'max_fingerprints': int(os.environ.get('DB_QUERY_FINGERPRINTS', 500)),
+}
+
+slow_log = logging.getLogger('db.slow')
+
+
+class PoolTimeout(pymysql.err.OperationalError):
+    """No connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of pymysql connections.
+
+    One pool per process: after a fork (gunicorn preload) the child drops the
+    inherited connections instead of sharing the parent's sockets.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=8, max_overflow=4,
+                 timeout=10, max_lifetime=1800, ping_after=5, idle_timeout=300):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()          # (conn, created_at, returned_at)
+        self._created_at = {}         # id(conn) -> created_at, for checked out connections
+        self._total = 0
+        self._stats = {'creates': 0, 'closes': 0, 'checkouts': 0, 'waits': 0,
+                       'wait_seconds': 0.0, 'timeouts': 0, 'health_failures': 0, 'recycled': 0}
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _create(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['creates'] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._total -= 1
+            self._stats['closes'] += 1
+            self._cond.notify()
+
+    def _healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if now - returned_at > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                with self._cond:
+                    self._stats['health_failures'] += 1
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                self._check_fork()
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._total < self.max_size + self.max_overflow:
+                        self._total += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(2013, f'No database connection available after {self.timeout}s')
+                    if waited_since is None:
+                        waited_since = time.monotonic()
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                if waited_since is not None:
+                    self._stats['wait_seconds'] += time.monotonic() - waited_since
+                    waited_since = None
+
+            if create:
+                try:
+                    conn, created_at = self._create()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn, created_at, returned_at = entry
+                if not self._healthy(conn, created_at, returned_at):
+                    self._discard(conn)
+                    continue
+
+            with self._cond:
+                self._created_at[id(conn)] = created_at
+                self._stats['checkouts'] += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            created_at = self._created_at.pop(id(conn), None)
+        if created_at is None:
+            return
+        if not discard:
+            try:
+                # Never hand an open transaction to the next request
+                conn.rollback()
+            except Exception:
+                discard = True
+        stale = []
+        with self._cond:
+            overflow = self._total > self.max_size
+            if not discard and not overflow:
+                now = time.monotonic()
+                self._idle.append((conn, created_at, now))
+                self._cond.notify()
+                # Oldest idle connections sit at the left end
+                while (self._idle and self._total - len(stale) > self.min_size
+                       and now - self._idle[0][2] > self.idle_timeout):
+                    stale.append(self._idle.popleft()[0])
+            else:
+                stale.append(conn)
+        for old in stale:
+            self._discard(old)
+
+    def prefill(self):
+        """Open min_size connections up front (e.g. from a gunicorn post_fork hook)."""
+        conns = [self.acquire() for _ in range(max(0, self.min_size - len(self._idle)))]
+        for conn in conns:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            self._check_fork()
+            stats = dict(self._stats)
+            stats.update({
+                'in_use': len(self._created_at),
+                'idle': len(self._idle),
+                'total': self._total,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+            })
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        return stats
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more statements than DB_QUERY_BUDGET (likely an N+1 loop)."""
+
+
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*')
+_SPACE = re.compile(r'\s+')
+_fingerprints = {}
+
+
+def fingerprint(query):
+    """Statement text with literals, placeholders and IN / VALUES lists folded to '?'.
+
+    'SELECT ... WHERE id IN (%s, %s, %s)' and a multi-row INSERT built by
+    executemany share the fingerprint of any other list length.
+    """
+    found = _fingerprints.get(query)
+    if found is None:
+        text = _SPACE.sub(' ', _LITERALS.sub('?', query)).strip()
+        found = _LISTS.sub('(...)', text)
+        if len(_fingerprints) < 4 * QUERY_CONFIG['max_fingerprints']:
+            _fingerprints[query] = found
+    return found
+
+
+class QueryStats:
+    """Per-process totals per statement fingerprint, and the current request's tally."""
+
+    def __init__(self, slow_ms=200, budget=0, max_fingerprints=500):
+        self.slow_ms = slow_ms
+        self.budget = budget
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._totals = {}           # fingerprint -> [count, seconds, max seconds]
+        self.slow = 0
+
+    def record(self, cursor, query, args, seconds):
+        fp = fingerprint(query)
+        with self._lock:
+            total = self._totals.get(fp)
+            if total is None and len(self._totals) < self.max_fingerprints:
+                total = self._totals[fp] = [0, 0.0, 0.0]
+            if total is not None:
+                total[0] += 1
+                total[1] += seconds
+                total[2] = max(total[2], seconds)
+        if self.slow_ms and seconds * 1000 >= self.slow_ms:
+            self.slow += 1
+            slow_log.warning("%.0f ms: %s\n%s", seconds * 1000, fp, explain(cursor, query, args))
+        if has_request_context():
+            tally = g.setdefault('db_queries', {'count': 0, 'seconds': 0.0, 'statements': {}})
+            tally['count'] += 1
+            tally['seconds'] += seconds
+            tally['statements'][fp] = tally['statements'].get(fp, 0) + 1
+            budget = g.get('db_query_budget', self.budget)
+            if budget and tally['count'] > budget:
+                top = sorted(tally['statements'].items(), key=lambda item: -item[1])[:3]
+                raise QueryBudgetExceeded(
+                    f"{tally['count']} statements in one request (budget {budget}); most run: "
+                    + '; '.join(f'{n}x {text}' for text, n in top))
+
+    def request_tally(self):
+        """(statements, seconds) run by the current request so far."""
+        tally = g.get('db_queries') if has_request_context() else None
+        return (tally['count'], tally['seconds']) if tally else (0, 0.0)
+
+    def stats(self, top=20):
+        with self._lock:
+            rows = [(fp, *total) for fp, total in self._totals.items()]
+            slow = self.slow
+        rows.sort(key=lambda r: -r[2])
+        return {
+            'fingerprints': len(rows),
+            'slow': slow,
+            'slow_ms': self.slow_ms,
+            'budget': self.budget,
+            'top': [{'statement': fp, 'count': count, 'total_ms': round(seconds * 1000, 2),
+                     'avg_ms': round(seconds * 1000 / count, 3), 'max_ms': round(longest * 1000, 2)}
+                    for fp, count, seconds, longest in rows[:top]],
+        }
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+            self.slow = 0
+
+
+query_stats = QueryStats(**QUERY_CONFIG)
+
+
+def explain(cursor, query, args):
+    """EXPLAIN plan of a statement, as text lines (best effort)."""
+    if isinstance(cursor, pymysql.cursors.SSCursor) or not re.match(r'\s*(SELECT|UPDATE|DELETE)\b', query, re.I):
+        # An unbuffered result still holds the connection; nothing else to explain
+        return '  (no plan)'
+    try:
+        plain = pymysql.cursors.DictCursor(cursor.connection)
+        plain.execute('EXPLAIN ' + cursor.mogrify(query, args))
+        rows = plain.fetchall()
+    except pymysql.MySQLError as e:
+        return f'  (no plan: {e})'
+    return '\n'.join('  ' + ' '.join(f'{k}={v}' for k, v in row.items() if v is not None) for row in rows)
+
+
+class TimedCursorMixin:
+    """Times every statement into query_stats (executemany goes through execute too)."""
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            query_stats.record(self, query, args, time.perf_counter() - started)
+
+
+class TimedDictCursor(TimedCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+class TimedSSCursor(TimedCursorMixin, pymysql.cursors.SSCursor):
+    """Unbuffered: the time covers sending the statement, not reading the rows."""
+
+
+pool = ConnectionPool(lambda: pymysql.connect(**dict(DB_CONFIG, cursorclass=TimedDictCursor)), **POOL_CONFIG)
+
 def get_db():
     if 'db' not in g:
-        g.db = pymysql.connect(**DB_CONFIG)
+        g.db = pool.acquire()
     return g.db
 
 def close_db(e=None):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # A connection that raised mid-request may be in an unknown state
+        pool.release(db, discard=isinstance(e, pymysql.err.OperationalError))
@@ -0,0 +1,45 @@
+"""Base TestCase for the tests that run against MySQL (skipped without a server)."""
+import unittest
+
+import pymysql
+
+import migrate
+from db import DB_CONFIG
+
+
+class MySQLTestCase(unittest.TestCase):
+    """One connection per class on a migrated schema; the whole class skips without a server."""
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.conn = pymysql.connect(**DB_CONFIG)
+        except pymysql.MySQLError as e:
+            raise unittest.SkipTest(f"MySQL not available: {e}")
+        migrate.run(cls.conn, verbose=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    @classmethod
+    def delete_users(cls, username, prefix=False):
+        """Delete the user named username (all those starting with it if prefix), with their logs and rollup."""
+        pattern = username.replace('\\', '\\\\').replace('%', r'\%').replace('_', r'\_') + ('%' if prefix else '')
+        with cls.conn.cursor() as cursor:
+            for table in ('logs', 'work_days'):
+                cursor.execute(f"DELETE {table} FROM {table} JOIN users ON users.id = {table}.user_id "
+                               f"WHERE users.username LIKE %s", (pattern,))
+            cursor.execute("DELETE FROM users WHERE username LIKE %s", (pattern,))
+        cls.conn.commit()
+
+    @classmethod
+    def create_user(cls, username, qr_code_data):
+        """A fresh employee (any leftover of the same name is deleted first); returns its id."""
+        cls.delete_users(username)
+        with cls.conn.cursor() as cursor:
+            cursor.execute("INSERT INTO users (username, role, qr_code_data) VALUES (%s, %s, %s)",
+                           (username, 'employee', qr_code_data))
+            user_id = cursor.lastrowid
+        cls.conn.commit()
+        return user_id
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+
+# face-api.js produces 128 float32 values per face
+DESCRIPTOR_SIZE = 128
+# users.face_vector: the descriptor packed as little-endian float32 (VARBINARY(512))
+PACKED_SIZE = DESCRIPTOR_SIZE * 4
+
+# While migrate_face_vectors.py runs, a face may still live in the legacy
+# JSON column. Queries select both columns and read them via stored_descriptor().
+FACE_COLUMNS = "face_vector, face_descriptor"
+HAS_FACE = "(face_vector IS NOT NULL OR face_descriptor IS NOT NULL)"
+
+
+def parse_descriptor(value):
+    """Convert a descriptor into a float32 vector.
+
+    Accepts the packed binary column (bytes), JSON text (legacy column and
+    form posts) or a list of floats. Raises ValueError when the value is not
+    a 128-d numeric vector.
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if len(value) != PACKED_SIZE:
+            raise ValueError(f'Descriptor inválido: se esperaban {PACKED_SIZE} bytes')
+        return np.frombuffer(value, dtype='<f4').astype(np.float32)
+    if isinstance(value, str):
+        value = json.loads(value)
+    vector = np.asarray(value, dtype=np.float32)
+    if vector.shape != (DESCRIPTOR_SIZE,):
+        raise ValueError(f'Descriptor inválido: se esperaban {DESCRIPTOR_SIZE} valores')
+    if not np.all(np.isfinite(vector)):
+        raise ValueError('Descriptor inválido: contiene valores no numéricos')
+    return vector
+
+
+def encode_descriptor(value):
+    """Pack a descriptor for the face_vector column."""
+    return parse_descriptor(value).astype('<f4').tobytes()
+
+
+def stored_descriptor(row):
+    """The descriptor of a users row selected with FACE_COLUMNS (binary first)."""
+    if row.get('face_vector') is not None:
+        return row['face_vector']
+    return row.get('face_descriptor')
@@ -0,0 +1,205 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+# Below this many faces a full scan is already a few milliseconds
+MIN_SIZE = int(os.environ.get('FACE_ANN_MIN_SIZE', 20000))
+NPROBE = int(os.environ.get('FACE_ANN_NPROBE', 12))
+INDEX_PATH = os.environ.get('FACE_INDEX_PATH', os.path.join('instance', 'face_index.npz'))
+
+log = logging.getLogger('face_ann')
+
+
+def fingerprint(ids, matrix):
+    """Identify the exact set and order of rows an assignment was computed for."""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def nearest_centroid(data, centroids, norms=None, chunk=20000):
+    if norms is None:
+        norms = np.einsum('ij,ij->i', data, data)
+    c_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assign = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        sq = norms[start:start + chunk, None] - 2.0 * (block @ centroids.T) + c_norms[None, :]
+        assign[start:start + chunk] = np.argmin(sq, axis=1)
+    return assign
+
+
+def kmeans(data, k, iterations=15, sample=50000, seed=0):
+    """Plain Lloyd's k-means on a random sample; returns k x dim centroids."""
+    rng = np.random.default_rng(seed)
+    if len(data) > sample:
+        data = data[rng.choice(len(data), sample, replace=False)]
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    norms = np.einsum('ij,ij->i', data, data)
+    for _ in range(iterations):
+        assign = nearest_centroid(data, centroids, norms)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters with random points so every list gets used
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class ExactBackend:
+    """Brute force over every row; also the fallback while IVF is not trained."""
+
+    name = 'exact'
+
+    def build(self, ids, matrix):
+        pass
+
+    def add(self, pos, vector):
+        pass
+
+    def move(self, src, dst):
+        pass
+
+    def candidates(self, query, size, thorough=False):
+        return None
+
+    def needs_rebuild(self, size):
+        return False
+
+
+class IVFBackend:
+    """Inverted-file index: k-means coarse quantizer over the descriptor matrix.
+
+    Each row is assigned to its nearest centroid and a query only scans the
+    rows of its nprobe closest centroids. The assignment array is aligned with
+    the FaceIndex rows, which reports appends and swap-moves to it.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nprobe=NPROBE, min_size=MIN_SIZE, path=INDEX_PATH):
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.path = path
+        self.centroids = None
+        self.trained_size = 0
+        self._assign = np.empty(0, dtype=np.int32)
+        # Fingerprint of the rows the file on disk describes, and whether
+        # add/move calls have diverged from it since
+        self._saved_fingerprint = None
+        self._dirty = False
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _ensure_capacity(self, size):
+        if len(self._assign) < size:
+            grown = np.empty(max(size, len(self._assign) * 2, 16), dtype=np.int32)
+            grown[:len(self._assign)] = self._assign
+            self._assign = grown
+
+    def build(self, ids, matrix):
+        size = len(matrix)
+        if size < self.min_size:
+            self.centroids = None
+            return
+
+        fp = fingerprint(ids, matrix)
+        if self._saved_fingerprint == fp and not self._dirty:
+            return
+        if self.load() and self._saved_fingerprint == fp:
+            # Another worker already indexed exactly these rows
+            return
+
+        if self.centroids is None or size > 2 * self.trained_size:
+            nlist = int(min(4 * np.sqrt(size), size // 8))
+            self.centroids = kmeans(matrix, nlist)
+            self.trained_size = size
+
+        # Existing centroids stay valid; only the row assignment is recomputed
+        self._ensure_capacity(size)
+        self._assign[:size] = nearest_centroid(matrix, self.centroids)
+        self.save(fp, size)
+
+    def add(self, pos, vector):
+        if not self.trained:
+            return
+        self._ensure_capacity(pos + 1)
+        self._assign[pos] = int(np.argmin(((self.centroids - vector) ** 2).sum(axis=1)))
+        self._dirty = True
+
+    def move(self, src, dst):
+        if self.trained:
+            self._assign[dst] = self._assign[src]
+            self._dirty = True
+
+    def needs_rebuild(self, size):
+        if not self.trained:
+            return size >= self.min_size
+        return size > 2 * self.trained_size
+
+    def candidates(self, query, size, thorough=False):
+        """Row positions to scan for query, or None to scan everything."""
+        if not self.trained or size < self.min_size:
+            return None
+        nprobe = min(self.nprobe * (4 if thorough else 1), len(self.centroids))
+        sq = ((self.centroids - query) ** 2).sum(axis=1)
+        probes = np.argpartition(sq, nprobe - 1)[:nprobe]
+        mask = np.zeros(len(self.centroids), dtype=bool)
+        mask[probes] = True
+        return np.flatnonzero(mask[self._assign[:size]])
+
+    # --- Persistence (shared by every worker so none of them retrains on boot) ---
+
+    def save(self, fp, size):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez(f, centroids=self.centroids, assign=self._assign[:size],
+                         trained_size=self.trained_size, fingerprint=fp)
+            os.replace(tmp, self.path)
+            self._saved_fingerprint = fp
+            self._dirty = False
+        except OSError as e:
+            log.warning("Could not persist face index %s: %s", self.path, e)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path) as data:
+                centroids = data['centroids'].astype(np.float32)
+                assign = data['assign'].astype(np.int32)
+                trained_size = int(data['trained_size'])
+                saved_fingerprint = str(data['fingerprint'])
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Ignoring unreadable face index %s: %s", self.path, e)
+            return False
+        self.centroids = centroids
+        self.trained_size = trained_size
+        self._saved_fingerprint = saved_fingerprint
+        self._assign = np.empty(0, dtype=np.int32)
+        self._ensure_capacity(len(assign))
+        self._assign[:len(assign)] = assign
+        self._dirty = False
+        return True
+
+
+def make_backend(name=None):
+    name = name or os.environ.get('FACE_INDEX_BACKEND', 'ivf')
+    if name == 'exact':
+        return ExactBackend()
+    if name == 'ivf':
+        return IVFBackend()
+    raise ValueError(f'Unknown face index backend: {name}')
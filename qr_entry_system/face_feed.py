@@ -0,0 +1,120 @@
+import struct
+
+import numpy as np
+
+from descriptors import DESCRIPTOR_SIZE, FACE_COLUMNS, HAS_FACE
+
+# Binary feed header: magic, format, dimension, feed version, full flag,
+# number of faces, number of removed ids. Followed by the face ids (int32),
+# removed ids (int32), the descriptors (float32, row-major) and the
+# usernames, each as its UTF-8 length (uint16) and bytes, so any character
+# in a username is safe. Everything little-endian.
+BINARY_MAGIC = b'FACE'
+BINARY_FORMAT = 2
+HEADER = struct.Struct('<4sHHQBII')
+LABEL_LENGTH = struct.Struct('<H')
+# Versions are AUTO_INCREMENT ids, assigned at insert and not at commit: a
+# lower version can become visible after a higher one. Readers re-read this
+# many versions back and apply the changes idempotently (as qr_tokens does).
+SYNC_OVERLAP = 32
+
+
+def record_face_change(cursor, user_id, deleted=False):
+    """Bump the descriptor feed version for user_id (same transaction as the change)."""
+    cursor.execute(
+        "INSERT INTO face_changes (user_id, deleted) VALUES (%s, %s)",
+        (user_id, 1 if deleted else 0)
+    )
+
+
+def current_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM face_changes")
+    return int(cursor.fetchone()['version'])
+
+
+def feed_state(cursor):
+    """(version, changes in the last SYNC_OVERLAP versions): moves when a late commit lands too."""
+    cursor.execute(
+        "SELECT COALESCE(MAX(version), 0) AS version, COUNT(*) AS recent FROM face_changes "
+        "WHERE version > (SELECT COALESCE(MAX(version), 0) FROM face_changes) - %s",
+        (SYNC_OVERLAP,))
+    row = cursor.fetchone()
+    return int(row['version']), int(row['recent'])
+
+
+def fetch_faces(cursor):
+    cursor.execute(f"SELECT id, username, {FACE_COLUMNS} FROM users WHERE {HAS_FACE} ORDER BY id")
+    return cursor.fetchall()
+
+
+def changes_since(cursor, since):
+    """Faces touched after version `since`, re-reading SYNC_OVERLAP versions before it.
+
+    Returns (upserts, removed): upserts are user rows (id, username, face
+    columns, existed) where existed tells whether the face was
+    already part of the feed at `since`; removed is a list of user ids that
+    were deleted or lost their face. Both reflect the users' current rows,
+    so applying a change twice is harmless.
+    """
+    cursor.execute("SELECT DISTINCT user_id FROM face_changes WHERE version > %s", (max(0, since - SYNC_OVERLAP),))
+    touched = [r['user_id'] for r in cursor.fetchall()]
+    if not touched:
+        return [], []
+
+    placeholders = ', '.join(['%s'] * len(touched))
+    cursor.execute(
+        f"SELECT DISTINCT user_id FROM face_changes WHERE version <= %s AND user_id IN ({placeholders})",
+        (since, *touched)
+    )
+    existed = {r['user_id'] for r in cursor.fetchall()}
+
+    cursor.execute(
+        f"SELECT id, username, {FACE_COLUMNS} FROM users "
+        f"WHERE {HAS_FACE} AND id IN ({placeholders}) ORDER BY id",
+        tuple(touched)
+    )
+    upserts = cursor.fetchall()
+    for row in upserts:
+        row['existed'] = row['id'] in existed
+
+    present = {row['id'] for row in upserts}
+    removed = [user_id for user_id in touched if user_id not in present]
+    return upserts, removed
+
+
+def pack_faces(version, full, faces, removed=()):
+    """Serialize (user_id, username, float32 vector) tuples into the binary feed."""
+    dim = len(faces[0][2]) if faces else DESCRIPTOR_SIZE
+    ids = np.array([f[0] for f in faces], dtype='<i4')
+    removed_ids = np.array(list(removed), dtype='<i4')
+    if faces:
+        matrix = np.stack([f[2] for f in faces]).astype('<f4', copy=False)
+    else:
+        matrix = np.empty((0, dim), dtype='<f4')
+    labels = []
+    for face in faces:
+        label = face[1].encode('utf-8')
+        labels += [LABEL_LENGTH.pack(len(label)), label]
+    header = HEADER.pack(BINARY_MAGIC, BINARY_FORMAT, dim, version, 1 if full else 0, len(faces), len(removed_ids))
+    return b''.join([header, ids.tobytes(), removed_ids.tobytes(), matrix.tobytes()] + labels)
+
+
+def unpack_faces(payload):
+    """Inverse of pack_faces: returns (version, full, ids, usernames, matrix, removed)."""
+    magic, fmt, dim, version, full, count, removed_count = HEADER.unpack_from(payload)
+    if magic != BINARY_MAGIC or fmt != BINARY_FORMAT:
+        raise ValueError('Not a face feed payload')
+    offset = HEADER.size
+    ids = np.frombuffer(payload, dtype='<i4', count=count, offset=offset)
+    offset += 4 * count
+    removed = np.frombuffer(payload, dtype='<i4', count=removed_count, offset=offset)
+    offset += 4 * removed_count
+    matrix = np.frombuffer(payload, dtype='<f4', count=count * dim, offset=offset).reshape(count, dim)
+    offset += 4 * count * dim
+    usernames = []
+    for _ in range(count):
+        (size,) = LABEL_LENGTH.unpack_from(payload, offset)
+        offset += LABEL_LENGTH.size
+        usernames.append(payload[offset:offset + size].decode('utf-8'))
+        offset += size
+    return version, bool(full), ids, usernames, matrix, removed
@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import get_db
+from descriptors import DESCRIPTOR_SIZE, parse_descriptor, stored_descriptor
+from face_ann import make_backend
+from face_feed import changes_since, feed_state, fetch_faces
+
+# Same distance used by the enrollment duplicate check since the first version
+DUPLICATE_THRESHOLD = 0.5
+# Same threshold the kiosks used with faceapi.FaceMatcher
+MATCH_THRESHOLD = 0.55
+# Other gunicorn workers enroll faces too; look for their changes this often (seconds)
+SYNC_INTERVAL = float(os.environ.get('FACE_INDEX_SYNC_INTERVAL', 2))
+
+
+class FaceIndex:
+    """In-memory N x 128 float32 matrix of enrolled faces.
+
+    Rows are kept contiguous (deletes swap the last row into the hole) so a
+    lookup is a single batched distance computation over the whole matrix.
+    The backend (see face_ann) may narrow that down to a few candidate rows
+    once the matrix is large; an untrained backend means exact search.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or make_backend()
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._usernames = []
+        self._positions = {}
+        self._size = 0
+        self.loaded = False
+        self.version = 0
+        self.state = None           # face_feed.feed_state at the last load/sync
+        self.synced_at = 0.0
+
+    def __len__(self):
+        return self._size
+
+    # --- Loading ---
+
+    def load(self, rows):
+        """Replace the index contents with (user_id, username, descriptor) rows."""
+        ids, usernames, vectors = [], [], []
+        for user_id, username, descriptor in rows:
+            try:
+                vectors.append(parse_descriptor(descriptor))
+            except (ValueError, TypeError):
+                continue
+            ids.append(user_id)
+            usernames.append(username)
+
+        with self._lock:
+            count = len(ids)
+            self._matrix = np.empty((max(count, 16), DESCRIPTOR_SIZE), dtype=np.float32)
+            self._norms = np.empty(self._matrix.shape[0], dtype=np.float32)
+            self._ids = np.empty(self._matrix.shape[0], dtype=np.int64)
+            if count:
+                self._matrix[:count] = np.stack(vectors)
+                self._norms[:count] = np.einsum('ij,ij->i', self._matrix[:count], self._matrix[:count])
+                self._ids[:count] = ids
+            self._usernames = usernames
+            self._positions = {user_id: pos for pos, user_id in enumerate(ids)}
+            self._size = count
+            self.backend.build(self._ids[:count], self._matrix[:count])
+            self.loaded = True
+            self.synced_at = time.monotonic()
+
+    def load_from_db(self, db):
+        with db.cursor() as cursor:
+            state = feed_state(cursor)
+            rows = fetch_faces(cursor)
+        self.load((r['id'], r['username'], stored_descriptor(r)) for r in rows)
+        self.version, self.state = state[0], state
+
+    def sync(self, db):
+        """Apply the face feed changes made (by any worker) since the last load/sync."""
+        with self._lock:
+            with db.cursor() as cursor:
+                state = feed_state(cursor)
+                # A change committed late under a lower version moves the state, not the version
+                if state != self.state:
+                    upserts, removed = changes_since(cursor, self.version)
+                    for row in upserts:
+                        try:
+                            self.upsert(row['id'], row['username'], stored_descriptor(row))
+                        except (ValueError, TypeError):
+                            self.remove(row['id'])
+                    for user_id in removed:
+                        self.remove(user_id)
+                    self.version, self.state = state[0], state
+                    if self.backend.needs_rebuild(self._size):
+                        self.backend.build(self._ids[:self._size], self._matrix[:self._size])
+            self.synced_at = time.monotonic()
+
+    def ensure_current(self, db, interval=SYNC_INTERVAL):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load_from_db(db)
+        elif time.monotonic() - self.synced_at > interval:
+            self.sync(db)
+        return self
+
+    # --- Incremental maintenance ---
+
+    def _grow(self):
+        capacity = max(16, self._matrix.shape[0] * 2)
+        matrix = np.empty((capacity, DESCRIPTOR_SIZE), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        norms[:self._size] = self._norms[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._norms, self._ids = matrix, norms, ids
+
+    def upsert(self, user_id, username, descriptor):
+        vector = parse_descriptor(descriptor)
+        with self._lock:
+            pos = self._positions.get(user_id)
+            if pos is None:
+                if self._size == self._matrix.shape[0]:
+                    self._grow()
+                pos = self._size
+                self._size += 1
+                self._positions[user_id] = pos
+                self._usernames.append(username)
+            else:
+                self._usernames[pos] = username
+            self._matrix[pos] = vector
+            self._norms[pos] = float(vector @ vector)
+            self._ids[pos] = user_id
+            self.backend.add(pos, vector)
+
+    def rename(self, user_id, username):
+        with self._lock:
+            pos = self._positions.get(user_id)
+            if pos is not None:
+                self._usernames[pos] = username
+
+    def remove(self, user_id):
+        with self._lock:
+            pos = self._positions.pop(user_id, None)
+            if pos is None:
+                return
+            last = self._size - 1
+            if pos != last:
+                # Move the last row into the hole to keep the matrix contiguous
+                self._matrix[pos] = self._matrix[last]
+                self._norms[pos] = self._norms[last]
+                self._ids[pos] = self._ids[last]
+                self._usernames[pos] = self._usernames[last]
+                self._positions[int(self._ids[pos])] = pos
+                self.backend.move(last, pos)
+            self._usernames.pop()
+            self._size = last
+
+    # --- Search ---
+
+    def _distances(self, queries, rows, size):
+        matrix = self._matrix[:size] if rows is None else self._matrix[rows]
+        norms = self._norms[:size] if rows is None else self._norms[rows]
+        # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, one matrix product for the whole batch
+        sq = norms[None, :] - 2.0 * (queries @ matrix.T)
+        sq += np.einsum('ij,ij->i', queries, queries)[:, None]
+        return sq
+
+    def _pick(self, sq, rows):
+        best = int(np.argmin(sq))
+        if not np.isfinite(sq[best]):
+            return None
+        pos = best if rows is None else int(rows[best])
+        return int(self._ids[pos]), self._usernames[pos], float(np.sqrt(max(sq[best], 0.0)))
+
+    def _search(self, queries, exclude_id=None, thorough=False):
+        """Closest enrolled face for each row of queries: [(user_id, username, distance) | None]."""
+        with self._lock:
+            size = self._size
+            if size == 0:
+                return [None] * len(queries)
+            exclude_pos = self._positions.get(exclude_id) if exclude_id is not None else None
+            candidates = [self.backend.candidates(q, size, thorough=thorough) for q in queries]
+
+            if all(rows is None for rows in candidates):
+                sq = self._distances(queries, None, size)
+                if exclude_pos is not None:
+                    sq[:, exclude_pos] = np.inf
+                return [self._pick(row, None) for row in sq]
+
+            results = []
+            for query, rows in zip(queries, candidates):
+                if rows is not None and exclude_pos is not None:
+                    rows = rows[rows != exclude_pos]
+                if rows is not None and len(rows) == 0:
+                    rows = None  # empty probe: fall back to exact search
+                sq = self._distances(query[None, :], rows, size)[0]
+                if rows is None and exclude_pos is not None:
+                    sq[exclude_pos] = np.inf
+                results.append(self._pick(sq, rows))
+            return results
+
+    def nearest(self, descriptor, exclude_id=None, thorough=False):
+        """Return (user_id, username, distance) of the closest face, or None."""
+        query = parse_descriptor(descriptor)
+        return self._search(query[None, :], exclude_id=exclude_id, thorough=thorough)[0]
+
+    def identify(self, descriptors, threshold=MATCH_THRESHOLD):
+        """Match a batch of descriptors, face-api.js FaceMatcher style.
+
+        Returns one (user_id, username, distance) per descriptor; user_id and
+        username are None when the best distance is not below threshold.
+        """
+        if not descriptors:
+            return []
+        queries = np.stack([parse_descriptor(d) for d in descriptors])
+        results = []
+        for match in self._search(queries):
+            if match is None:
+                results.append((None, None, None))
+            elif match[2] < threshold:
+                results.append(match)
+            else:
+                results.append((None, None, match[2]))
+        return results
+
+    def find_duplicate(self, descriptor, exclude_id=None, threshold=DUPLICATE_THRESHOLD):
+        """Return (user_id, username, distance) of an enrolled face closer than threshold."""
+        # Enrollment is rare and a miss means a duplicate identity: probe wider
+        match = self.nearest(descriptor, exclude_id=exclude_id, thorough=True)
+        if match and match[2] < threshold:
+            return match
+        return None
+
+
+# One index per worker process, loaded lazily on first use
+face_index = FaceIndex()
+
+
+def get_face_index():
+    if face_index.loaded and time.monotonic() - face_index.synced_at <= SYNC_INTERVAL:
+        return face_index
+    return face_index.ensure_current(get_db())
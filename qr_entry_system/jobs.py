@@ -0,0 +1,244 @@
+"""Local background jobs for slow reports, no broker needed.
+
+Jobs live in a SQLite file shared by every gunicorn worker on the host; the
+worker that claims a queued job runs it in its own process pool, so the
+heavy work never holds a web thread or the GIL. A job is claimed only while
+fewer than max_concurrent jobs are running host-wide, and finished results
+are deleted after ttl seconds: on every submit, and at most every
+cleanup_interval seconds when a job is polled or finishes, so results do
+not outlive the ttl when nobody submits any more.
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+
+JOBS_DB = os.environ.get('REPORT_JOBS_DB', os.path.join('instance', 'report_jobs.sqlite3'))
+RESULTS_DIR = os.environ.get('REPORT_RESULTS_DIR', os.path.join('instance', 'reports'))
+# Reports generated at the same time across all workers
+MAX_CONCURRENT = int(os.environ.get('REPORT_MAX_CONCURRENT', 2))
+# Queued + running jobs allowed per user
+MAX_PENDING_PER_USER = int(os.environ.get('REPORT_MAX_PENDING_PER_USER', 3))
+# Seconds a finished (or failed) job and its file are kept
+RESULT_TTL = float(os.environ.get('REPORT_RESULT_TTL', 3600))
+# A running job older than this is assumed lost (worker restarted)
+JOB_TIMEOUT = float(os.environ.get('REPORT_JOB_TIMEOUT', 900))
+# Seconds between cleanups from the status and worker paths
+CLEANUP_INTERVAL = float(os.environ.get('REPORT_CLEANUP_INTERVAL', 60))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        owner_id INTEGER,
+        state TEXT NOT NULL,
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        error TEXT,
+        file_path TEXT,
+        filename TEXT,
+        mimetype TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        expires_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobLimit(Exception):
+    """The user already has too many pending jobs."""
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _run(func, params, out_path, db_path, job_id):
+    """Worker process entry point: run func and report its progress into the jobs table."""
+    with closing(connect(db_path)) as conn:
+        def progress(fraction, message=None):
+            conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ? AND state = ?",
+                         (fraction, message, job_id, RUNNING))
+        return func(params, out_path, progress)
+
+
+class JobQueue:
+    def __init__(self, kinds, path=JOBS_DB, results_dir=RESULTS_DIR, max_concurrent=MAX_CONCURRENT,
+                 max_pending=MAX_PENDING_PER_USER, ttl=RESULT_TTL, timeout=JOB_TIMEOUT,
+                 cleanup_interval=CLEANUP_INTERVAL):
+        self.kinds = kinds
+        self.path = path
+        # Absolute: send_file resolves relative paths against the app root
+        self.results_dir = os.path.abspath(results_dir)
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cleanup_interval = cleanup_interval
+        self._cleaned_at = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self._ready = False
+
+    def _db(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            os.makedirs(self.results_dir, exist_ok=True)
+            with closing(connect(self.path)) as conn:
+                conn.executescript(SCHEMA)
+            self._ready = True
+        return closing(connect(self.path))
+
+    def _pool(self):
+        with self._lock:
+            # Never reuse a pool inherited through fork
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_concurrent, mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    # --- Public API ---
+
+    def submit(self, kind, params, owner_id=None):
+        if kind not in self.kinds:
+            raise ValueError(f'Unknown job kind: {kind}')
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE owner_id = ? AND state IN (?, ?)",
+                    (owner_id, QUEUED, RUNNING)).fetchone()[0]
+                if owner_id is not None and pending >= self.max_pending:
+                    raise JobLimit(f'Ya tienes {pending} reportes en proceso')
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, params, owner_id, state, message, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(params), owner_id, QUEUED, 'En cola', time.time()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.dispatch()
+        return job_id
+
+    def get(self, job_id):
+        self._cleanup_due()
+        with self._db() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def dispatch(self):
+        """Start queued jobs while there are free slots host-wide."""
+        started = 0
+        while True:
+            job = self._claim()
+            if job is None:
+                return started
+            out_path = os.path.join(self.results_dir, job['id'])
+            try:
+                future = self._pool().submit(
+                    _run, self.kinds[job['kind']], json.loads(job['params']), out_path, self.path, job['id'])
+            except (BrokenProcessPool, RuntimeError) as e:
+                self._executor = None
+                self._finish(job['id'], error=str(e))
+                continue
+            future.add_done_callback(lambda f, job_id=job['id'], out_path=out_path: self._done(job_id, out_path, f))
+            started += 1
+
+    def cleanup(self):
+        """Fail lost jobs and delete expired results."""
+        now = self._cleaned_at = time.time()
+        with self._db() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ?, expires_at = ? "
+                "WHERE state = ? AND started_at < ?",
+                (FAILED, 'Tiempo de espera agotado', now, now + self.ttl, RUNNING, now - self.timeout))
+            expired = conn.execute(
+                "SELECT id, file_path FROM jobs WHERE state IN (?, ?) AND expires_at < ?",
+                (DONE, FAILED, now)).fetchall()
+            for row in expired:
+                if row['file_path']:
+                    try:
+                        os.remove(row['file_path'])
+                    except FileNotFoundError:
+                        pass
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(row['id'],) for row in expired])
+        return len(expired)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=wait)
+
+    # --- Internals ---
+
+    def _cleanup_due(self):
+        if self._cleaned_at is None or time.time() - self._cleaned_at >= self.cleanup_interval:
+            self.cleanup()
+
+    def _claim(self):
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (RUNNING,)).fetchone()[0]
+                job = None
+                if running < self.max_concurrent:
+                    job = conn.execute(
+                        "SELECT * FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+                if job is not None:
+                    conn.execute(
+                        "UPDATE jobs SET state = ?, started_at = ?, message = ? WHERE id = ?",
+                        (RUNNING, time.time(), 'Procesando', job['id']))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return dict(job) if job else None
+
+    def _done(self, job_id, out_path, future):
+        try:
+            filename, mimetype = future.result()
+        except BrokenProcessPool as e:
+            self._executor = None
+            self._finish(job_id, error=f'Worker terminated: {e}')
+        except Exception as e:
+            self._finish(job_id, error=str(e) or type(e).__name__)
+        else:
+            self._finish(job_id, file_path=out_path, filename=filename, mimetype=mimetype)
+        self._cleanup_due()
+        # A slot just freed up
+        self.dispatch()
+
+    def _finish(self, job_id, file_path=None, filename=None, mimetype=None, error=None):
+        now = time.time()
+        with self._db() as conn:
+            # Only a running job: cleanup() may have given up on it meanwhile
+            updated = conn.execute(
+                "UPDATE jobs SET state = ?, progress = ?, message = ?, error = ?, file_path = ?, "
+                "filename = ?, mimetype = ?, finished_at = ?, expires_at = ? WHERE id = ? AND state = ?",
+                (FAILED if error else DONE, 0 if error else 1, 'Error' if error else 'Listo', error,
+                 file_path, filename, mimetype, now, now + self.ttl, job_id, RUNNING)).rowcount
+        if error or not updated:
+            try:
+                os.remove(os.path.join(self.results_dir, job_id))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,223 @@
+"""Columnar export of logs for analytics: Parquet (with pyarrow) or a .npz bundle.
+
+/api/logs/export?format=parquet|npz (format=columnar picks the best one
+available). Both carry one row per log:
+
+    log_id     int64
+    user_id    int32 (Parquet) / user, an int32 code into the user arrays (npz)
+    username   dictionary-encoded per user
+    area       dictionary-encoded per user
+    type       int8 code into VALID_ACTIONS (a dictionary column in Parquet)
+    local_time time of the scan on the scanner host's wall clock, no time zone:
+               datetime64[s] (npz) / timestamp[s] without tz (Parquet)
+
+logs.timestamp holds local time, not UTC, so local_time is not an epoch:
+its values are the wall-clock fields as stored.
+
+The npz bundle loads with numpy.load: the row arrays log_id, user, type
+and local_time, plus user_ids, usernames and user_areas indexed by user,
+areas indexed by user_areas and type_labels indexed by type.
+
+Rows are read from an unbuffered cursor and encoded ROW_GROUP at a time:
+each group becomes a Parquet row group, or is appended to per-column
+spill files that are copied into the .npz at the end. Memory stays
+bounded by the group size whatever the date range. Rows come in no
+particular order (no sort on the server); archived months are included
+like in the CSV export.
+"""
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import ExitStack
+from itertools import chain
+
+import numpy as np
+
+from db import pool
+from log_export import iter_rows
+from log_partitions import archived_records
+from report_cache import cache_key, report_cache, watermark
+from scans import VALID_ACTIONS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:                 # optional: npz only
+    pa = pq = None
+
+ROW_GROUP = int(os.environ.get('EXPORT_ROW_GROUP', 65536))
+PARQUET_COMPRESSION = os.environ.get('EXPORT_PARQUET_COMPRESSION', 'zstd')
+MIMETYPES = {'parquet': 'application/vnd.apache.parquet', 'npz': 'application/octet-stream'}
+ACTION_CODES = {action: code for code, action in enumerate(VALID_ACTIONS)}
+# npz row arrays, in the order they are written
+ROW_COLUMNS = {'log_id': '<i8', 'user': '<i4', 'type': '|i1', 'local_time': '<M8[s]'}
+
+COLUMNAR_QUERY = """
+    SELECT logs.id, logs.user_id, users.username, users.area, logs.type, logs.timestamp
+    FROM logs
+    JOIN users ON logs.user_id = users.id
+    WHERE {where}
+"""
+
+
+def available_formats():
+    return ('parquet', 'npz') if pa is not None else ('npz',)
+
+
+def resolve_format(fmt):
+    """The export format to write for a ?format= value, or None if it is not columnar."""
+    if fmt == 'columnar':
+        return available_formats()[0]
+    return fmt if fmt in MIMETYPES else None
+
+
+def row_groups(rows, size=ROW_GROUP):
+    group = []
+    for row in rows:
+        group.append(row)
+        if len(group) == size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+class Encoder:
+    """Dictionary-encodes users and areas across row groups."""
+
+    def __init__(self):
+        self.users = {}             # user_id -> code
+        self.user_ids = []
+        self.usernames = []
+        self.user_areas = []
+        self.areas = {}             # area -> code
+
+    def _user(self, user_id, username, area):
+        code = self.users.get(user_id)
+        if code is None:
+            code = self.users[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.usernames.append(username)
+            self.user_areas.append(self.areas.setdefault(area or '', len(self.areas)))
+        return code
+
+    def encode(self, group):
+        """Row arrays (ROW_COLUMNS) of one group of (id, user_id, username, area, type, timestamp)."""
+        n = len(group)
+        log_ids = np.empty(n, ROW_COLUMNS['log_id'])
+        users = np.empty(n, ROW_COLUMNS['user'])
+        types = np.empty(n, ROW_COLUMNS['type'])
+        stamps = [None] * n
+        for i, (log_id, user_id, username, area, action_type, ts) in enumerate(group):
+            log_ids[i] = log_id
+            users[i] = self._user(user_id, username, area)
+            types[i] = ACTION_CODES[action_type]
+            stamps[i] = ts
+        # datetime64 of a naive datetime keeps its wall-clock fields
+        local_times = np.array(stamps, dtype=ROW_COLUMNS['local_time'])
+        return {'log_id': log_ids, 'user': users, 'type': types, 'local_time': local_times}
+
+    def dictionaries(self):
+        return {
+            'user_ids': np.array(self.user_ids, dtype='<i4'),
+            'usernames': np.array(self.usernames, dtype=str),
+            'user_areas': np.array(self.user_areas, dtype='<i4'),
+            'areas': np.array(sorted(self.areas, key=self.areas.get), dtype=str),
+            'type_labels': np.array(VALID_ACTIONS, dtype=str),
+        }
+
+
+def write_npz(groups, f):
+    encoder = Encoder()
+    count = 0
+    with ExitStack() as stack:
+        spill = {name: stack.enter_context(tempfile.TemporaryFile()) for name in ROW_COLUMNS}
+        for group in groups:
+            for name, values in encoder.encode(group).items():
+                spill[name].write(values.tobytes())
+            count += len(group)
+        with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as bundle:
+            for name, dtype in ROW_COLUMNS.items():
+                with bundle.open(f'{name}.npy', 'w', force_zip64=True) as member:
+                    # The header np.save would write for the whole array
+                    np.lib.format.write_array_header_1_0(member, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                        'fortran_order': False,
+                        'shape': (count,),
+                    })
+                    spill[name].seek(0)
+                    shutil.copyfileobj(spill[name], member)
+            for name, values in encoder.dictionaries().items():
+                with bundle.open(f'{name}.npy', 'w') as member:
+                    np.lib.format.write_array(member, values, allow_pickle=False)
+    return count
+
+
+def parquet_schema():
+    return pa.schema([
+        ('log_id', pa.int64()),
+        ('user_id', pa.int32()),
+        ('username', pa.dictionary(pa.int32(), pa.string())),
+        ('area', pa.dictionary(pa.int32(), pa.string())),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('local_time', pa.timestamp('s')),
+    ], metadata={'local_time': 'wall-clock time of the scanner host, not UTC'})
+
+
+def write_parquet(groups, f):
+    encoder = Encoder()
+    schema = parquet_schema()
+    type_labels = pa.array(VALID_ACTIONS, pa.string())
+    count = 0
+    with pq.ParquetWriter(f, schema, compression=PARQUET_COMPRESSION,
+                          use_dictionary=['user_id', 'username', 'area', 'type']) as writer:
+        for group in groups:
+            columns = encoder.encode(group)
+            users = columns['user']
+            dictionaries = encoder.dictionaries()
+            table = pa.Table.from_arrays([
+                pa.array(columns['log_id']),
+                pa.array(dictionaries['user_ids'][users]),
+                pa.DictionaryArray.from_arrays(pa.array(users), pa.array(encoder.usernames, pa.string())),
+                pa.DictionaryArray.from_arrays(pa.array(dictionaries['user_areas'][users]),
+                                               pa.array(dictionaries['areas'].tolist(), pa.string())),
+                pa.DictionaryArray.from_arrays(pa.array(columns['type']), type_labels),
+                pa.array(columns['local_time']),
+            ], schema=schema)
+            writer.write_table(table, row_group_size=len(group))
+            count += len(group)
+    return count
+
+
+WRITERS = {'parquet': write_parquet, 'npz': write_npz}
+
+
+def export_columnar(where, params, filters, fmt, row_group=ROW_GROUP):
+    """Write the filtered logs as fmt into the report cache; returns the file opened for reading.
+
+    The rows and the cache watermark come from one snapshot, like the CSV
+    export, so the entry is valid for exactly the logs it holds. The file
+    is opened before it is published, so evicting it (here or in another
+    worker) before it is sent does not lose it.
+    """
+    conn = pool.acquire()
+    finished = False
+    result = None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            key = cache_key(filters, fmt, watermark(cursor, where, params))
+        rows = chain(iter_rows(conn, COLUMNAR_QUERY.format(where=where), params),
+                     archived_records(conn, filters))
+        with report_cache.writer(key, fmt) as f:
+            WRITERS[fmt](row_groups(rows, row_group), f)
+            f.flush()
+            result = open(f.name, 'rb')
+        conn.commit()
+        finished = True
+    finally:
+        pool.release(conn, discard=not finished)
+        if not finished and result is not None:
+            result.close()
+    return result
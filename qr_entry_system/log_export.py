@@ -0,0 +1,99 @@
+import csv
+import io
+from contextlib import ExitStack
+from itertools import chain
+
+from db import pool, TimedSSCursor
+from log_partitions import iter_archived
+from report_cache import cache_key, report_cache, watermark
+
+# Rows pulled from the server per round trip and CSV lines per yielded chunk
+EXPORT_CHUNK_ROWS = 2000
+
+CSV_HEADER = ['ID', 'Usuario', 'Tipo Accion', 'Fecha y Hora']
+CSV_QUERY = """
+    SELECT logs.id, users.username, logs.type, logs.timestamp
+    FROM logs
+    JOIN users ON logs.user_id = users.id
+    WHERE {where}
+    ORDER BY logs.timestamp DESC
+"""
+
+
+def iter_rows(conn, query, params=(), chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield result tuples from an unbuffered (SSCursor) query, chunk_size at a time.
+
+    The result set stays on the server and is read off the socket as the
+    caller consumes it, so memory does not grow with the number of rows.
+    """
+    cursor = conn.cursor(TimedSSCursor)
+    try:
+        cursor.execute(query, tuple(params))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        # Closing an unbuffered cursor reads the rest of the result; skip that
+        # when the connection was already dropped by an aborted download
+        if conn.open:
+            cursor.close()
+
+
+def csv_chunks(rows, header=CSV_HEADER, chunk_size=EXPORT_CHUNK_ROWS):
+    """Encode rows as CSV, yielding one string per chunk_size rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_logs_csv(where, params, filters=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """CSV export of the filtered logs as a generator of text chunks.
+
+    Uses its own pooled connection rather than the request one: an unbuffered
+    result ties up the connection until it is fully read, and the response
+    body is produced after the view has returned. If the client goes away
+    mid-download the connection is discarded instead of draining the rest of
+    the result set.
+
+    With filters, archived months the date range reaches follow the live
+    rows, and the output is also written to the report cache, keyed by a
+    watermark read in the same snapshot as the rows; an aborted download
+    leaves no entry.
+    """
+    conn = pool.acquire()
+    finished = False
+    try:
+        with ExitStack() as stack:
+            cache_file = None
+            if filters is not None:
+                with conn.cursor() as cursor:
+                    cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                    key = cache_key(filters, 'csv', watermark(cursor, where, params))
+                cache_file = stack.enter_context(report_cache.writer(key, 'csv'))
+            rows = iter_rows(conn, CSV_QUERY.format(where=where), params, chunk_size)
+            if filters is not None:
+                rows = chain(rows, iter_archived(conn, filters))
+            for chunk in csv_chunks(rows, chunk_size=chunk_size):
+                if cache_file is not None:
+                    cache_file.write(chunk.encode('utf-8'))
+                yield chunk
+        finished = True
+    finally:
+        if not finished:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        pool.release(conn, discard=not finished)
@@ -0,0 +1,319 @@
+"""Monthly partitions of logs and the archive of cold months.
+
+logs is RANGE COLUMNS partitioned on timestamp: pYYYYMM holds one month,
+p_future anything after the last of them and p_old anything before the
+first. p_old starts empty (the migration creates months back to the
+oldest log) and only ever gets scans backdated into archived months; it
+is never archived, so those rows stay live and the exports read them
+next to the archive files. Run this daily (cron):
+
+    python log_partitions.py              # keep FUTURE_MONTHS partitions ahead
+    python log_partitions.py --archive    # also archive months past the retention
+    python log_partitions.py --list
+
+Archiving a month swaps its rows out of logs into a staging table
+(EXCHANGE PARTITION), writes them, newest first, to
+ARCHIVE_DIR/logs-YYYY-MM.csv.gz, records the file in log_archives and
+folds the emptied partition's range into p_old (no DELETE of the month). The CSV and PDF
+exports read archived months back through iter_archived when their date
+range reaches them; the payroll summary comes from work_days, which is
+kept. Archived rows carry the username they had when archived, used if
+the user has been deleted since.
+"""
+import argparse
+import csv
+import gzip
+import io
+import os
+import re
+from datetime import date, datetime, timedelta
+
+import pymysql
+import pymysql.cursors
+
+from log_queries import TIMESTAMP_FORMAT, parse_date
+
+FUTURE_MONTHS = int(os.environ.get('LOG_FUTURE_PARTITIONS', 3))
+RETENTION_MONTHS = int(os.environ.get('LOG_RETENTION_MONTHS', 24))
+ARCHIVE_DIR = os.environ.get('LOG_ARCHIVE_DIR', os.path.join('instance', 'log_archive'))
+ARCHIVE_COLUMNS = ['id', 'user_id', 'username', 'type', 'timestamp']
+MONTH_PARTITION = re.compile(r'^p(\d{4})(\d{2})$')
+OLD_PARTITION = 'p_old'
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, n):
+    year, index = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return date(year, index + 1, 1)
+
+
+def partition_name(month):
+    return f'p{month:%Y%m}'
+
+
+def partition_definitions(first, last, old=False):
+    """PARTITION clauses for the months first..last (inclusive) and p_future, after p_old if old."""
+    clauses = [f"PARTITION {OLD_PARTITION} VALUES LESS THAN ('{first:%Y-%m-%d}')"] if old else []
+    month = first
+    while month <= last:
+        clauses.append(f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')")
+        month = add_months(month, 1)
+    clauses.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    return ', '.join(clauses)
+
+
+def partitions(cursor):
+    """[(name, estimated rows)] of logs in order; empty if logs is not partitioned."""
+    cursor.execute(
+        "SELECT PARTITION_NAME AS name, TABLE_ROWS AS estimated_rows FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'logs' AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION")
+    return [(r['name'], int(r['estimated_rows'] or 0)) for r in cursor.fetchall()]
+
+
+def monthly_partitions(cursor):
+    """{first day of month: partition name}."""
+    found = {}
+    for name, _ in partitions(cursor):
+        match = MONTH_PARTITION.match(name)
+        if match:
+            found[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return found
+
+
+def ensure_future(cursor, months=FUTURE_MONTHS, today=None):
+    """Split p_future so there are partitions through `months` months ahead; returns the names added."""
+    current = month_start(today or date.today())
+    existing = monthly_partitions(cursor)
+    first = add_months(max(existing), 1) if existing else current
+    last = add_months(current, months)
+    if first > last:
+        return []
+    # Cheap while p_future is still empty (nothing to move)
+    cursor.execute(f"ALTER TABLE logs REORGANIZE PARTITION p_future INTO ({partition_definitions(first, last)})")
+    added = []
+    while first <= last:
+        added.append(partition_name(first))
+        first = add_months(first, 1)
+    return added
+
+
+# --- Archive ---
+
+def archive_path(file, directory=ARCHIVE_DIR):
+    return os.path.join(directory, file)
+
+
+def _export_table(conn, table, path):
+    """Write a staged month's rows to path (gzip CSV, newest first); returns the row count."""
+    tmp = path + '.tmp'
+    with conn.cursor() as cursor:
+        # Count and rows from one snapshot, so the check below is exact
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        cursor.execute(f"SELECT COUNT(*) AS n FROM {table}")
+        expected = cursor.fetchone()['n']
+    written = 0
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(
+            f"SELECT logs.id, logs.user_id, users.username, logs.type, logs.timestamp "
+            f"FROM {table} AS logs LEFT JOIN users ON users.id = logs.user_id "
+            f"ORDER BY logs.timestamp DESC, logs.id DESC")
+        with open(tmp, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as gz, io.TextIOWrapper(gz, 'utf-8', newline='') as text:
+                writer = csv.writer(text)
+                writer.writerow(ARCHIVE_COLUMNS)
+                for log_id, user_id, username, action_type, ts in cursor:
+                    writer.writerow([log_id, user_id, username or '', action_type, ts.strftime(TIMESTAMP_FORMAT)])
+                    written += 1
+            raw.flush()
+            os.fsync(raw.fileno())
+    finally:
+        cursor.close()
+    conn.commit()
+    if written != expected:
+        os.remove(tmp)
+        raise RuntimeError(f'{table}: exported {written} of {expected} rows')
+    os.replace(tmp, path)
+    return written
+
+
+def _table_rows(cursor, table):
+    """Row count of table, None if it does not exist."""
+    cursor.execute("SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                   (table,))
+    if cursor.fetchone() is None:
+        return None
+    cursor.execute(f"SELECT COUNT(*) AS n FROM {table}")
+    return cursor.fetchone()['n']
+
+
+def archive_month(conn, month, directory=ARCHIVE_DIR):
+    """Archive the oldest monthly partition into p_old; returns the rows archived (None if there was nothing).
+
+    The month's rows are swapped out into a staging table first, so the
+    export reads rows nothing writes to any more; a scan backdated into
+    the month meanwhile lands in the emptied partition and moves into p_old
+    with its range. Safe to re-run after a crash at any step: the staging
+    table is kept until the month is marked dropped, and readers only use
+    months marked dropped.
+    """
+    name = partition_name(month)
+    staging = f'logs_archive_{month:%Y%m}'
+    file = f'logs-{month:%Y-%m}.csv.gz'
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT `rows`, dropped FROM log_archives WHERE month = %s", (month,))
+        recorded = cursor.fetchone()
+        exists = month in monthly_partitions(cursor)
+        staged = _table_rows(cursor, staging)
+    if recorded and recorded['dropped']:
+        if staged is not None:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {staging}")
+        return None
+    if exists:
+        if not staged:
+            # Not swapped yet (or swapped empty): swap the month's rows out, instant
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+                cursor.execute(f"CREATE TABLE {staging} LIKE logs")
+                cursor.execute(f"ALTER TABLE {staging} REMOVE PARTITIONING")
+                cursor.execute(f"ALTER TABLE logs EXCHANGE PARTITION {name} WITH TABLE {staging}")
+        os.makedirs(directory, exist_ok=True)
+        rows = _export_table(conn, staging, archive_path(file, directory))
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO log_archives (month, file, `rows`) VALUES (%s, %s, %s) "
+                "ON DUPLICATE KEY UPDATE file = VALUES(file), `rows` = VALUES(`rows`)",
+                (month, file, rows))
+        conn.commit()
+        with conn.cursor() as cursor:
+            # p_old takes the month's range; only its rows and scans backdated since the swap are copied
+            cursor.execute(
+                f"ALTER TABLE logs REORGANIZE PARTITION {OLD_PARTITION}, {name} INTO "
+                f"(PARTITION {OLD_PARTITION} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}'))")
+    elif recorded:
+        # Folded into p_old before the crash, not yet marked
+        rows = recorded['rows']
+    else:
+        return None
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE log_archives SET dropped = 1, archived_at = NOW() WHERE month = %s", (month,))
+    conn.commit()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    return rows
+
+
+def archive_old(conn, retention=RETENTION_MONTHS, today=None, directory=ARCHIVE_DIR):
+    """Archive every month older than `retention` months, oldest first; returns {month: rows}."""
+    cutoff = add_months(month_start(today or date.today()), -retention)
+    with conn.cursor() as cursor:
+        months = sorted(m for m in monthly_partitions(cursor) if m < cutoff)
+    done = {}
+    for month in months:
+        rows = archive_month(conn, month, directory)
+        if rows is not None:
+            done[month] = rows
+    return done
+
+
+def archived_until(cursor):
+    """First day after the newest archived month (None if nothing is archived)."""
+    cursor.execute("SELECT MAX(month) AS month FROM log_archives WHERE dropped = 1")
+    month = cursor.fetchone()['month']
+    return add_months(month, 1) if month else None
+
+
+def archived_months(cursor, start=None, end=None):
+    """[(month, file)] of archived months overlapping [start, end), newest first."""
+    clauses, params = ["dropped = 1"], []
+    if start is not None:
+        clauses.append("month >= %s")
+        params.append(month_start(start))
+    if end is not None:
+        clauses.append("month < %s")
+        params.append(end)
+    cursor.execute(f"SELECT month, file FROM log_archives WHERE {' AND '.join(clauses)} ORDER BY month DESC",
+                   tuple(params))
+    return [(r['month'], r['file']) for r in cursor.fetchall()]
+
+
+def archived_records(conn, filters, directory=ARCHIVE_DIR):
+    """(id, user_id, username, area, type, timestamp) of archived logs matching filters, newest first.
+
+    Same semantics as build_log_where: username is a case-insensitive
+    substring, dates a half-open range. Nothing is read from disk unless
+    the range reaches an archived month.
+    """
+    start = parse_date(filters['date_from']) if filters.get('date_from') else None
+    end = parse_date(filters['date_to']) + timedelta(days=1) if filters.get('date_to') else None
+    with conn.cursor() as cursor:
+        months = archived_months(cursor, start, end)
+        if not months:
+            return
+        # Current names, like the live rows; the archived one for deleted users
+        cursor.execute("SELECT id, username, area FROM users")
+        users = {r['id']: (r['username'], r['area'] or '') for r in cursor.fetchall()}
+    needle = (filters.get('username') or '').casefold()
+    action = filters.get('action_type')
+    for _, file in months:
+        with gzip.open(archive_path(file, directory), 'rt', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for log_id, user_id, username, action_type, stamp in reader:
+                if action and action_type != action:
+                    continue
+                ts = datetime.strptime(stamp, TIMESTAMP_FORMAT)
+                if (start and ts < start) or (end and ts >= end):
+                    continue
+                user_id = int(user_id)
+                username, area = users.get(user_id, (username, ''))
+                if needle and needle not in username.casefold():
+                    continue
+                yield int(log_id), user_id, username, area, action_type, ts
+
+
+def iter_archived(conn, filters, directory=ARCHIVE_DIR):
+    """(id, username, type, timestamp) of archived_records, the columns of the CSV export."""
+    for log_id, _, username, _, action_type, ts in archived_records(conn, filters, directory):
+        yield log_id, username, action_type, ts
+
+
+if __name__ == "__main__":
+    from db import DB_CONFIG
+    from report_cache import report_cache
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--months', type=int, default=FUTURE_MONTHS, help='partitions to keep ahead')
+    parser.add_argument('--archive', action='store_true', help='archive and drop months past the retention')
+    parser.add_argument('--retention', type=int, default=RETENTION_MONTHS, help='months kept in MySQL')
+    parser.add_argument('--list', action='store_true', help='show the partitions and archived months')
+    args = parser.parse_args()
+
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            if not partitions(cursor):
+                raise SystemExit("logs is not partitioned: run `python migrate.py` first.")
+            if args.list:
+                for name, estimated in partitions(cursor):
+                    print(f"  {name:<10} ~{estimated} rows")
+                for month, file in archived_months(cursor):
+                    print(f"  archived {month:%Y-%m}  {archive_path(file)}")
+                raise SystemExit(0)
+            added = ensure_future(cursor, args.months)
+        print(f"Partitions added: {', '.join(added) or 'none'}")
+        if args.archive:
+            archived = archive_old(conn, args.retention)
+            for month, rows in archived.items():
+                print(f"  archived {month:%Y-%m}: {rows} logs")
+            if archived:
+                # Cached reports were built from the live rows
+                report_cache.clear()
+            print(f"Archived {len(archived)} month(s).")
+    finally:
+        conn.close()
@@ -0,0 +1,124 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+# Filters shared by the log search and both exports
+LOG_FILTERS = ('username', 'action_type', 'date_from', 'date_to')
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {value}')
+
+
+def log_filters(args):
+    """Normalized filter values from the request arguments."""
+    return {name: (args.get(name, '') or '').strip() for name in LOG_FILTERS}
+
+
+def build_log_where(filters):
+    """WHERE clause (logs joined with users) and its params for the given filters.
+
+    Dates become half-open timestamp ranges, [date_from 00:00, date_to + 1 day),
+    instead of DATE(logs.timestamp) comparisons, so the (timestamp),
+    (user_id, timestamp) and (type, timestamp) indexes can be used.
+    Raises ValueError for malformed dates.
+    """
+    clauses = ["1=1"]
+    params = []
+
+    if filters.get('username'):
+        clauses.append("users.username LIKE %s")
+        params.append(f"%{filters['username']}%")
+
+    if filters.get('action_type'):
+        clauses.append("logs.type = %s")
+        params.append(filters['action_type'])
+
+    if filters.get('date_from'):
+        clauses.append("logs.timestamp >= %s")
+        params.append(parse_date(filters['date_from']))
+
+    if filters.get('date_to'):
+        clauses.append("logs.timestamp < %s")
+        params.append(parse_date(filters['date_to']) + timedelta(days=1))
+
+    return " AND ".join(clauses), params
+
+
+def build_work_day_where(filters):
+    """WHERE clause (work_days joined with users) for the payroll summary.
+
+    Same username and date filters as build_log_where, on work_date; the
+    action type does not apply to a daily rollup.
+    """
+    clauses = ["1=1"]
+    params = []
+
+    if filters.get('username'):
+        clauses.append("users.username LIKE %s")
+        params.append(f"%{filters['username']}%")
+
+    if filters.get('date_from'):
+        clauses.append("work_days.work_date >= %s")
+        params.append(parse_date(filters['date_from']).date())
+
+    if filters.get('date_to'):
+        clauses.append("work_days.work_date <= %s")
+        params.append(parse_date(filters['date_to']).date())
+
+    return " AND ".join(clauses), params
+
+
+# --- Keyset pagination on (timestamp, id) ---
+
+def encode_cursor(row, order):
+    """Opaque token pointing just past row in the given sort order."""
+    payload = {'t': row['timestamp'].strftime(TIMESTAMP_FORMAT), 'i': row['id'], 'o': order}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, order):
+    """(timestamp, id) from a token made by encode_cursor. Raises ValueError if invalid."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        position = (datetime.strptime(payload['t'], TIMESTAMP_FORMAT), int(payload['i']))
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Cursor inválido')
+    if payload.get('o') != order:
+        raise ValueError('El cursor no corresponde al orden solicitado')
+    return position
+
+
+def keyset_page(order, after=None):
+    """Extra WHERE clause, its params and the ORDER BY for one page.
+
+    Rows are ordered by (timestamp, id) so ties on the timestamp are stable;
+    the (timestamp) index already carries the primary key, so the page is a
+    range scan that starts at the cursor instead of skipping OFFSET rows.
+    """
+    direction, op = ('DESC', '<') if order == 'desc' else ('ASC', '>')
+    order_by = f"ORDER BY logs.timestamp {direction}, logs.id {direction}"
+    if after is None:
+        return "", [], order_by
+    timestamp, log_id = after
+    clause = f" AND (logs.timestamp {op} %s OR (logs.timestamp = %s AND logs.id {op} %s))"
+    return clause, [timestamp, timestamp, log_id], order_by
+
+
+def estimate_count(cursor, where, params):
+    """Optimizer row estimate for the filtered logs (EXPLAIN, no table scan)."""
+    cursor.execute(
+        f"EXPLAIN SELECT logs.id FROM logs JOIN users ON logs.user_id = users.id WHERE {where}",
+        tuple(params))
+    estimate = 1
+    for row in cursor.fetchall():
+        estimate *= max(int(row.get('rows') or 1), 1) * float(row.get('filtered') or 100) / 100
+    return int(estimate)
@@ -0,0 +1,284 @@
+"""Request and scan metrics in the Prometheus text format, across gunicorn workers.
+
+Each worker counts in memory and a background thread writes a snapshot to
+METRICS_DIR/worker-<process>.json every WRITE_INTERVAL seconds (and /metrics
+writes its own before reading). /metrics merges every snapshot: counters
+and histograms are summed, including those of workers that have exited,
+so totals never go backwards; gauges only count live workers. A worker
+starting up folds the snapshots of dead workers into one file. <process>
+is the pid plus the boot id and the process start time (Linux), so a pid
+reused after a restart never takes over a dead worker's file.
+
+/metrics answers an admin session, or a scraper sending
+`Authorization: Bearer <METRICS_TOKEN>`. Without METRICS_TOKEN set there
+is no scraper access.
+
+    http_requests_total{endpoint,method,status}
+    http_request_duration_seconds{endpoint,method}   histogram
+    http_requests_in_flight{endpoint}                gauge
+    scans_total{action,result}
+    face_matches_total{outcome}
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join('instance', 'metrics'))
+WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 1))
+# Seconds; the PDF and export routes take whole seconds, scans milliseconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DEAD = 'dead.json'
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests served, by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time from the start of a request to its teardown.'),
+    'http_requests_in_flight': ('gauge', 'Requests being served right now.'),
+    'scans_total': ('counter', 'Scans by action and result (created, duplicate, rejected, error).'),
+    'face_matches_total': ('counter', 'Faces sent to identify, by outcome (matched, unknown).'),
+}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def _boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()[:8]
+    except OSError:
+        return None
+
+
+BOOT_ID = _boot_id()
+
+
+def process_token(pid):
+    """pid-boot-starttime identifying one process for good, or None without /proc."""
+    if BOOT_ID is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name (field 2) may hold spaces; starttime is field 22
+    return f'{pid}-{BOOT_ID}-{stat.rsplit(")", 1)[1].split()[19]}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _alive(snapshot):
+    """Whether the process that wrote snapshot still runs (not just its pid)."""
+    pid = snapshot.get('pid')
+    if pid is None or not _pid_alive(pid):
+        return False
+    current = process_token(pid)
+    return current is None or snapshot.get('process', current) == current
+
+
+def merge(total, snapshot, gauges=True):
+    """Add a snapshot (as written to disk) into total, in place."""
+    for name, labels, value in snapshot['counters']:
+        key = _key(name, dict(labels))
+        total['counters'][key] = total['counters'].get(key, 0) + value
+    for name, labels, buckets, sum_, count in snapshot['histograms']:
+        key = _key(name, dict(labels))
+        old = total['histograms'].get(key)
+        if old is None:
+            total['histograms'][key] = [list(buckets), sum_, count]
+        else:
+            old[0] = [a + b for a, b in zip(old[0], buckets)]
+            old[1] += sum_
+            old[2] += count
+    if gauges:
+        for name, labels, value in snapshot['gauges']:
+            key = _key(name, dict(labels))
+            total['gauges'][key] = total['gauges'].get(key, 0) + value
+
+
+def _empty():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def _serialize(data, pid=None, process=None):
+    return {
+        'pid': pid,
+        'process': process,
+        'counters': [[name, list(labels), value] for (name, labels), value in data['counters'].items()],
+        'gauges': [[name, list(labels), value] for (name, labels), value in data['gauges'].items()],
+        'histograms': [[name, list(labels), h[0], h[1], h[2]] for (name, labels), h in data['histograms'].items()],
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, directory=METRICS_DIR, write_interval=WRITE_INTERVAL, buckets=BUCKETS):
+        self.directory = os.path.abspath(directory)
+        self.write_interval = write_interval
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._data = _empty()
+        self._pid = None
+        self._process = None
+        self._thread = None
+
+    # --- Recording ---
+
+    def inc(self, name, labels=None, value=1):
+        key = _key(name, labels)
+        with self._lock:
+            self._data['counters'][key] = self._data['counters'].get(key, 0) + value
+
+    def gauge_add(self, name, labels=None, value=1):
+        key = _key(name, labels)
+        with self._lock:
+            self._data['gauges'][key] = self._data['gauges'].get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = _key(name, labels)
+        with self._lock:
+            h = self._data['histograms'].get(key)
+            if h is None:
+                h = self._data['histograms'][key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    h[0][i] += 1
+                    break
+            h[1] += value
+            h[2] += 1
+
+    # --- Sharing between workers ---
+
+    def start(self):
+        """Start this worker's snapshot writer (once per process)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Inherited through fork: the parent's numbers are not ours
+                self._data = _empty()
+            self._pid = os.getpid()
+            # Without /proc, a random suffix still keeps a reused pid apart
+            self._process = process_token(self._pid) or f'{self._pid}-{uuid.uuid4().hex[:8]}'
+            os.makedirs(self.directory, exist_ok=True)
+            self._fold_dead()
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread.start()
+
+    def write(self):
+        with self._lock:
+            snapshot = _serialize(self._data, self._pid, self._process)
+        path = os.path.join(self.directory, f'worker-{self._process}.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def collect(self):
+        """Every worker's numbers merged (this one's as of now)."""
+        self.start()
+        self.write()
+        total = _empty()
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue            # folded or being replaced meanwhile
+            merge(total, snapshot, gauges=_alive(snapshot))
+        return total
+
+    def render(self):
+        total = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                for (metric, labels), (buckets, sum_, count) in sorted(total['histograms'].items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(self.buckets, buckets):
+                        cumulative += n
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", _number(float(bound))),))} '
+                                     f'{cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_number(float(sum_))}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {count}')
+            else:
+                values = total['counters'] if kind == 'counter' else total['gauges']
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    # --- Internals ---
+
+    def _run(self):
+        while True:
+            time.sleep(self.write_interval)
+            try:
+                self.write()
+            except OSError:
+                pass                # e.g. the directory was removed; retried next time
+
+    def _fold_dead(self):
+        """Merge the snapshots of exited workers into DEAD (one worker at a time)."""
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead_path = os.path.join(self.directory, DEAD)
+            total = _empty()
+            if os.path.exists(dead_path):
+                with open(dead_path) as f:
+                    merge(total, json.load(f))
+            folded = []
+            for name in os.listdir(self.directory):
+                if not (name.startswith('worker-') and name.endswith('.json')):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if _alive(snapshot):
+                    continue
+                merge(total, snapshot, gauges=False)
+                folded.append(path)
+            if not folded:
+                return
+            tmp = dead_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(_serialize(total), f, separators=(',', ':'))
+            # Written before the workers' files go: a reader may count one twice, never lose it
+            os.replace(tmp, dead_path)
+            for path in folded:
+                os.remove(path)
+
+
+metrics = Metrics()
@@ -0,0 +1,77 @@
+"""Apply pending schema migrations (see migrations/).
+
+    python migrate.py            # apply everything pending
+    python migrate.py --status   # list applied / pending migrations
+
+Applied versions are recorded in schema_migrations, so running it again is a
+no-op. A MySQL named lock keeps two deploys from migrating at the same time.
+"""
+import argparse
+
+import pymysql
+
+from db import DB_CONFIG
+from migrations import discover
+
+LOCK_NAME = 'qr_entry_schema_migrations'
+
+def ensure_version_table(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `schema_migrations` ("
+        "  `version` int(11) NOT NULL,"
+        "  `name` varchar(100) NOT NULL,"
+        "  `applied_at` datetime DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`version`)"
+        ") ENGINE=InnoDB")
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {r['version'] for r in cursor.fetchall()}
+
+def run(conn, verbose=True):
+    """Apply pending migrations on an open connection; returns the versions applied."""
+    done = []
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, 60) AS locked", (LOCK_NAME,))
+        if not cursor.fetchone()['locked']:
+            raise RuntimeError("Another migration run holds the lock")
+        try:
+            ensure_version_table(cursor)
+            applied = applied_versions(cursor)
+            for version, name, module in discover():
+                if version in applied:
+                    continue
+                if verbose:
+                    print(f"Applying {version:04d}_{name}...")
+                module.up(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                done.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+    if verbose:
+        print(f"{len(done)} migration(s) applied." if done else "Schema is up to date.")
+    return done
+
+def status(conn):
+    with conn.cursor() as cursor:
+        ensure_version_table(cursor)
+        applied = applied_versions(cursor)
+    for version, name, module in discover():
+        mark = 'applied' if version in applied else 'pending'
+        print(f"{version:04d}_{name:<30} {mark}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument('--status', action='store_true', help='only list migrations')
+    args = parser.parse_args()
+
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        if args.status:
+            status(conn)
+        else:
+            run(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,77 @@
+"""Convert users.face_descriptor (JSON) into users.face_vector (packed float32).
+
+Online and resumable: migrate.py adds the column (instantly on MySQL
+8.0.29+, otherwise built in place without blocking writes), then rows are
+converted in small keyset-ordered chunks, each in its own short
+transaction, so the users table is never locked. A converted row has its
+JSON cleared, which is what makes a re-run pick up exactly where the last
+one stopped. The app reads both formats in the meantime.
+
+    python migrate_face_vectors.py [--chunk 500] [--sleep 0.05]
+"""
+import argparse
+import time
+
+import pymysql
+
+from db import DB_CONFIG
+from descriptors import encode_descriptor
+from migrations import column_exists
+
+def has_column(conn):
+    with conn.cursor() as cursor:
+        return column_exists(cursor, 'users', 'face_vector')
+
+def convert(conn, chunk, pause):
+    converted = failed = 0
+    last_id = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, face_descriptor FROM users "
+                "WHERE id > %s AND face_descriptor IS NOT NULL ORDER BY id LIMIT %s",
+                (last_id, chunk))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            updates = []
+            for row in rows:
+                try:
+                    updates.append((encode_descriptor(row['face_descriptor']), row['id']))
+                except (ValueError, TypeError) as e:
+                    failed += 1
+                    print(f"  user {row['id']}: skipped ({e})")
+
+            # face_vector IS NULL: never overwrite a face the app saved meanwhile
+            cursor.executemany(
+                "UPDATE users SET face_vector = %s, face_descriptor = NULL "
+                "WHERE id = %s AND face_vector IS NULL",
+                updates)
+            # Rows that already had a face_vector are not counted
+            converted += cursor.rowcount if updates else 0
+        conn.commit()
+        print(f"  converted up to id {last_id} ({converted} rows)")
+        if pause:
+            time.sleep(pause)
+    return converted, failed
+
+def migrate(chunk, pause):
+    print("Connecting to DB...")
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        if not has_column(conn):
+            print("users.face_vector is missing: run `python migrate.py` first.")
+            return
+        converted, failed = convert(conn, chunk, pause)
+        print(f"Migration complete: {converted} converted, {failed} skipped.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunk', type=int, default=500, help='rows per transaction')
+    parser.add_argument('--sleep', type=float, default=0.05, help='pause between chunks (seconds)')
+    args = parser.parse_args()
+    migrate(args.chunk, args.sleep)
@@ -0,0 +1,26 @@
+"""users and logs tables as originally created by setup_db.py."""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `users` ("
+        "  `id` int(11) NOT NULL AUTO_INCREMENT,"
+        "  `username` varchar(50) NOT NULL,"
+        "  `password_hash` varchar(255) DEFAULT NULL,"
+        "  `role` enum('admin','employee','supervisor') NOT NULL DEFAULT 'employee',"
+        "  `qr_code_data` varchar(255) NOT NULL,"
+        "  PRIMARY KEY (`id`),"
+        "  UNIQUE KEY `username` (`username`)"
+        ") ENGINE=InnoDB")
+
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `logs` ("
+        "  `id` int(11) NOT NULL AUTO_INCREMENT,"
+        "  `user_id` int(11) NOT NULL,"
+        "  `type` enum('entry','exit','start_lunch','end_lunch') NOT NULL,"
+        "  `timestamp` datetime DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`id`),"
+        "  KEY `user_id` (`user_id`),"
+        "  CONSTRAINT `logs_ibfk_1` FOREIGN KEY (`user_id`) "
+        "     REFERENCES `users` (`id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB")
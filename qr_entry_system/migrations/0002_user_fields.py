@@ -0,0 +1,7 @@
+"""cedula and area columns (formerly add_user_fields.py)."""
+from migrations import add_column
+
+
+def up(cursor):
+    add_column(cursor, 'users', 'cedula', "varchar(20) DEFAULT NULL AFTER `role`")
+    add_column(cursor, 'users', 'area', "varchar(100) DEFAULT NULL AFTER `cedula`")
@@ -0,0 +1,11 @@
+"""supervisor role (formerly fix_role_enum.py)."""
+
+
+def up(cursor):
+    cursor.execute(
+        "SELECT COLUMN_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND COLUMN_NAME = 'role'")
+    if 'supervisor' not in cursor.fetchone()['COLUMN_TYPE']:
+        cursor.execute(
+            "ALTER TABLE users MODIFY COLUMN role "
+            "ENUM('admin', 'employee', 'supervisor') NOT NULL DEFAULT 'employee'")
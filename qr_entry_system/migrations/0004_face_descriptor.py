@@ -0,0 +1,6 @@
+"""Legacy JSON face descriptor column (formerly migrate_db.py)."""
+from migrations import add_column
+
+
+def up(cursor):
+    add_column(cursor, 'users', 'face_descriptor', "JSON DEFAULT NULL AFTER `qr_code_data`")
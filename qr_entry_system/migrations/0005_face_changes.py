@@ -0,0 +1,20 @@
+"""Versioned face descriptor feed (formerly add_face_changes.py)."""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `face_changes` ("
+        "  `version` bigint NOT NULL AUTO_INCREMENT,"
+        "  `user_id` int(11) NOT NULL,"
+        "  `deleted` tinyint(1) NOT NULL DEFAULT 0,"
+        "  `changed_at` datetime DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`version`),"
+        "  KEY `user_version` (`user_id`, `version`)"
+        ") ENGINE=InnoDB")
+
+    # Seed one version per enrolled face so deltas can tell added from changed
+    cursor.execute("SELECT COUNT(*) AS n FROM face_changes")
+    if cursor.fetchone()['n'] == 0:
+        cursor.execute(
+            "INSERT INTO face_changes (user_id) "
+            "SELECT id FROM users WHERE face_descriptor IS NOT NULL ORDER BY id")
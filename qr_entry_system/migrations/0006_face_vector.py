@@ -0,0 +1,20 @@
+"""Packed float32 face column; migrate_face_vectors.py converts existing rows."""
+import pymysql
+
+from migrations import column_exists
+
+
+def up(cursor):
+    if column_exists(cursor, 'users', 'face_vector'):
+        return
+    # INSTANT needs MySQL 8.0.29+ for a column placed AFTER another; older servers build it in place
+    for algorithm in ("ALGORITHM=INSTANT", "ALGORITHM=INPLACE, LOCK=NONE"):
+        try:
+            cursor.execute(
+                "ALTER TABLE users ADD COLUMN face_vector VARBINARY(512) DEFAULT NULL "
+                f"AFTER face_descriptor, {algorithm}")
+            return
+        except pymysql.MySQLError as e:
+            if e.args[0] != 1846:  # Algorithm not supported by this server
+                raise
+    raise RuntimeError("Server cannot add users.face_vector online")
@@ -0,0 +1,23 @@
+"""Indexes for date-range log reports and the per-scan QR lookup.
+
+Reports filter on half-open timestamp ranges, optionally narrowed by user or
+action type; log_scan looks users up by qr_code_data.
+"""
+from migrations import add_index, drop_index
+
+
+def up(cursor):
+    add_index(cursor, 'logs', 'idx_logs_timestamp', '(`timestamp`)')
+    add_index(cursor, 'logs', 'idx_logs_user_timestamp', '(`user_id`, `timestamp`)')
+    add_index(cursor, 'logs', 'idx_logs_type_timestamp', '(`type`, `timestamp`)')
+    # The foreign key is now served by idx_logs_user_timestamp
+    drop_index(cursor, 'logs', 'user_id')
+
+    cursor.execute(
+        "SELECT qr_code_data, COUNT(*) AS n FROM users GROUP BY qr_code_data HAVING n > 1 LIMIT 5")
+    duplicates = cursor.fetchall()
+    if duplicates:
+        raise RuntimeError(
+            "Duplicate users.qr_code_data values must be fixed before adding the unique index: "
+            + ', '.join(d['qr_code_data'] for d in duplicates))
+    add_index(cursor, 'users', 'uq_users_qr_code_data', '(`qr_code_data`)', unique=True)
@@ -0,0 +1,20 @@
+"""Per-user daily payroll rollup maintained by work_days.py.
+
+Existing history is filled in by rebuild_work_days.py.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `work_days` ("
+        "  `user_id` int(11) NOT NULL,"
+        "  `work_date` date NOT NULL,"
+        "  `worked_seconds` int unsigned NOT NULL DEFAULT 0,"
+        "  `sunday_holiday_seconds` int unsigned NOT NULL DEFAULT 0,"
+        "  `overtime_seconds` int unsigned NOT NULL DEFAULT 0,"
+        "  `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`user_id`, `work_date`),"
+        "  KEY `idx_work_days_date` (`work_date`),"
+        "  CONSTRAINT `work_days_user_fk` FOREIGN KEY (`user_id`) "
+        "     REFERENCES `users` (`id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB")
@@ -0,0 +1,18 @@
+"""Revoked signed QR tokens (see qr_tokens.py).
+
+A row invalidates every token of user_id issued before revoked_before (epoch
+milliseconds). The auto-increment id is the version workers sync from.
+No foreign key: deleting a user records a revocation that must outlive it.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `qr_revocations` ("
+        "  `id` bigint unsigned NOT NULL AUTO_INCREMENT,"
+        "  `user_id` int(11) NOT NULL,"
+        "  `revoked_before` bigint unsigned NOT NULL,"
+        "  `created_at` datetime DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`id`),"
+        "  KEY `idx_qr_revocations_user` (`user_id`)"
+        ") ENGINE=InnoDB")
@@ -0,0 +1,15 @@
+"""Named change counters, bumped in the same transaction as the change.
+
+'users' tells the per-worker user cache (user_cache.py) that some user's
+username or QR code changed.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `counters` ("
+        "  `name` varchar(64) NOT NULL,"
+        "  `value` bigint unsigned NOT NULL DEFAULT 0,"
+        "  PRIMARY KEY (`name`)"
+        ") ENGINE=InnoDB")
+    cursor.execute("INSERT IGNORE INTO counters (name, value) VALUES ('users', 0)")
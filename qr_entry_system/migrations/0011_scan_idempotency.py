@@ -0,0 +1,19 @@
+"""Idempotency keys of uploaded scans (scans.record_batch).
+
+A replayed upload finds its key here and gets the original result back
+instead of a second logs row. Keys older than scans.IDEMPOTENCY_DAYS are
+pruned.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `scan_idempotency` ("
+        "  `idempotency_key` varchar(64) NOT NULL,"
+        "  `user_id` int(11) NOT NULL,"
+        "  `type` enum('entry','exit','start_lunch','end_lunch') NOT NULL,"
+        "  `timestamp` datetime NOT NULL,"
+        "  `created_at` datetime DEFAULT CURRENT_TIMESTAMP,"
+        "  PRIMARY KEY (`idempotency_key`),"
+        "  KEY `idx_scan_idempotency_created` (`created_at`)"
+        ") ENGINE=InnoDB")
@@ -0,0 +1,18 @@
+"""Last live scan per user and action, for the debounce window (scans.debounce).
+
+token identifies the scan that set scanned_at, so a scan can tell whether
+its upsert won or an earlier scan in the window is kept.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `scan_dedupe` ("
+        "  `user_id` int(11) NOT NULL,"
+        "  `type` enum('entry','exit','start_lunch','end_lunch') NOT NULL,"
+        "  `scanned_at` datetime NOT NULL,"
+        "  `token` bigint unsigned NOT NULL,"
+        "  PRIMARY KEY (`user_id`, `type`),"
+        "  CONSTRAINT `scan_dedupe_user_fk` FOREIGN KEY (`user_id`) "
+        "     REFERENCES `users` (`id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB")
@@ -0,0 +1,30 @@
+"""Current state of each user (user_status.py): in, at lunch or out.
+
+Seeded from each user's latest scan in logs. updated_at (microseconds)
+lets every worker pull just the rows changed since its last sync.
+"""
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `user_status` ("
+        "  `user_id` int(11) NOT NULL,"
+        "  `state` enum('out','in','lunch') NOT NULL DEFAULT 'out',"
+        "  `last_action` enum('entry','exit','start_lunch','end_lunch') DEFAULT NULL,"
+        "  `last_at` datetime DEFAULT NULL,"
+        "  `flag` varchar(100) DEFAULT NULL,"
+        "  `updated_at` datetime(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),"
+        "  PRIMARY KEY (`user_id`),"
+        "  KEY `idx_user_status_updated` (`updated_at`),"
+        "  CONSTRAINT `user_status_user_fk` FOREIGN KEY (`user_id`) "
+        "     REFERENCES `users` (`id`) ON DELETE CASCADE"
+        ") ENGINE=InnoDB")
+    # Latest scan per user (idx_logs_user_timestamp); IGNORE keeps one of two at the same second
+    cursor.execute(
+        "INSERT IGNORE INTO user_status (user_id, state, last_action, last_at) "
+        "SELECT logs.user_id, "
+        "  CASE logs.type WHEN 'exit' THEN 'out' WHEN 'start_lunch' THEN 'lunch' ELSE 'in' END, "
+        "  logs.type, logs.timestamp "
+        "FROM logs JOIN (SELECT user_id, MAX(timestamp) AS last_at FROM logs GROUP BY user_id) latest "
+        "  ON latest.user_id = logs.user_id AND latest.last_at = logs.timestamp "
+        "ORDER BY logs.id DESC")
@@ -0,0 +1,48 @@
+"""Monthly RANGE partitions on logs.timestamp, and log_archives (log_partitions.py).
+
+MySQL allows no foreign keys on a partitioned table and wants the
+partitioning column in every unique key: the logs -> users foreign key is
+dropped (delete_user deletes the user's logs itself; scans still go
+through user_status and scan_dedupe, which keep theirs) and the primary key
+becomes (id, timestamp). Months start at the oldest log, under an empty
+p_old. Partitioning copies the table: on a large logs table, run this in
+a maintenance window.
+"""
+from datetime import date
+
+from log_partitions import FUTURE_MONTHS, add_months, month_start, partition_definitions, partitions
+
+
+def up(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS `log_archives` ("
+        "  `month` date NOT NULL,"
+        "  `file` varchar(100) NOT NULL,"
+        "  `rows` int unsigned NOT NULL DEFAULT 0,"
+        "  `dropped` tinyint(1) NOT NULL DEFAULT 0,"
+        "  `archived_at` datetime DEFAULT NULL,"
+        "  PRIMARY KEY (`month`)"
+        ") ENGINE=InnoDB")
+    if partitions(cursor):
+        return
+
+    cursor.execute("SELECT COUNT(*) AS n FROM logs WHERE timestamp IS NULL")
+    missing = cursor.fetchone()['n']
+    if missing:
+        raise RuntimeError(f"{missing} logs have no timestamp: fix or delete them before partitioning")
+
+    cursor.execute(
+        "SELECT CONSTRAINT_NAME AS name FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'logs' AND CONSTRAINT_TYPE = 'FOREIGN KEY'")
+    for row in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE `logs` DROP FOREIGN KEY `{row['name']}`")
+
+    cursor.execute("SELECT MIN(timestamp) AS first FROM logs")
+    first = cursor.fetchone()['first']
+    current = month_start(date.today())
+    first = month_start(first) if first and first.date() < current else current
+    cursor.execute(
+        "ALTER TABLE `logs` "
+        "MODIFY `timestamp` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `timestamp`) "
+        f"PARTITION BY RANGE COLUMNS(`timestamp`) ({partition_definitions(first, add_months(current, FUTURE_MONTHS), old=True)})")
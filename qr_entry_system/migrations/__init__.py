@@ -0,0 +1,65 @@
+"""Ordered schema migrations, applied by migrate.py.
+
+Each module is named NNNN_description.py and defines up(cursor). Migrations
+must be idempotent: databases created by the old setup/ad-hoc scripts may
+already have some of the changes, so check before altering.
+"""
+import importlib
+import os
+import re
+
+MODULE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+
+def discover():
+    """[(version, name, module)] sorted by version."""
+    found = []
+    for filename in os.listdir(os.path.dirname(__file__)):
+        match = MODULE_PATTERN.match(filename)
+        if match:
+            module = importlib.import_module(f'{__name__}.{filename[:-3]}')
+            found.append((int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda m: m[0])
+    return found
+
+
+# --- Helpers for idempotent DDL ---
+
+def table_exists(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table, column):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column))
+    return cursor.fetchone() is not None
+
+
+def index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index))
+    return cursor.fetchone() is not None
+
+
+def add_column(cursor, table, column, definition):
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+
+
+def add_index(cursor, table, index, columns, unique=False):
+    """Build an index online (no table lock) unless it already exists."""
+    if not index_exists(cursor, table, index):
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        cursor.execute(f"ALTER TABLE `{table}` ADD {kind} `{index}` {columns}, ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def drop_index(cursor, table, index):
+    if index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE `{table}` DROP INDEX `{index}`, ALGORITHM=INPLACE, LOCK=NONE")
@@ -0,0 +1,138 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from operator import itemgetter
+
+# Ordinary working hours per day; anything above counts as overtime
+DAILY_LIMIT_HOURS = 8
+ONE_DAY = timedelta(days=1)
+
+# Holidays kept on their date
+FIXED_HOLIDAYS = [(1, 1), (5, 1), (7, 20), (8, 7), (12, 8), (12, 25)]
+# Holidays moved to the following Monday (Ley Emiliani, Ley 51 de 1983)
+EMILIANI_HOLIDAYS = [(1, 6), (3, 19), (6, 29), (8, 15), (10, 12), (11, 1), (11, 11)]
+# Days from Easter Sunday: Holy Thursday and Good Friday stay put, the rest
+# are already the Monday they are moved to (Ascension, Corpus Christi, Sacred Heart)
+EASTER_OFFSETS = [-3, -2, 43, 64, 71]
+
+
+def easter_sunday(year):
+    """Gregorian Easter Sunday (anonymous / Meeus-Jones-Butcher algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def next_monday(day):
+    return day + timedelta(days=(7 - day.weekday()) % 7)
+
+
+@lru_cache(maxsize=None)
+def colombian_holidays(year):
+    """Frozen set of the national holidays for year."""
+    easter = easter_sunday(year)
+    holidays = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    holidays.update(next_monday(date(year, month, day)) for month, day in EMILIANI_HOLIDAYS)
+    holidays.update(easter + timedelta(days=offset) for offset in EASTER_OFFSETS)
+    return frozenset(holidays)
+
+
+def is_sunday_or_holiday(day):
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.weekday() == 6 or day in colombian_holidays(day.year)
+
+
+def worked_segments(logs):
+    """Worked (start, end) intervals from one user's logs, sorted by timestamp ascending.
+
+    Single pass over the logs: entry opens a session, start_lunch/end_lunch
+    pause and resume it, exit closes it. An exit without an entry and a
+    session never closed are ignored; an entry while a session is already open
+    restarts it (forgotten exit or repeated scan).
+    """
+    in_session = False
+    segment_start = None  # None while out or on lunch
+
+    for log in logs:
+        kind, ts = log['type'], log['timestamp']
+        if kind == 'entry':
+            in_session, segment_start = True, ts
+        elif not in_session:
+            continue
+        elif kind == 'start_lunch':
+            if segment_start is not None:
+                yield segment_start, ts
+                segment_start = None
+        elif kind == 'end_lunch':
+            if segment_start is None:
+                segment_start = ts
+        elif kind == 'exit':
+            if segment_start is not None:
+                yield segment_start, ts
+            in_session, segment_start = False, None
+
+
+def daily_seconds(logs):
+    """{date: worked seconds} for one user's sorted logs, splitting intervals at midnight."""
+    days = {}
+    for start, end in worked_segments(logs):
+        day = start.date()
+        while start < end:
+            if end.date() == day:
+                days[day] = days.get(day, 0.0) + (end - start).total_seconds()
+                break
+            midnight = datetime.combine(day + ONE_DAY, time())
+            days[day] = days.get(day, 0.0) + (midnight - start).total_seconds()
+            start, day = midnight, day + ONE_DAY
+    return days
+
+
+def day_totals(day, seconds):
+    """(hours, Sunday/holiday hours, overtime hours) for one worked day."""
+    hours = seconds / 3600
+    return (hours,
+            hours if is_sunday_or_holiday(day) else 0.0,
+            max(hours - DAILY_LIMIT_HOURS, 0.0))
+
+
+def summarize(day_rows):
+    """Payroll totals from (hours, Sunday/holiday hours, overtime hours) per day."""
+    total = sunday_holiday = overtime = 0.0
+    for hours, holiday_hours, overtime_hours in day_rows:
+        total += hours
+        sunday_holiday += holiday_hours
+        overtime += overtime_hours
+    return {
+        'total_hours': round(total, 2),
+        'sunday_holiday_hours': round(sunday_holiday, 2),
+        'overtime_hours': round(overtime, 2),
+    }
+
+
+def user_summary(logs):
+    """Payroll totals for one user's logs, sorted by timestamp ascending.
+
+    Overtime is counted per calendar day, and a session crossing midnight
+    counts its hours on each day it touches.
+    """
+    return summarize(day_totals(day, seconds) for day, seconds in daily_seconds(logs).items())
+
+
+def payroll_summary(logs):
+    """{username: totals} for logs (dicts with username, type and timestamp) in any order."""
+    by_user = {}
+    for log in logs:
+        by_user.setdefault(log['username'], []).append(log)
+    # Timsort is linear on the already ordered (or reversed) report queries
+    return {
+        username: user_summary(sorted(user_logs, key=itemgetter('timestamp')))
+        for username, user_logs in by_user.items()
+    }
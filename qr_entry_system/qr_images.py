@@ -0,0 +1,101 @@
+"""Rendered QR badge images, cached per worker and keyed by a hash of the QR data.
+
+The hash doubles as the strong ETag and as the version in the badge URL, so a
+change of qr_code_data is a new cache key and a new URL: nothing stale can be
+served, and clients may keep a versioned image forever.
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import qrcode
+
+# Rendered images kept per worker process (PNG ~0.5 KB, SVG ~2 KB each)
+CACHE_SIZE = int(os.environ.get('QR_IMAGE_CACHE_SIZE', 1024))
+BORDER = 4
+
+MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def qr_version(data):
+    """Short content hash of the QR data, used in badge URLs and ETags."""
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:20]
+
+
+def render_png(data):
+    img = qrcode.make(data, border=BORDER)
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def render_svg(data):
+    """SVG written straight from the module matrix: one path of horizontal runs.
+
+    Skips the raster image and PNG compression entirely, and is a fraction of
+    the size of qrcode's per-module SVG output.
+    """
+    qr = qrcode.QRCode(border=BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+            else:
+                x += 1
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'width="{size * 10}" height="{size * 10}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(runs)}"/></svg>'
+    ).encode('utf-8')
+
+
+RENDERERS = {'png': render_png, 'svg': render_svg}
+
+
+class QRImageCache:
+    """LRU of rendered images keyed by (version, format)."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, data, fmt='png'):
+        """(image bytes, etag) for data in fmt, rendering it on a miss."""
+        key = (qr_version(data), fmt)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+        if image is None:
+            image = RENDERERS[fmt](data)
+            with self._lock:
+                self.misses += 1
+                self._images[key] = image
+                while len(self._images) > self.size:
+                    self._images.popitem(last=False)
+        return image, f'{fmt}-{key[0]}'
+
+    def invalidate(self, data):
+        """Drop the images of a QR code that was replaced."""
+        version = qr_version(data)
+        with self._lock:
+            for fmt in RENDERERS:
+                self._images.pop((version, fmt), None)
+
+
+qr_images = QRImageCache()
@@ -0,0 +1,187 @@
+"""Signed QR tokens: the scan path resolves the user without a database lookup.
+
+    qr1.<kid>.<payload>.<signature>
+
+payload is the base64url of the user id (uint32) and the issue time in
+milliseconds (uint64); signature is HMAC-SHA256 over everything before it,
+truncated to 128 bits, with the key named by kid. Keys come from
+QR_SIGNING_KEYS ("kid:secret,kid:secret", the first one signs, the rest
+only verify, which is how keys are rotated) or, when that is not set, from a
+key file generated once under instance/.
+
+A token is revoked by recording that every token of the user issued before
+some instant is invalid (qr_revocations). Each worker mirrors that table in
+memory and pulls new rows every REVOCATION_SYNC_INTERVAL seconds.
+
+Codes issued before this format (user:<name>:<hex>) are still accepted by
+log_scan through the qr_code_data lookup.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+
+PREFIX = 'qr1'
+PAYLOAD = struct.Struct('>IQ')
+SIGNATURE_BYTES = 16
+KEYS_PATH = os.environ.get('QR_KEYS_PATH', os.path.join('instance', 'qr_signing_keys.json'))
+REVOCATION_SYNC_INTERVAL = float(os.environ.get('QR_REVOCATION_SYNC_INTERVAL', 2))
+SYNC_OVERLAP = 32
+# revoked_before value that rejects every token of a user (deleted accounts)
+REVOKE_ALL = 2 ** 63 - 1
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class KeystoreError(RuntimeError):
+    """The signing keys could not be loaded (bad QR_SIGNING_KEYS, unreadable key file)."""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def is_signed(qr_data):
+    return qr_data.startswith(PREFIX + '.')
+
+
+def parse_keys(spec):
+    """'kid:secret,kid:secret' -> (active kid, {kid: secret bytes})."""
+    keys = {}
+    active = None
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        kid, sep, secret = item.partition(':')
+        if not sep or not kid.isalnum() or not secret:
+            raise ValueError(f'Invalid QR signing key entry: {item.split(":")[0]}')
+        keys[kid] = secret.encode('utf-8')
+        active = active or kid
+    if not keys:
+        raise ValueError('QR_SIGNING_KEYS has no keys')
+    return active, keys
+
+
+def load_keys(path=KEYS_PATH):
+    """Keys from QR_SIGNING_KEYS, else from (or into) a generated key file."""
+    spec = os.environ.get('QR_SIGNING_KEYS')
+    if spec:
+        return parse_keys(spec)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # O_EXCL: the first worker to get here creates it, the others read it
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path) as f:
+            data = json.load(f)
+    else:
+        data = {'active': 'k1', 'keys': {'k1': secrets.token_hex(32)}}
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+    return data['active'], {kid: secret.encode('utf-8') for kid, secret in data['keys'].items()}
+
+
+class QRTokens:
+    def __init__(self, active=None, keys=None, sync_interval=REVOCATION_SYNC_INTERVAL):
+        self._active = active
+        self._keys = keys
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._revoked = {}          # user_id -> tokens issued before this (ms) are invalid
+        self._revocation_version = 0
+        self.synced_at = None
+
+    def _key_set(self):
+        if self._keys is None:
+            try:
+                self._active, self._keys = load_keys()
+            except (OSError, ValueError, KeyError) as e:
+                raise KeystoreError(f'QR signing keys unavailable: {e}') from e
+        return self._active, self._keys
+
+    def _sign(self, key, message):
+        return hmac.new(key, message.encode('ascii'), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+    def issue(self, user_id, issued_at=None):
+        active, keys = self._key_set()
+        payload = _b64encode(PAYLOAD.pack(user_id, now_ms() if issued_at is None else issued_at))
+        message = f'{PREFIX}.{active}.{payload}'
+        return f'{message}.{_b64encode(self._sign(keys[active], message))}'
+
+    def verify(self, token):
+        """(user_id, issued_at ms, kid) of a valid, unrevoked token. Raises InvalidToken."""
+        try:
+            prefix, kid, payload, signature = token.split('.')
+        except ValueError:
+            raise InvalidToken('Código QR inválido')
+        _, keys = self._key_set()
+        if prefix != PREFIX or kid not in keys:
+            raise InvalidToken('Código QR inválido')
+        try:
+            expected = self._sign(keys[kid], f'{prefix}.{kid}.{payload}')
+            valid = hmac.compare_digest(expected, _b64decode(signature))
+            user_id, issued_at = PAYLOAD.unpack(_b64decode(payload))
+        except (ValueError, struct.error):
+            raise InvalidToken('Código QR inválido')
+        if not valid:
+            raise InvalidToken('Código QR inválido')
+        if issued_at < self._revoked.get(user_id, 0):
+            raise InvalidToken('Código QR revocado')
+        return user_id, issued_at, kid
+
+    # --- Revocations ---
+
+    def revoke(self, cursor, user_id, before=None):
+        """Invalidate user_id's tokens issued before `before` (ms; default now, REVOKE_ALL for all)."""
+        before = now_ms() if before is None else before
+        # Takes effect once committed: in each worker at its next sync()
+        cursor.execute(
+            "INSERT INTO qr_revocations (user_id, revoked_before) VALUES (%s, %s)", (user_id, before))
+        return before
+
+    def reissue(self, cursor, user_id):
+        """Revoke user_id's current tokens and store a new one in users.qr_code_data."""
+        # +1 ms: a token issued earlier in this same millisecond is revoked too
+        issued_at = self.revoke(cursor, user_id, now_ms() + 1)
+        token = self.issue(user_id, issued_at)
+        cursor.execute("UPDATE users SET qr_code_data = %s WHERE id = %s", (token, user_id))
+        return token
+
+    def sync(self, db):
+        """Pull revocations recorded (by any worker) since the last sync."""
+        with self._lock:
+            with db.cursor() as cursor:
+                # Re-read a few rows back: ids are assigned before commit, so a
+                # lower id can become visible after a higher one
+                cursor.execute(
+                    "SELECT id, user_id, revoked_before FROM qr_revocations WHERE id > %s ORDER BY id",
+                    (max(0, self._revocation_version - SYNC_OVERLAP),))
+                for row in cursor.fetchall():
+                    user_id = row['user_id']
+                    self._revoked[user_id] = max(self._revoked.get(user_id, 0), int(row['revoked_before']))
+                    self._revocation_version = max(self._revocation_version, row['id'])
+            self.synced_at = time.monotonic()
+
+    def ensure_current(self, db):
+        if self.synced_at is None or time.monotonic() - self.synced_at > self.sync_interval:
+            self.sync(db)
+        return self
+
+
+qr_tokens = QRTokens()
@@ -0,0 +1,88 @@
+"""Backfill or rebuild the work_days payroll rollup from the raw logs.
+
+log_scan and delete_log keep recent days current; run this after
+migrate.py to cover existing history, after bulk edits to logs, or when
+the holiday or overtime rules change. Each user is rebuilt one month at a
+time, in its own short transaction. Only days that still have logs are
+rebuilt: months archived by log_partitions.py keep their work_days.
+
+    python rebuild_work_days.py                       # everything
+    python rebuild_work_days.py --from 2024-01-01 --to 2024-12-31
+    python rebuild_work_days.py --user 42
+"""
+import argparse
+import time
+from datetime import timedelta
+
+import pymysql
+
+from db import DB_CONFIG
+from log_queries import parse_date
+from migrations import table_exists
+from report_cache import report_cache
+from work_days import refresh_days
+
+
+def month_windows(first_day, last_day):
+    start = first_day
+    while start <= last_day:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end = min(next_month - timedelta(days=1), last_day)
+        yield start, end
+        start = next_month
+
+
+def log_range(cursor, user_id):
+    cursor.execute(
+        "SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM logs WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    if row['first'] is None:
+        return None
+    return row['first'].date(), row['last'].date()
+
+
+def rebuild(conn, user_id=None, date_from=None, date_to=None, pause=0.0):
+    with conn.cursor() as cursor:
+        if user_id is not None:
+            user_ids = [user_id]
+        else:
+            cursor.execute("SELECT id FROM users ORDER BY id")
+            user_ids = [r['id'] for r in cursor.fetchall()]
+
+    days = 0
+    for uid in user_ids:
+        with conn.cursor() as cursor:
+            found = log_range(cursor, uid)
+        if found is None:
+            continue
+        first_day = max(found[0], date_from) if date_from else found[0]
+        last_day = min(found[1], date_to) if date_to else found[1]
+        for start, end in month_windows(first_day, last_day):
+            with conn.cursor() as cursor:
+                days += refresh_days(cursor, uid, start, end)
+            conn.commit()
+            if pause:
+                time.sleep(pause)
+        print(f"  user {uid}: rebuilt {first_day} .. {last_day}")
+    return days
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--from', dest='date_from', type=lambda v: parse_date(v).date(), help='YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', type=lambda v: parse_date(v).date(), help='YYYY-MM-DD')
+    parser.add_argument('--user', type=int, help='only this user id')
+    parser.add_argument('--sleep', type=float, default=0.0, help='pause between transactions (seconds)')
+    args = parser.parse_args()
+
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            if not table_exists(cursor, 'work_days'):
+                raise SystemExit("work_days is missing: run `python migrate.py` first.")
+        total = rebuild(conn, args.user, args.date_from, args.date_to, args.sleep)
+        # Cached PDFs carry the old summaries
+        report_cache.clear()
+        print(f"Rebuild complete: {total} work day(s) written.")
+    finally:
+        conn.close()
@@ -0,0 +1,51 @@
+"""Replace QR codes with signed tokens (see qr_tokens.py).
+
+By default converts only users still on the old user:<name>:<hex> codes;
+their badges change, so print or send the new ones afterwards. --user
+reissues one user's code whatever its format (lost or shared badge). The
+signing keys must be the ones the app uses (QR_SIGNING_KEYS or the same
+instance/ key file).
+
+    python reissue_qr_tokens.py                # every legacy code
+    python reissue_qr_tokens.py --user 42
+"""
+import argparse
+
+import pymysql
+
+from db import DB_CONFIG
+from migrations import table_exists
+from qr_tokens import qr_tokens, PREFIX
+from user_cache import record_user_change
+
+
+def legacy_users(cursor):
+    cursor.execute("SELECT id FROM users WHERE qr_code_data NOT LIKE %s ORDER BY id", (PREFIX + '.%',))
+    return [r['id'] for r in cursor.fetchall()]
+
+
+def reissue(conn, user_ids):
+    for uid in user_ids:
+        with conn.cursor() as cursor:
+            qr_tokens.reissue(cursor, uid)
+            # Running workers drop the old code -> user mapping
+            record_user_change(cursor)
+        conn.commit()
+    return len(user_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user', type=int, help='reissue only this user id')
+    args = parser.parse_args()
+
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            if not table_exists(cursor, 'qr_revocations'):
+                raise SystemExit("qr_revocations is missing: run `python migrate.py` first.")
+            user_ids = [args.user] if args.user is not None else legacy_users(cursor)
+        total = reissue(conn, user_ids)
+        print(f"Reissued {total} QR code(s).")
+    finally:
+        conn.close()
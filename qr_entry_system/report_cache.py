@@ -0,0 +1,170 @@
+"""On-disk cache of generated reports (CSV and PDF).
+
+An entry is keyed by the normalized filters, the format and a watermark of
+the logs in range: row count, highest id and XOR of the ids. Logs are only
+ever inserted (new, higher ids) or deleted, so any change in range changes
+the watermark and the old entry is simply never looked up again. The
+payroll PDF's summary comes from work_days, which also depends on logs
+outside the filters (a shift that began before date_from, any action
+type): its watermark adds a digest of those work_days rows. Whoever
+writes an entry computes the watermark in the same consistent snapshot as
+the report itself. Entries are evicted least recently used first once the
+directory grows past max_bytes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+from log_queries import LOG_FILTERS, build_log_where, build_work_day_where, parse_date
+
+CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', os.path.join('instance', 'report_cache'))
+MAX_BYTES = int(float(os.environ.get('REPORT_CACHE_MAX_MB', 200)) * 1024 * 1024)
+
+
+def normalize_filters(filters):
+    """Canonical filter values, so equivalent requests share an entry."""
+    normalized = {}
+    for name in LOG_FILTERS:
+        value = (filters.get(name) or '').strip()
+        if name == 'username':
+            # LIKE with the default collation ignores case
+            value = value.lower()
+        elif name in ('date_from', 'date_to') and value:
+            value = parse_date(value).date().isoformat()
+        normalized[name] = value
+    return normalized
+
+
+def watermark(cursor, where, params):
+    cursor.execute(
+        f"SELECT COUNT(*) AS n, COALESCE(MAX(logs.id), 0) AS max_id, COALESCE(BIT_XOR(logs.id), 0) AS id_xor "
+        f"FROM logs JOIN users ON logs.user_id = users.id WHERE {where}",
+        tuple(params))
+    row = cursor.fetchone()
+    return [int(row['n']), int(row['max_id']), int(row['id_xor'])]
+
+
+def rollup_watermark(cursor, where, params):
+    """Row count and XOR of per-row checksums of the work_days a payroll summary sums."""
+    cursor.execute(
+        f"SELECT COUNT(*) AS n, COALESCE(BIT_XOR(CRC32(CONCAT_WS(',', work_days.user_id, work_days.work_date, "
+        f"work_days.worked_seconds, work_days.sunday_holiday_seconds, work_days.overtime_seconds))), 0) AS digest "
+        f"FROM work_days JOIN users ON work_days.user_id = users.id WHERE {where}",
+        tuple(params))
+    row = cursor.fetchone()
+    return [int(row['n']), int(row['digest'])]
+
+
+def pdf_watermark(cursor, filters):
+    """Watermark of the payroll PDF: its log listing plus the rollup behind its summary."""
+    where, params = build_log_where(filters)
+    summary_where, summary_params = build_work_day_where(filters)
+    return watermark(cursor, where, params) + rollup_watermark(cursor, summary_where, summary_params)
+
+
+def cache_key(filters, fmt, mark):
+    payload = json.dumps({'filters': normalize_filters(filters), 'format': fmt, 'watermark': mark},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        # Absolute: send_file resolves relative paths against the app root
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f'{key}.{fmt}')
+
+    def get(self, key, fmt):
+        """Path of a cached report, or None. A hit refreshes its LRU position."""
+        path = self.path(key, fmt)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def open(self, key, fmt):
+        """A cached report opened for reading, or None. A hit refreshes its LRU position.
+
+        Send the handle rather than the path: it stays readable even if
+        another worker evicts the entry before the response is written.
+        """
+        try:
+            f = open(self.path(key, fmt), 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(f.fileno())
+        return f
+
+    def store(self, key, fmt, src):
+        """Copy a finished report into the cache."""
+        with self.writer(key, fmt) as f, open(src, 'rb') as source:
+            shutil.copyfileobj(source, f)
+
+    @contextmanager
+    def writer(self, key, fmt):
+        """Binary file to write a report into; published only if the block completes."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                yield f
+            os.replace(tmp, self.path(key, fmt))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        # The caller is about to serve it, even if it alone is over the limit
+        self.evict(keep=f'{key}.{fmt}')
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until under max_bytes, never the one named keep."""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        removed = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Drop every entry (e.g. a rename changes reports without touching logs)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.startswith('.'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+report_cache = ReportCache()
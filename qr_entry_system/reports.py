@@ -0,0 +1,64 @@
+"""Report generation outside the request cycle (runs in the jobs.py worker processes)."""
+import os
+
+import pymysql
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from xhtml2pdf import pisa
+
+from db import DB_CONFIG
+from log_partitions import iter_archived
+from log_queries import build_log_where, build_work_day_where
+from report_cache import cache_key, pdf_watermark, report_cache
+from work_days import payroll_from_rollup
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Same autoescaping Flask applies to .html templates
+_env = Environment(loader=FileSystemLoader(TEMPLATES), autoescape=select_autoescape(['html']))
+
+
+def payroll_pdf(filters, out_path, progress):
+    """Write the payroll/log PDF for filters to out_path.
+
+    progress(fraction, message) is called between stages. Returns the
+    (download filename, mimetype) of the result.
+    """
+    where, params = build_log_where(filters)
+    summary_where, summary_params = build_work_day_where(filters)
+
+    progress(0.05, 'Consultando registros')
+    conn = pymysql.connect(**DB_CONFIG)
+    try:
+        with conn.cursor() as cursor:
+            # Rows, summary and cache watermark all from one snapshot
+            cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+            mark = pdf_watermark(cursor, filters)
+            cursor.execute(
+                f"SELECT logs.id, users.username, logs.type, logs.timestamp "
+                f"FROM logs JOIN users ON logs.user_id = users.id "
+                f"WHERE {where} ORDER BY logs.timestamp DESC",
+                tuple(params))
+            logs = cursor.fetchall()
+            # Older than every live row, so the order holds
+            logs.extend(dict(zip(('id', 'username', 'type', 'timestamp'), row))
+                        for row in iter_archived(conn, filters))
+            progress(0.3, 'Calculando nómina')
+            summary = payroll_from_rollup(cursor, summary_where, summary_params)
+    finally:
+        conn.close()
+
+    progress(0.4, f'Generando PDF ({len(logs)} registros)')
+    html_content = _env.get_template('pdf_report.html').render(logs=logs, summary=summary)
+    with open(out_path, 'wb') as f:
+        pisa_status = pisa.CreatePDF(src=html_content, dest=f)
+    if pisa_status.err:
+        raise RuntimeError('Error generating PDF')
+    report_cache.store(cache_key(filters, 'pdf', mark), 'pdf', out_path)
+    progress(1.0, 'Listo')
+    return 'reporte_nomina.pdf', 'application/pdf'
+
+
+# Job kind -> function(params, out_path, progress) used by jobs.JobQueue
+JOB_KINDS = {
+    'payroll_pdf': payroll_pdf,
+}
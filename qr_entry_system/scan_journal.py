@@ -0,0 +1,340 @@
+"""Write-behind mode for live scans (SCAN_WRITE_BEHIND=1).
+
+log_scan appends the scan to a local append-only journal and answers once
+the line is fsync'd; a background thread writes the journaled scans to logs
+every FLUSH_MS milliseconds, or as soon as FLUSH_ROWS are waiting, in one
+transaction per batch. Concurrent scans share a single fsync (whoever syncs
+covers every line written before it), so neither the journal nor MySQL
+pays one flush per scan.
+
+Each worker writes its own segment files and holds an exclusive flock on
+them; a segment is deleted only after its scans are committed. A segment
+nobody holds a lock on belongs to a worker that died: the next worker to
+start its journal (or `python scan_journal.py`) replays it. Every scan
+carries an idempotency key (scan_idempotency), so a replay after a crash
+between commit and delete does not log anything twice.
+
+A segment that keeps failing for a reason other than the database being
+unreachable (MAX_ATTEMPTS failed flushes) is written scan by scan: the
+scans that still fail go to DEAD_DIR/<segment>.jsonl with their error
+and are logged, so one bad scan never holds back the ones behind it.
+
+Scans are stamped with this host's clock when they are journaled.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+import pymysql
+
+from db import pool
+from log_queries import TIMESTAMP_FORMAT
+from scans import debounce, remember_key, seen_keys, write_scans
+
+WRITE_BEHIND = os.environ.get('SCAN_WRITE_BEHIND', '0') == '1'
+JOURNAL_DIR = os.environ.get('SCAN_JOURNAL_DIR', os.path.join('instance', 'scan_journal'))
+FLUSH_MS = float(os.environ.get('SCAN_FLUSH_MS', 200))
+FLUSH_ROWS = int(os.environ.get('SCAN_FLUSH_ROWS', 500))
+MAX_ATTEMPTS = int(os.environ.get('SCAN_FLUSH_ATTEMPTS', 5))
+SUFFIX = '.jsonl'
+DEAD_DIR = 'dead'
+# The database or the network, not the scans: retried forever
+TRANSIENT = (pymysql.err.OperationalError, pymysql.err.InterfaceError, OSError)
+
+log = logging.getLogger('scan_journal')
+
+
+def live_users(cursor, user_ids):
+    if not user_ids:
+        return set()
+    cursor.execute(f"SELECT id FROM users WHERE id IN ({', '.join(['%s'] * len(user_ids))})", tuple(user_ids))
+    return {r['id'] for r in cursor.fetchall()}
+
+
+def write_records(records):
+    """Write journaled scans to MySQL in one transaction; returns how many were logged.
+
+    Skips scans already written (a replay), keys another worker recorded,
+    scans of users deleted since they were acknowledged and repeats inside
+    the debounce window, which the scanner was already answered for.
+    """
+    conn = pool.acquire()
+    finished = False
+    try:
+        with conn.cursor() as cursor:
+            done = seen_keys(cursor, sorted({r['k'] for r in records}))
+            live = live_users(cursor, sorted({r['u'] for r in records}))
+            rows = []
+            for r in records:
+                if r['k'] in done or r['u'] not in live:
+                    continue
+                done[r['k']] = r
+                ts = datetime.strptime(r['t'], TIMESTAMP_FORMAT)
+                original = debounce(cursor, r['u'], r['a'], ts)
+                if original is None:
+                    rows.append((r['u'], r['a'], ts, r['k']))
+                else:
+                    # A retry of the key after the window finds the scan it repeated
+                    remember_key(cursor, r['k'], r['u'], r['a'], original)
+            write_scans(cursor, rows)
+        conn.commit()
+        finished = True
+        return len(rows)
+    except pymysql.IntegrityError:
+        # Raced with a delete or another worker's key: the next flush re-checks
+        conn.rollback()
+        finished = True
+        raise
+    finally:
+        pool.release(conn, discard=not finished)
+
+
+def read_segment(fd):
+    records = []
+    with os.fdopen(os.dup(fd), 'rb') as f:
+        f.seek(0)
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A line torn by the crash was never acknowledged
+                break
+    return records
+
+
+class ScanJournal:
+    def __init__(self, directory=JOURNAL_DIR, flush_ms=FLUSH_MS, flush_rows=FLUSH_ROWS, write=write_records,
+                 max_attempts=MAX_ATTEMPTS):
+        self.directory = os.path.abspath(directory)
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.write = write
+        self.max_attempts = max_attempts
+        self._failures = {}                     # segment path -> failed flushes in a row
+        self._lock = threading.Lock()           # appends and segment swaps
+        self._wake = threading.Condition(self._lock)
+        self._sync_lock = threading.Lock()      # one fsync at a time, the others ride along
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._fd = self._path = None
+        self._pending = []                      # records of the current segment
+        self._backlog = deque()                 # (fd, path, records) rotated, not yet committed
+        self._written = self._synced = 0
+        self._stopping = False
+        self._thread = None
+        self._stats = {'appended': 0, 'flushed': 0, 'batches': 0, 'fsyncs': 0, 'replayed': 0,
+                       'errors': 0, 'last_error': None, 'dead_lettered': 0}
+
+    # --- Public API ---
+
+    def start(self):
+        """Open this worker's segment, pick up orphaned segments and start the flusher."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Inherited through fork: the parent's segment and thread are not ours
+            self._pid = os.getpid()
+            self._backlog = deque()
+            self._pending = []
+            self._stopping = False
+            os.makedirs(self.directory, exist_ok=True)
+            self._adopt_orphans()
+            self._open_segment()
+            self._thread = threading.Thread(target=self._run, name='scan-journal', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, user_id, action_type, timestamp=None, key=None):
+        """Durably journal a scan; returns its record once it is on disk."""
+        self.start()
+        ts = (timestamp or datetime.now()).replace(microsecond=0)
+        record = {'k': key or f'j-{uuid.uuid4().hex}', 'u': user_id, 'a': action_type,
+                  't': ts.strftime(TIMESTAMP_FORMAT)}
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            os.write(self._fd, line)
+            self._written += 1
+            seq = self._written
+            self._pending.append(record)
+            self._stats['appended'] += 1
+            if len(self._pending) >= self.flush_rows:
+                self._wake.notify()
+        self._sync(seq)
+        return record
+
+    def flush(self):
+        """Write everything journaled so far to MySQL; returns the number of scans written."""
+        with self._flush_lock:
+            self._rotate()
+            written = 0
+            while self._backlog:
+                fd, path, records = self._backlog[0]
+                if records:
+                    try:
+                        written += self.write(records)
+                    except Exception as e:
+                        # Kept on disk and in memory: retried on the next flush
+                        self._error(e)
+                        if isinstance(e, TRANSIENT):
+                            break
+                        self._failures[path] = self._failures.get(path, 0) + 1
+                        if self._failures[path] < self.max_attempts:
+                            break
+                        try:
+                            written += self._salvage(path, records)
+                        except TRANSIENT as e:
+                            self._error(e)
+                            break
+                    with self._lock:
+                        self._stats['flushed'] += len(records)
+                        self._stats['batches'] += 1
+                self._failures.pop(path, None)
+                self._backlog.popleft()
+                # Unlink before unlocking: a replaying worker never sees it free
+                os.remove(path)
+                os.close(fd)
+            return written
+
+    def close(self):
+        with self._lock:
+            if self._pid != os.getpid() or self._stopping:
+                return
+            self._stopping = True
+            self._wake.notify()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            if not self._pending:
+                # Nothing left in it: do not leave an empty segment to replay
+                os.remove(self._path)
+                os.close(self._fd)
+                self._pid = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending) + sum(len(b[2]) for b in self._backlog)
+        stats['write_behind'] = WRITE_BEHIND
+        return stats
+
+    # --- Internals ---
+
+    def _error(self, e):
+        with self._lock:
+            self._stats['errors'] += 1
+            self._stats['last_error'] = str(e) or type(e).__name__
+
+    def _salvage(self, path, records):
+        """Write a failing segment one scan at a time, dead-lettering the scans that fail."""
+        written, dead = 0, []
+        for record in records:
+            try:
+                written += self.write([record])
+            except TRANSIENT:
+                # Those written so far are skipped on the retry (idempotency keys)
+                raise
+            except Exception as e:
+                dead.append({'record': record, 'error': str(e) or type(e).__name__})
+        if dead:
+            directory = os.path.join(self.directory, DEAD_DIR)
+            os.makedirs(directory, exist_ok=True)
+            dead_path = os.path.join(directory, os.path.basename(path))
+            with open(dead_path, 'a') as f:
+                for entry in dead:
+                    f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            with self._lock:
+                self._stats['dead_lettered'] += len(dead)
+            log.error("%d journaled scan(s) failed %d times and were moved to %s: %s",
+                      len(dead), self.max_attempts, dead_path, dead[0]['error'])
+        return written
+
+    def _sync(self, seq):
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                target, fd = self._written, self._fd
+            os.fsync(fd)
+            self._synced = target
+            self._stats['fsyncs'] += 1
+
+    def _open_segment(self):
+        name = f'scans-{os.getpid()}-{uuid.uuid4().hex[:12]}'
+        tmp = os.path.join(self.directory, f'.{name}.tmp')
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # Visible to replay only once it is locked
+        path = os.path.join(self.directory, name + SUFFIX)
+        os.rename(tmp, path)
+        dir_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._fd, self._path = fd, path
+
+    def _rotate(self):
+        """Move the current segment (fsync'd) to the backlog and start a new one."""
+        with self._sync_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                entry = (self._fd, self._path, self._pending)
+                target = self._written
+                self._open_segment()
+                self._pending = []
+            os.fsync(entry[0])
+            self._synced = max(self._synced, target)
+            self._backlog.append(entry)
+
+    def _adopt_orphans(self):
+        paths = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(SUFFIX)]
+        for path in sorted(paths, key=lambda p: os.stat(p).st_mtime if os.path.exists(p) else 0):
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)            # a live worker's segment
+                continue
+            if os.fstat(fd).st_nlink == 0:
+                os.close(fd)            # committed and removed meanwhile
+                continue
+            records = read_segment(fd)
+            self._stats['replayed'] += len(records)
+            self._backlog.append((fd, path, records))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._wake.wait_for(lambda: self._stopping or len(self._pending) >= self.flush_rows,
+                                    timeout=self.flush_interval)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # Disk full, out of descriptors...: the scans stay journaled, retried next cycle
+                self._error(e)
+                log.exception("Journal flush failed")
+
+
+scan_journal = ScanJournal()
+
+
+if __name__ == "__main__":
+    # Replay segments left by workers that are gone, e.g. after turning write-behind off
+    journal = ScanJournal()
+    journal.start()
+    journal.close()
+    print(f"Replayed {journal.stats()['replayed']} journaled scan(s).")
@@ -0,0 +1,358 @@
+"""Recording scans: the live log_scan insert and batched uploads from kiosks.
+
+Both paths write logs and keep the work_days rollup current in the same
+transaction. Uploaded scans carry the time they were taken on the kiosk
+(client_timestamp) and an optional idempotency key, so a kiosk replaying its
+backlog after a network blip never creates the same scan twice.
+
+Live scans are also debounced: the same user and action again within
+DEBOUNCE_SECONDS (the face loop, a QR read twice) is not logged, and the
+caller gets the original scan back. scan_dedupe holds the last live scan per
+user and action for every worker; RecentScans answers repeats from memory.
+
+Every path also moves the user's user_status row along (user_status.py) and
+reports scans that do not follow from it, such as an exit without an entry.
+"""
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pymysql
+
+from log_queries import TIMESTAMP_FORMAT
+from qr_tokens import qr_tokens, is_signed
+from user_status import InvalidTransition, update_status
+from work_days import refresh_after_scan, refresh_span
+
+VALID_ACTIONS = ('entry', 'exit', 'start_lunch', 'end_lunch')
+# Scans accepted in a single upload
+MAX_BATCH = int(os.environ.get('SCAN_BATCH_MAX', 500))
+# Kiosk clocks may run this far ahead of the database
+MAX_CLOCK_SKEW = timedelta(seconds=float(os.environ.get('SCAN_MAX_CLOCK_SKEW', 300)))
+# Oldest scan a kiosk may still upload
+MAX_BACKDATE = timedelta(days=float(os.environ.get('SCAN_MAX_BACKDATE_DAYS', 7)))
+# Days an idempotency key is remembered
+IDEMPOTENCY_DAYS = int(os.environ.get('SCAN_IDEMPOTENCY_DAYS', 30))
+PRUNE_INTERVAL = 3600
+KEY_PATTERN = re.compile(r'^[\w.:-]{1,64}$')
+# A concurrent upload of the same keys, or a user deleted meanwhile, retries the batch
+ATTEMPTS = 3
+# Same user and action within this many seconds is one scan (0 disables)
+DEBOUNCE_SECONDS = int(os.environ.get('SCAN_DEBOUNCE_SECONDS', 60))
+# Recent scans and idempotency keys remembered per worker
+RECENT_SCANS = int(os.environ.get('SCAN_RECENT_SIZE', 10000))
+
+_pruned_at = None
+
+
+def debounce(cursor, user_id, action_type, ts, window=None):
+    """Claim (user_id, action_type) at ts; returns the time of the scan it repeats, or None.
+
+    The upsert keeps an earlier scan that is still inside the window and
+    otherwise takes over the row; either way it holds the row lock until
+    commit, so concurrent scans of the same person queue up behind it.
+    """
+    window = DEBOUNCE_SECONDS if window is None else window
+    if not window:
+        return None
+    token = secrets.randbits(63)
+    # Assignments apply left to right: scanned_at sees the new token
+    cursor.execute(
+        "INSERT INTO scan_dedupe (user_id, type, scanned_at, token) VALUES (%s, %s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE "
+        "token = IF(scanned_at > VALUES(scanned_at) - INTERVAL %s SECOND, token, VALUES(token)), "
+        "scanned_at = IF(token = VALUES(token), VALUES(scanned_at), scanned_at)",
+        (user_id, action_type, ts, token, window))
+    cursor.execute("SELECT scanned_at, token FROM scan_dedupe WHERE user_id = %s AND type = %s",
+                   (user_id, action_type))
+    row = cursor.fetchone()
+    return None if row['token'] == token else row['scanned_at']
+
+
+def record_scan(cursor, user_id, action_type, key=None, reject=False):
+    """Insert a live scan (database clock), refresh the rollup and the user's status.
+
+    Returns (timestamp, created, problem): created is False when the scan
+    repeats the idempotency key or, within the debounce window, the user and
+    action of an earlier one, whose timestamp is returned instead. problem
+    says why the scan does not follow from the user's state (None if it
+    does); with reject, such a scan raises InvalidTransition instead and the
+    caller rolls back.
+    """
+    if key:
+        original = seen_keys(cursor, [key]).get(key)
+        if original:
+            return original['timestamp'], False, None
+    cursor.execute("SELECT NOW() AS now")
+    now = cursor.fetchone()['now']
+    original = debounce(cursor, user_id, action_type, now)
+    if original:
+        if key:
+            # A retry after the window must still find the scan this repeats
+            remember_key(cursor, key, user_id, action_type, original)
+        return original, False, None
+    problem = update_status(cursor, user_id, [(action_type, now)])[0]
+    if problem and reject:
+        raise InvalidTransition(problem)
+    if key:
+        remember_key(cursor, key, user_id, action_type, now)
+    cursor.execute("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)", (user_id, action_type, now))
+    refresh_after_scan(cursor, user_id, action_type, now)
+    return now, True, problem
+
+
+class RecentScans:
+    """Bounded per-worker memory of live scans, checked before the database.
+
+    Answers a repeated idempotency key, or the same user and action inside
+    the debounce window, without a query. Anything it has forgotten (or
+    never saw, e.g. a scan through another worker) still goes to the
+    database checks in record_scan, and so does a new key repeating a scan
+    in the window: record_scan ties the key to that scan for later retries.
+    """
+
+    def __init__(self, size=RECENT_SCANS, window=DEBOUNCE_SECONDS):
+        self.size = size
+        self.window = window
+        self._scans = OrderedDict()     # (user_id, action_type) -> (monotonic time, result)
+        self._keys = OrderedDict()      # idempotency key -> result
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def original(self, user_id, action_type, key=None):
+        """Result of the scan this one repeats, or None."""
+        with self._lock:
+            found = self._keys.get(key) if key else None
+            if found is None and self.window and not key:
+                entry = self._scans.get((user_id, action_type))
+                if entry and time.monotonic() - entry[0] < self.window:
+                    found = entry[1]
+            if found is not None:
+                self.suppressed += 1
+            return found
+
+    def remember(self, user_id, action_type, key, result):
+        with self._lock:
+            self._scans[(user_id, action_type)] = (time.monotonic(), result)
+            self._scans.move_to_end((user_id, action_type))
+            if key:
+                self._keys[key] = result
+                self._keys.move_to_end(key)
+            for entries in (self._scans, self._keys):
+                while len(entries) > self.size:
+                    entries.popitem(last=False)
+
+
+recent_scans = RecentScans()
+
+
+def parse_client_timestamp(value):
+    """ISO 8601 timestamp -> naive local datetime, like the logs column.
+
+    An offset is converted to this host's local time, which must be the
+    time zone MySQL stamps live scans with.
+    """
+    if not isinstance(value, str):
+        raise ValueError('Fecha inválida')
+    try:
+        ts = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {value}')
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts.replace(microsecond=0)
+
+
+def parse_item(item, now):
+    """(user reference, action, timestamp, key) of one uploaded scan. Raises ValueError.
+
+    The user reference is ('id', user_id) for a verified signed token,
+    ('qr', code) for an old-format code or ('username', name).
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Registro inválido')
+    qr_data, username = item.get('qr_data'), item.get('username')
+    action_type = item.get('action_type')
+    if action_type not in VALID_ACTIONS:
+        raise ValueError('Acción inválida')
+
+    if qr_data and isinstance(qr_data, str):
+        if is_signed(qr_data):
+            ref = ('id', qr_tokens.verify(qr_data)[0])
+        else:
+            ref = ('qr', qr_data)
+    elif username and isinstance(username, str):
+        ref = ('username', username.strip().lower())
+    else:
+        raise ValueError('Missing data')
+
+    if item.get('client_timestamp') is None:
+        ts = now
+    else:
+        ts = parse_client_timestamp(item['client_timestamp'])
+        if ts > now + MAX_CLOCK_SKEW:
+            raise ValueError('Fecha en el futuro')
+        if ts < now - MAX_BACKDATE:
+            raise ValueError('Registro demasiado antiguo')
+
+    key = item.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or not KEY_PATTERN.match(key)):
+        raise ValueError('idempotency_key inválida')
+    return ref, action_type, ts, key
+
+
+def resolve_users(cursor, refs):
+    """{user reference: {'id', 'username'}} for every reference that exists, in one query."""
+    by_kind = {'id': set(), 'qr': set(), 'username': set()}
+    for kind, value in refs:
+        by_kind[kind].add(value)
+    clauses, params = [], []
+    for kind, column in (('id', 'id'), ('qr', 'qr_code_data'), ('username', 'username')):
+        if by_kind[kind]:
+            clauses.append(f"{column} IN ({', '.join(['%s'] * len(by_kind[kind]))})")
+            params.extend(by_kind[kind])
+    if not clauses:
+        return {}
+    cursor.execute(
+        f"SELECT id, username, qr_code_data FROM users WHERE {' OR '.join(clauses)}", tuple(params))
+    found = {}
+    for row in cursor.fetchall():
+        user = {'id': row['id'], 'username': row['username']}
+        found[('id', row['id'])] = user
+        found[('qr', row['qr_code_data'])] = user
+        # username comparison in MySQL ignores case
+        found[('username', row['username'].lower())] = user
+    return found
+
+
+def remember_key(cursor, key, user_id, action_type, ts):
+    cursor.execute(
+        "INSERT INTO scan_idempotency (idempotency_key, user_id, type, timestamp) VALUES (%s, %s, %s, %s)",
+        (key, user_id, action_type, ts))
+
+
+def seen_keys(cursor, keys):
+    """{idempotency key: original scan} for keys already recorded."""
+    if not keys:
+        return {}
+    cursor.execute(
+        f"SELECT scan_idempotency.idempotency_key, scan_idempotency.type, scan_idempotency.timestamp, "
+        f"users.username FROM scan_idempotency LEFT JOIN users ON users.id = scan_idempotency.user_id "
+        f"WHERE scan_idempotency.idempotency_key IN ({', '.join(['%s'] * len(keys))})",
+        tuple(keys))
+    return {row['idempotency_key']: row for row in cursor.fetchall()}
+
+
+def result(status, username, action_type, ts):
+    return {'status': status, 'username': username, 'action_type': action_type,
+            'timestamp': ts.strftime(TIMESTAMP_FORMAT)}
+
+
+def prune_idempotency(cursor):
+    global _pruned_at
+    if _pruned_at is not None and time.monotonic() - _pruned_at < PRUNE_INTERVAL:
+        return 0
+    _pruned_at = time.monotonic()
+    cursor.execute(
+        "DELETE FROM scan_idempotency WHERE created_at < NOW() - INTERVAL %s DAY LIMIT 10000",
+        (IDEMPOTENCY_DAYS,))
+    return cursor.rowcount
+
+
+def write_scans(cursor, rows):
+    """Insert (user_id, action_type, timestamp, idempotency key or None) rows and refresh the rollup.
+
+    Keys must not have been recorded yet; one recorded concurrently makes
+    the key insert fail (IntegrityError) instead of logging the scan twice.
+    Returns the transition problem of each row (update_status), in order.
+    """
+    keys = [(key, user_id, action_type, ts) for user_id, action_type, ts, key in rows if key]
+    if keys:
+        # Blocks on, then fails against, the same keys from a concurrent upload
+        cursor.executemany(
+            "INSERT INTO scan_idempotency (idempotency_key, user_id, type, timestamp) "
+            "VALUES (%s, %s, %s, %s)", keys)
+    if rows:
+        cursor.executemany("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)",
+                           [row[:3] for row in rows])
+    spans, by_user = {}, {}
+    for i, (user_id, action_type, ts, _) in enumerate(rows):
+        first, last = spans.get(user_id, (ts, ts))
+        spans[user_id] = (min(first, ts), max(last, ts))
+        by_user.setdefault(user_id, []).append(i)
+    # Backdated scans can change earlier days too, whatever their type
+    for user_id, (first, last) in spans.items():
+        refresh_span(cursor, user_id, first, last)
+    problems = [None] * len(rows)
+    # In id order, so two batches lock status rows in the same order
+    for user_id in sorted(by_user):
+        indexes = by_user[user_id]
+        found = update_status(cursor, user_id, [(rows[i][1], rows[i][2]) for i in indexes])
+        for i, problem in zip(indexes, found):
+            problems[i] = problem
+    return problems
+
+
+def record_batch(db, items):
+    """Record uploaded scans in one transaction; one result dict per item, in order.
+
+    Each result has a status: 'created', 'duplicate' (the key was recorded
+    before, possibly earlier in this same upload: the original scan is
+    returned) or 'error' with a message. Invalid items do not affect the
+    others. A created scan that does not follow from the user's state also
+    has a 'warning'.
+    """
+    qr_tokens.ensure_current(db)
+    with db.cursor() as cursor:
+        cursor.execute("SELECT NOW() AS now")
+        now = cursor.fetchone()['now']
+    db.commit()
+
+    results = [None] * len(items)
+    parsed = {}
+    for i, item in enumerate(items):
+        try:
+            parsed[i] = parse_item(item, now)
+        except ValueError as e:
+            results[i] = {'status': 'error', 'message': str(e)}
+
+    for attempt in range(ATTEMPTS):
+        try:
+            return _insert(db, parsed, list(results))
+        except pymysql.IntegrityError:
+            db.rollback()
+            if attempt == ATTEMPTS - 1:
+                raise
+
+
+def _insert(db, parsed, results):
+    with db.cursor() as cursor:
+        prune_idempotency(cursor)
+        originals = seen_keys(cursor, sorted({p[3] for p in parsed.values() if p[3]}))
+        users = resolve_users(cursor, {p[0] for p in parsed.values()})
+
+        rows, positions = [], []
+        for i, (ref, action_type, ts, key) in parsed.items():
+            if key in originals:
+                original = originals[key]
+                results[i] = result('duplicate', original['username'], original['type'], original['timestamp'])
+                continue
+            user = users.get(ref)
+            if user is None:
+                results[i] = {'status': 'error', 'message': 'Usuario no encontrado'}
+                continue
+            if key:
+                originals[key] = {'username': user['username'], 'type': action_type, 'timestamp': ts}
+            rows.append((user['id'], action_type, ts, key))
+            positions.append(i)
+            results[i] = result('created', user['username'], action_type, ts)
+        for i, problem in zip(positions, write_scans(cursor, rows)):
+            if problem:
+                # Logged anyway: the scan happened, it is only out of sequence
+                results[i]['warning'] = problem
+    db.commit()
+    return results
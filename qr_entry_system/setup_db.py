@@ -3,6 +3,7 @@ try:
     import pymysql
     import pymysql.cursors
     import os
+    from migrate import run as run_migrations
     print("Import successful")
 except ImportError as e:
     print(f"Import failed: {e}")
@@ -12,44 +13,20 @@ except ImportError as e:
 print("Defining constants...")
 DB_NAME = os.environ.get('DB_NAME', 'qr_entry_db')
 
+# Every table the app owns, dropped children first
+APP_TABLES = ['log_archives', 'user_status', 'scan_dedupe', 'scan_idempotency', 'counters', 'qr_revocations', 'work_days', 'face_changes', 'logs', 'users', 'schema_migrations']
+
 def force_reset_tables(cursor):
     print("!!! FORCING FULL TABLE RESET !!!")
     try:
         cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
-        cursor.execute("DROP TABLE IF EXISTS logs")
-        cursor.execute("DROP TABLE IF EXISTS users")
+        for table in APP_TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
         print("Tables dropped successfully.")
     except Exception as e:
         print(f"Error dropping tables: {e}")
 
-TABLES = {}
-TABLES['users'] = (
-    "CREATE TABLE `users` ("
-    "  `id` int(11) NOT NULL AUTO_INCREMENT,"
-    "  `username` varchar(50) NOT NULL,"
-    "  `password_hash` varchar(255) DEFAULT NULL,"
-    "  `role` enum('admin','employee','supervisor') NOT NULL DEFAULT 'employee',"
-    "  `cedula` varchar(20) DEFAULT NULL,"
-    "  `area` varchar(100) DEFAULT NULL,"
-    "  `qr_code_data` varchar(255) NOT NULL,"
-    "  `face_descriptor` JSON DEFAULT NULL,"
-    "  PRIMARY KEY (`id`),"
-    "  UNIQUE KEY `username` (`username`)"
-    ") ENGINE=InnoDB")
-
-TABLES['logs'] = (
-    "CREATE TABLE `logs` ("
-    "  `id` int(11) NOT NULL AUTO_INCREMENT,"
-    "  `user_id` int(11) NOT NULL,"
-    "  `type` enum('entry','exit','start_lunch','end_lunch') NOT NULL,"
-    "  `timestamp` datetime DEFAULT CURRENT_TIMESTAMP,"
-    "  PRIMARY KEY (`id`),"
-    "  KEY `user_id` (`user_id`),"
-    "  CONSTRAINT `logs_ibfk_1` FOREIGN KEY (`user_id`) "
-    "     REFERENCES `users` (`id`) ON DELETE CASCADE"
-    ") ENGINE=InnoDB")
-
 def create_database(cursor):
     try:
         print(f"Attempting to create database {DB_NAME}...")
@@ -93,35 +70,11 @@ try:
 
     # Reset tables to ensure new schema is applied
     print("Resetting tables (DROP IF EXISTS)...")
-    try:
-        cursor.execute("DROP TABLE IF EXISTS logs")
-        cursor.execute("DROP TABLE IF EXISTS users")
-        print("Tables dropped.")
-    except pymysql.MySQLError as err:
-        print(f"Warning dropping tables: {err}")
+    force_reset_tables(cursor)
 
-    # Reset tables to ensure new schema is applied
-    print("Resetting tables (DROP IF EXISTS)...")
-    try:
-        cursor.execute("DROP TABLE IF EXISTS logs")
-        cursor.execute("DROP TABLE IF EXISTS users")
-        print("Tables dropped.")
-    except pymysql.MySQLError as err:
-        print(f"Warning dropping tables: {err}")
-
-    for table_name in TABLES:
-        table_description = TABLES[table_name]
-        try:
-            print("Creating table {}: ".format(table_name), end='')
-            cursor.execute(table_description)
-        except pymysql.MySQLError as err:
-            # Check for "Table already exists" error (code 1050)
-            if err.args[0] == 1050:
-                print("already exists.")
-            else:
-                print(err)
-        else:
-            print("OK")
+    # The schema itself lives in migrations/ so fresh and upgraded databases match
+    print("Creating tables (running migrations)...")
+    run_migrations(cnx)
 
     cursor.close()
     cnx.close()
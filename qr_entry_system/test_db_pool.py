@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise ConnectionError('gone')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        self.created = []
+
+        def connect():
+            conn = FakeConnection()
+            self.created.append(conn)
+            return conn
+
+        options = dict(min_size=1, max_size=2, max_overflow=1, timeout=0.2, ping_after=0)
+        options.update(kwargs)
+        return ConnectionPool(connect, **options)
+
+    def test_reuses_connections(self):
+        pool = self.make_pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(pool.stats()['creates'], 1)
+
+    def test_overflow_is_closed_on_release_and_timeout_when_exhausted(self):
+        pool = self.make_pool()
+        conns = [pool.acquire() for _ in range(3)]
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        pool.release(conns[2])
+        self.assertTrue(conns[2].closed)
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['total']), (2, 2))
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.make_pool(max_overflow=0, timeout=2)
+        conns = [pool.acquire() for _ in range(2)]
+        threading.Timer(0.05, pool.release, args=(conns[0],)).start()
+        self.assertIs(pool.acquire(), conns[0])
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_health_check_and_lifetime(self):
+        pool = self.make_pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.alive = False
+        fresh = pool.acquire()
+        self.assertIsNot(fresh, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['health_failures'], 1)
+
+        pool.max_lifetime = 0
+        pool.release(fresh)
+        time.sleep(0.01)
+        self.assertIsNot(pool.acquire(), fresh)
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+    def test_broken_connection_is_discarded(self):
+        pool = self.make_pool()
+        conn = pool.acquire()
+        pool.release(conn, discard=True)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()['total'], 0)
+
+    def test_concurrent_checkouts_never_exceed_limit(self):
+        pool = self.make_pool(max_size=3, max_overflow=0, timeout=5)
+        peak = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(50):
+                conn = pool.acquire()
+                with lock:
+                    peak.append(pool.stats()['in_use'])
+                pool.release(conn)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(max(peak), 3)
+        self.assertLessEqual(len(self.created), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
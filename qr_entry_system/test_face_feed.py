@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from face_feed import pack_faces, unpack_faces
+
+
+class TestBinaryFeed(unittest.TestCase):
+    def test_round_trip(self):
+        faces = [
+            (1, 'ana', np.full(128, 0.25, dtype=np.float32)),
+            (7, 'josé', np.arange(128, dtype=np.float32) / 128),
+        ]
+        payload = pack_faces(42, False, faces, removed=[3, 9])
+        version, full, ids, usernames, matrix, removed = unpack_faces(payload)
+
+        self.assertEqual(version, 42)
+        self.assertFalse(full)
+        self.assertEqual(ids.tolist(), [1, 7])
+        self.assertEqual(usernames, ['ana', 'josé'])
+        self.assertEqual(removed.tolist(), [3, 9])
+        np.testing.assert_array_equal(matrix[1], faces[1][2])
+        # 4 bytes per value instead of ~20 characters of JSON
+        self.assertLess(len(payload), 2 * 128 * 4 + 64)
+
+    def test_usernames_with_separators_keep_their_faces(self):
+        faces = [(i, name, np.full(128, i, dtype=np.float32))
+                 for i, name in enumerate(['ana\nluis', '', 'x\x00y', 'josé'], start=1)]
+        _, _, ids, usernames, matrix, _ = unpack_faces(pack_faces(1, True, faces))
+        self.assertEqual(usernames, ['ana\nluis', '', 'x\x00y', 'josé'])
+        self.assertEqual(matrix[:, 0].tolist(), [1, 2, 3, 4])
+
+    def test_empty_feed(self):
+        version, full, ids, usernames, matrix, removed = unpack_faces(pack_faces(0, True, []))
+        self.assertTrue(full)
+        self.assertEqual((len(ids), usernames, matrix.shape), (0, [], (0, 128)))
+
+
+if __name__ == '__main__':
+    unittest.main()
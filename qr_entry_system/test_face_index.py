@@ -0,0 +1,185 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from descriptors import DESCRIPTOR_SIZE, encode_descriptor, parse_descriptor, stored_descriptor
+from face_ann import ExactBackend, IVFBackend
+from face_index import FaceIndex
+
+
+def vec(value):
+    v = np.zeros(DESCRIPTOR_SIZE, dtype=np.float32)
+    v[0] = value
+    return v
+
+
+class FakeFeedDB:
+    """face_changes and users in memory, answering the face_feed queries."""
+
+    def __init__(self):
+        self.changes = []           # (version, user_id), visible ones only
+        self.users = {}             # id -> (username, vector)
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        if 'COUNT(*) AS recent' in query:
+            top = max((v for v, _ in self.changes), default=0)
+            self.rows = [{'version': top, 'recent': sum(1 for v, _ in self.changes if v > top - params[0])}]
+        elif 'version > %s' in query:
+            self.rows = [{'user_id': u} for u in sorted({u for v, u in self.changes if v > params[0]})]
+        elif 'version <= %s' in query:
+            self.rows = [{'user_id': u} for u in sorted({u for v, u in self.changes
+                                                         if v <= params[0] and u in params[1:]})]
+        else:
+            wanted = set(params) if params else set(self.users)
+            self.rows = [{'id': i, 'username': name, 'face_vector': encode_descriptor(v), 'face_descriptor': None}
+                         for i, (name, v) in sorted(self.users.items()) if i in wanted]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestFaceIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = FaceIndex(ExactBackend())
+        self.index.load([(1, 'ana', vec(0.0).tolist()), (2, 'luis', vec(1.0).tolist()), (3, 'bad', '[1, 2]')])
+
+    def test_load_skips_invalid_rows(self):
+        self.assertEqual(len(self.index), 2)
+
+    def test_find_duplicate(self):
+        self.assertEqual(self.index.find_duplicate(vec(0.1))[:2], (1, 'ana'))
+        self.assertIsNone(self.index.find_duplicate(vec(0.1), exclude_id=1))
+        self.assertIsNone(self.index.find_duplicate(vec(3.0)))
+
+    def test_incremental_updates(self):
+        self.index.upsert(4, 'eva', vec(5.0))
+        self.assertEqual(self.index.find_duplicate(vec(5.1))[1], 'eva')
+
+        self.index.upsert(1, 'ana', vec(8.0))
+        self.assertIsNone(self.index.find_duplicate(vec(0.0)))
+
+        self.index.rename(4, 'eva.m')
+        self.assertEqual(self.index.find_duplicate(vec(5.0))[1], 'eva.m')
+
+        self.index.remove(1)
+        self.index.remove(1)
+        self.assertEqual(len(self.index), 2)
+        self.assertEqual(self.index.find_duplicate(vec(5.0))[:2], (4, 'eva.m'))
+        self.assertEqual(self.index.find_duplicate(vec(1.0))[:2], (2, 'luis'))
+
+    def test_sync_picks_up_a_change_committed_late(self):
+        db = FakeFeedDB()
+        db.users = {1: ('ana', vec(0.0))}
+        db.changes = [(1, 1)]
+        index = FaceIndex(ExactBackend())
+        index.load_from_db(db)
+
+        # Version 3 commits first; 2 (inserted earlier) becomes visible after the sync
+        db.users[3] = ('eva', vec(3.0))
+        db.changes.append((3, 3))
+        index.sync(db)
+        db.users[2] = ('luis', vec(2.0))
+        db.changes.append((2, 2))
+        index.sync(db)
+        self.assertEqual(index.find_duplicate(vec(2.0))[:2], (2, 'luis'))
+        self.assertEqual(len(index), 3)
+
+    def test_identify_batch(self):
+        matches = self.index.identify([vec(0.2), vec(0.9), vec(3.0)])
+        self.assertEqual(matches[0][:2], (1, 'ana'))
+        self.assertEqual(matches[1][:2], (2, 'luis'))
+        self.assertEqual(matches[2][:2], (None, None))
+        self.assertAlmostEqual(matches[2][2], 2.0, places=5)
+        self.assertEqual(FaceIndex(ExactBackend()).identify([vec(0.0)]), [(None, None, None)])
+
+    def test_grows_past_capacity(self):
+        for i in range(100):
+            self.index.upsert(100 + i, f'u{i}', vec(10.0 + i))
+        self.assertEqual(self.index.find_duplicate(vec(60.0))[1], 'u50')
+
+    def test_packed_descriptor_round_trip(self):
+        packed = encode_descriptor(vec(0.25).tolist())
+        self.assertEqual(len(packed), 512)
+        np.testing.assert_array_equal(parse_descriptor(packed), vec(0.25))
+        # Binary column wins over the legacy JSON one
+        row = {'face_vector': packed, 'face_descriptor': '[0]'}
+        np.testing.assert_array_equal(parse_descriptor(stored_descriptor(row)), vec(0.25))
+        legacy = {'face_vector': None, 'face_descriptor': str(vec(0.5).tolist())}
+        np.testing.assert_array_equal(parse_descriptor(stored_descriptor(legacy)), vec(0.5))
+
+    def test_parse_descriptor_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            parse_descriptor('[0.1, 0.2]')
+        with self.assertRaises(ValueError):
+            parse_descriptor('not json')
+        with self.assertRaises(ValueError):
+            parse_descriptor(b'\x00' * 100)
+
+
+class TestIVFBackend(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(0, 0.1, size=(2000, DESCRIPTOR_SIZE)).astype(np.float32)
+        self.rows = [(i, f'u{i}', v) for i, v in enumerate(self.vectors)]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'face_index.npz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_exact_search(self):
+        index = FaceIndex(IVFBackend(nprobe=8, min_size=100, path=self.path))
+        index.load(self.rows)
+        self.assertTrue(index.backend.trained)
+        for i in (0, 500, 1999):
+            self.assertEqual(index.nearest(self.vectors[i])[0], i)
+
+    def test_incremental_updates_are_searchable(self):
+        index = FaceIndex(IVFBackend(nprobe=8, min_size=100, path=self.path))
+        index.load(self.rows)
+        index.remove(0)
+        index.upsert(5000, 'new', self.vectors[0])
+        self.assertEqual(index.nearest(self.vectors[0])[:2], (5000, 'new'))
+        self.assertEqual(index.nearest(self.vectors[1999])[0], 1999)
+
+    def test_reuses_persisted_index(self):
+        FaceIndex(IVFBackend(min_size=100, path=self.path)).load(self.rows)
+        self.assertTrue(os.path.exists(self.path))
+
+        backend = IVFBackend(min_size=100, path=self.path)
+        backend.save = lambda *args: self.fail('rebuilt an index that was already on disk')
+        index = FaceIndex(backend)
+        index.load(self.rows)
+        self.assertEqual(index.nearest(self.vectors[42])[0], 42)
+
+    def test_unreadable_index_is_logged_and_rebuilt(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not an npz')
+        index = FaceIndex(IVFBackend(min_size=100, path=self.path))
+        with self.assertLogs('face_ann', 'WARNING'):
+            index.load(self.rows)
+        self.assertEqual(index.nearest(self.vectors[42])[0], 42)
+
+    def test_small_index_uses_exact_search(self):
+        index = FaceIndex(IVFBackend(min_size=10000, path=self.path))
+        index.load(self.rows)
+        self.assertFalse(index.backend.trained)
+        self.assertEqual(index.nearest(self.vectors[7])[0], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobLimit, JobQueue
+
+
+# Job functions run in spawned worker processes, so they live at module level
+
+def write_report(params, out_path, progress):
+    progress(0.5, 'Escribiendo')
+    time.sleep(params.get('sleep', 0))
+    with open(out_path, 'w') as f:
+        f.write(params['text'])
+    return 'reporte.txt', 'text/plain'
+
+
+def broken_report(params, out_path, progress):
+    raise RuntimeError('sin datos')
+
+
+KINDS = {'text': write_report, 'broken': broken_report}
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = self.make_queue()
+
+    def tearDown(self):
+        self.queue.shutdown()
+        shutil.rmtree(self.tmp)
+
+    def make_queue(self, **options):
+        return JobQueue(KINDS, path=os.path.join(self.tmp, 'jobs.sqlite3'),
+                        results_dir=os.path.join(self.tmp, 'reports'), **options)
+
+    def wait(self, job_id, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.queue.get(job_id)
+            if job['state'] in (DONE, FAILED):
+                return job
+            time.sleep(0.05)
+        self.fail(f'job {job_id} did not finish')
+
+    def test_runs_job_and_keeps_result(self):
+        job = self.wait(self.queue.submit('text', {'text': 'hola'}, owner_id=1))
+        self.assertEqual(job['state'], DONE)
+        self.assertEqual(job['progress'], 1)
+        self.assertEqual((job['filename'], job['mimetype']), ('reporte.txt', 'text/plain'))
+        with open(job['file_path']) as f:
+            self.assertEqual(f.read(), 'hola')
+
+    def test_failure_is_reported(self):
+        job = self.wait(self.queue.submit('broken', {}))
+        self.assertEqual(job['state'], FAILED)
+        self.assertEqual(job['error'], 'sin datos')
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            self.queue.submit('nope', {})
+
+    def test_concurrency_limit(self):
+        self.queue.shutdown()
+        self.queue = self.make_queue(max_concurrent=1)
+        first = self.queue.submit('text', {'text': '1', 'sleep': 1})
+        second = self.queue.submit('text', {'text': '2'})
+        self.assertEqual(self.queue.get(first)['state'], RUNNING)
+        self.assertEqual(self.queue.get(second)['state'], QUEUED)
+        self.assertEqual(self.wait(second)['state'], DONE)
+        self.assertLessEqual(self.queue.get(first)['finished_at'], self.queue.get(second)['started_at'])
+
+    def test_pending_limit_per_user(self):
+        self.queue.shutdown()
+        self.queue = self.make_queue(max_concurrent=1, max_pending=2)
+        jobs = [self.queue.submit('text', {'text': 'x', 'sleep': 0.5}, owner_id=7) for _ in range(2)]
+        with self.assertRaises(JobLimit):
+            self.queue.submit('text', {'text': 'x'}, owner_id=7)
+        # Other users are not affected
+        self.queue.submit('text', {'text': 'x'}, owner_id=8)
+        for job_id in jobs:
+            self.wait(job_id)
+
+    def test_cleanup_removes_expired_results(self):
+        self.queue.ttl = 0
+        job = self.wait(self.queue.submit('text', {'text': 'hola'}))
+        time.sleep(0.01)
+        self.assertEqual(self.queue.cleanup(), 1)
+        self.assertIsNone(self.queue.get(job['id']))
+        self.assertFalse(os.path.exists(job['file_path']))
+
+    def test_polling_cleans_up_without_submits(self):
+        self.queue.cleanup_interval = 0
+        path = os.path.join(self.tmp, 'reports', 'old')
+        with self.queue._db() as conn:
+            with open(path, 'w') as f:
+                f.write('viejo')
+            conn.execute("INSERT INTO jobs (id, kind, params, state, file_path, created_at, expires_at) "
+                         "VALUES ('old', 'text', '{}', ?, ?, ?, ?)", (DONE, path, time.time() - 120, time.time() - 60))
+        self.assertIsNone(self.queue.get('other'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_cleanup_fails_lost_jobs(self):
+        self.queue.timeout = 60
+        with self.queue._db() as conn:
+            conn.execute("INSERT INTO jobs (id, kind, params, state, created_at, started_at) "
+                         "VALUES ('lost', 'text', '{}', ?, ?, ?)", (RUNNING, time.time() - 120, time.time() - 120))
+        self.queue.cleanup()
+        self.assertEqual(self.queue.get('lost')['state'], FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import io
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import log_columnar
+from log_columnar import export_columnar, resolve_format, row_groups, write_npz, write_parquet
+from report_cache import ReportCache
+
+
+def sample_rows(count):
+    areas = ['Bodega', 'Calidad', None]
+    actions = ['entry', 'start_lunch', 'end_lunch', 'exit']
+    return [(i + 1, 100 + i % 3, f'user_{i % 3}', areas[i % 3], actions[i % 4], datetime(2024, 3, 1, 8, 0, i % 60))
+            for i in range(count)]
+
+
+class FakeExportCursor:
+    """Snapshot/watermark cursor (dict rows), or the unbuffered row cursor."""
+
+    def __init__(self, rows=None):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchone(self):
+        return {'n': len(self.rows or []), 'max_id': 10, 'id_xor': 11}
+
+    def fetchall(self):
+        return []                   # no archived months
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeExportPool:
+    open = True
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def acquire(self):
+        return self
+
+    def release(self, conn, discard=False):
+        pass
+
+    def cursor(self, cursorclass=None):
+        return FakeExportCursor(list(self.rows) if cursorclass else None)
+
+    def commit(self):
+        pass
+
+
+class TestColumnarExport(unittest.TestCase):
+    def test_npz_round_trip_across_row_groups(self):
+        rows = sample_rows(10)
+        f = io.BytesIO()
+        self.assertEqual(write_npz(row_groups(rows, 4), f), 10)
+        f.seek(0)
+        bundle = np.load(f)
+
+        self.assertEqual(bundle['log_id'].tolist(), list(range(1, 11)))
+        self.assertEqual(bundle['local_time'].dtype, np.dtype('datetime64[s]'))
+        self.assertEqual(bundle['type'].dtype, np.int8)
+        user = bundle['user']
+        self.assertEqual(bundle['user_ids'][user].tolist(), [r[1] for r in rows])
+        self.assertEqual(bundle['usernames'][user].tolist(), [r[2] for r in rows])
+        self.assertEqual(bundle['areas'][bundle['user_areas'][user]].tolist(), [r[3] or '' for r in rows])
+        self.assertEqual(bundle['type_labels'][bundle['type']].tolist(), [r[4] for r in rows])
+        # Wall-clock fields, no time-zone shift
+        self.assertEqual(bundle['local_time'].astype(object).tolist(), [r[5] for r in rows])
+
+    def test_export_survives_eviction_before_it_is_sent(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        original_pool, original_cache = log_columnar.pool, log_columnar.report_cache
+        log_columnar.pool = FakeExportPool(sample_rows(10))
+        log_columnar.report_cache = cache = ReportCache(tmp)
+        try:
+            with export_columnar('1=1', [], {}, 'npz') as f:
+                # Another worker's write evicts it before the response is written
+                cache.clear()
+                self.assertEqual(np.load(f)['log_id'].tolist(), list(range(1, 11)))
+        finally:
+            log_columnar.pool, log_columnar.report_cache = original_pool, original_cache
+
+    def test_empty_export(self):
+        f = io.BytesIO()
+        self.assertEqual(write_npz(row_groups([]), f), 0)
+        f.seek(0)
+        self.assertEqual(np.load(f)['log_id'].shape, (0,))
+
+    def test_resolve_format(self):
+        self.assertEqual(resolve_format('npz'), 'npz')
+        self.assertIsNone(resolve_format('xlsx'))
+        self.assertEqual(resolve_format('columnar'), 'parquet' if log_columnar.pa else 'npz')
+
+    @unittest.skipIf(log_columnar.pa is None, "pyarrow not installed")
+    def test_parquet_row_groups(self):
+        rows = sample_rows(10)
+        f = io.BytesIO()
+        self.assertEqual(write_parquet(row_groups(rows, 4), f), 10)
+        f.seek(0)
+        parquet = log_columnar.pq.ParquetFile(f)
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        table = parquet.read()
+        self.assertEqual(table.column('user_id').to_pylist(), [r[1] for r in rows])
+        self.assertEqual(table.column('username').to_pylist(), [r[2] for r in rows])
+        self.assertEqual(table.column('type').to_pylist(), [r[4] for r in rows])
+        self.assertEqual(table.column('local_time').to_pylist(), [r[5] for r in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
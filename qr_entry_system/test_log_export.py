@@ -0,0 +1,118 @@
+import csv
+import io
+import itertools
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta
+
+from db_testing import MySQLTestCase
+from log_export import CSV_HEADER, csv_chunks, iter_rows
+
+# Enough for the CSV to dwarf the ceiling; a buffered export would blow it
+EXPORT_ROWS = 200_000
+# Peak Python allocations allowed while streaming the whole export
+MEMORY_CEILING = 2 * 1024 * 1024
+
+
+def synthetic_logs(count, distinct=2000):
+    # Cycle through a fixed block of rows so the generator itself allocates nothing
+    start = datetime(2024, 1, 1, 7, 0)
+    types = ('entry', 'start_lunch', 'end_lunch', 'exit')
+    block = [(i + 1, f'empleado_{i % 500}', types[i % 4], start + timedelta(seconds=37 * i))
+             for i in range(min(count, distinct))]
+    return itertools.islice(itertools.cycle(block), count)
+
+
+def consume(chunks):
+    """Drain a chunk generator like a WSGI server would; returns (rows, bytes)."""
+    lines = size = 0
+    for chunk in chunks:
+        lines += chunk.count('\n')
+        size += len(chunk)
+    return lines - 1, size
+
+
+class FakeStreamingCursor:
+    """SSCursor stand-in that produces rows on demand."""
+
+    def __init__(self, count):
+        self.rows = synthetic_logs(count)
+        self.closed = False
+
+    def execute(self, query, params):
+        pass
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self.rows)]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStreamingConnection:
+    open = True
+
+    def __init__(self, count):
+        self.cursor_obj = FakeStreamingCursor(count)
+
+    def cursor(self, cursorclass=None):
+        return self.cursor_obj
+
+
+class TestCsvChunks(unittest.TestCase):
+    def test_output_matches_csv_writer(self):
+        rows = list(synthetic_logs(4501))
+        expected = io.StringIO()
+        writer = csv.writer(expected)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+
+        chunks = list(csv_chunks(iter(rows), chunk_size=1000))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(''.join(chunks), expected.getvalue())
+
+    def test_empty_export_has_header(self):
+        self.assertEqual(''.join(csv_chunks(iter([]))), 'ID,Usuario,Tipo Accion,Fecha y Hora\r\n')
+
+    def test_iter_rows_closes_cursor(self):
+        conn = FakeStreamingConnection(10)
+        self.assertEqual(len(list(iter_rows(conn, 'SELECT 1'))), 10)
+        self.assertTrue(conn.cursor_obj.closed)
+
+    def test_memory_stays_flat_for_large_exports(self):
+        conn = FakeStreamingConnection(EXPORT_ROWS)
+        tracemalloc.start()
+        try:
+            rows, size = consume(csv_chunks(iter_rows(conn, 'SELECT 1')))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(rows, EXPORT_ROWS)
+        # The full CSV is ~9 MB; only one chunk may be alive at a time
+        self.assertGreater(size, 4 * MEMORY_CEILING)
+        self.assertLess(peak, MEMORY_CEILING)
+
+
+class TestServerSideCursor(MySQLTestCase):
+    """Same ceiling against a real MySQL result set (skipped without a server)."""
+
+    def test_sscursor_export_memory(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SET SESSION cte_max_recursion_depth = %s", (EXPORT_ROWS,))
+        query = """
+            WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s)
+            SELECT n, CONCAT('empleado_', n MOD 500), 'entry', TIMESTAMP('2024-01-01') + INTERVAL n SECOND
+            FROM seq
+        """
+        tracemalloc.start()
+        try:
+            rows, _ = consume(csv_chunks(iter_rows(self.conn, query, (EXPORT_ROWS,))))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(rows, EXPORT_ROWS)
+        self.assertLess(peak, MEMORY_CEILING)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""EXPLAIN checks that report filters and the scan lookup hit the indexes.
+
+Needs the MySQL database from DB_CONFIG; migrations are applied first.
+"""
+import unittest
+from datetime import datetime, timedelta
+
+from db_testing import MySQLTestCase
+from log_queries import build_log_where, decode_cursor, encode_cursor, keyset_page, log_filters
+
+SEED_USERS = 20
+SEED_DAYS = 60
+
+
+def explain(cursor, query, params=()):
+    cursor.execute("EXPLAIN " + query, params)
+    return {row['table']: row for row in cursor.fetchall()}
+
+
+class TestLogWhere(unittest.TestCase):
+    def test_dates_are_half_open_ranges(self):
+        where, params = build_log_where(log_filters({'date_from': '2024-03-01', 'date_to': '2024-03-31'}))
+        self.assertNotIn('DATE(', where)
+        self.assertIn('logs.timestamp >= %s', where)
+        self.assertIn('logs.timestamp < %s', where)
+        self.assertEqual(params, [datetime(2024, 3, 1), datetime(2024, 4, 1)])
+
+    def test_rejects_malformed_dates(self):
+        with self.assertRaises(ValueError):
+            build_log_where(log_filters({'date_from': '01/03/2024'}))
+
+
+class TestKeysetCursor(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        token = encode_cursor({'timestamp': datetime(2024, 3, 1, 7, 30, 5), 'id': 42}, 'desc')
+        self.assertNotIn('=', token)
+        self.assertEqual(decode_cursor(token, 'desc'), (datetime(2024, 3, 1, 7, 30, 5), 42))
+
+    def test_cursor_is_bound_to_its_order(self):
+        token = encode_cursor({'timestamp': datetime(2024, 3, 1), 'id': 1}, 'asc')
+        with self.assertRaises(ValueError):
+            decode_cursor(token, 'desc')
+
+    def test_rejects_garbage(self):
+        for token in ('x', 'bm90IGpzb24', 'e30'):
+            with self.assertRaises(ValueError):
+                decode_cursor(token, 'desc')
+
+    def test_keyset_clause_follows_direction(self):
+        at = datetime(2024, 3, 1)
+        clause, params, order_by = keyset_page('desc', (at, 7))
+        self.assertIn('logs.timestamp < %s OR (logs.timestamp = %s AND logs.id < %s)', clause)
+        self.assertEqual(params, [at, at, 7])
+        self.assertEqual(order_by, 'ORDER BY logs.timestamp DESC, logs.id DESC')
+
+        clause, _, order_by = keyset_page('asc', (at, 7))
+        self.assertIn('logs.id > %s', clause)
+        self.assertEqual(order_by, 'ORDER BY logs.timestamp ASC, logs.id ASC')
+        self.assertEqual(keyset_page('asc')[:2], ("", []))
+
+
+class TestLogIndexes(MySQLTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.delete_users('explain_user_', prefix=True)
+        with cls.conn.cursor() as cursor:
+            users = [(f'explain_user_{i}', 'employee', f'explain:qr:{i}') for i in range(SEED_USERS)]
+            cursor.executemany("INSERT INTO users (username, role, qr_code_data) VALUES (%s, %s, %s)", users)
+            cursor.execute("SELECT id FROM users WHERE username LIKE %s", ('explain_user_%',))
+            cls.user_ids = [r['id'] for r in cursor.fetchall()]
+
+            start = datetime(2020, 1, 1, 7, 0)
+            rows = []
+            for day in range(SEED_DAYS):
+                for user_id in cls.user_ids:
+                    base = start + timedelta(days=day)
+                    rows.append((user_id, 'entry', base))
+                    rows.append((user_id, 'start_lunch', base + timedelta(hours=5)))
+                    rows.append((user_id, 'end_lunch', base + timedelta(hours=6)))
+                    rows.append((user_id, 'exit', base + timedelta(hours=9)))
+            cursor.executemany("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)", rows)
+            cursor.execute("ANALYZE TABLE logs, users")
+            cursor.fetchall()
+        cls.conn.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.delete_users('explain_user_', prefix=True)
+        super().tearDownClass()
+
+    def explain_search(self, **filters):
+        where, params = build_log_where(log_filters(filters))
+        query = (f"SELECT logs.id, logs.type, logs.timestamp, users.username FROM logs "
+                 f"JOIN users ON logs.user_id = users.id WHERE {where} ORDER BY logs.timestamp DESC LIMIT 100")
+        with self.conn.cursor() as cursor:
+            return explain(cursor, query, tuple(params))
+
+    def test_date_range_uses_timestamp_index(self):
+        plan = self.explain_search(date_from='2020-01-10', date_to='2020-01-11')
+        self.assertEqual(plan['logs']['key'], 'idx_logs_timestamp')
+        self.assertEqual(plan['logs']['type'], 'range')
+
+    def test_type_and_date_use_composite_index(self):
+        plan = self.explain_search(action_type='exit', date_from='2020-01-10', date_to='2020-01-11')
+        self.assertIn(plan['logs']['key'], ('idx_logs_type_timestamp', 'idx_logs_timestamp'))
+        self.assertEqual(plan['logs']['type'], 'range')
+
+    def test_user_history_uses_user_timestamp_index(self):
+        with self.conn.cursor() as cursor:
+            plan = explain(cursor,
+                           "SELECT id FROM logs WHERE user_id = %s AND timestamp >= %s AND timestamp < %s",
+                           (self.user_ids[0], datetime(2020, 1, 10), datetime(2020, 1, 11)))
+        self.assertEqual(plan['logs']['key'], 'idx_logs_user_timestamp')
+
+    def test_scan_lookup_uses_unique_qr_index(self):
+        with self.conn.cursor() as cursor:
+            plan = explain(cursor, "SELECT id, username FROM users WHERE qr_code_data = %s", ('explain:qr:3',))
+        self.assertEqual(plan['users']['key'], 'uq_users_qr_code_data')
+        self.assertEqual(plan['users']['type'], 'const')
+
+    def test_keyset_pages_cover_range_once(self):
+        where, params = build_log_where(log_filters({'date_from': '2020-01-01', 'date_to': '2020-01-05'}))
+        seen, after = [], None
+        with self.conn.cursor() as cursor:
+            while True:
+                keyset, keyset_params, order_by = keyset_page('desc', after)
+                cursor.execute(f"SELECT logs.id, logs.timestamp FROM logs JOIN users ON logs.user_id = users.id "
+                               f"WHERE {where} AND users.username LIKE %s{keyset} {order_by} LIMIT 7",
+                               (*params, 'explain_user_%', *keyset_params))
+                page = cursor.fetchall()
+                if not page:
+                    break
+                seen.extend(row['id'] for row in page)
+                after = decode_cursor(encode_cursor(page[-1], 'desc'), 'desc')
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 5 * SEED_USERS * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
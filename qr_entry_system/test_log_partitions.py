@@ -0,0 +1,224 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import date, datetime
+
+from db_testing import MySQLTestCase
+from log_partitions import (add_months, archive_month, archived_months, ensure_future, iter_archived,
+                            monthly_partitions, partition_definitions, _export_table)
+
+
+class FakeCursor:
+    """Buffered (dict rows) or unbuffered (tuples) cursor over canned results."""
+
+    def __init__(self, conn, streaming=False):
+        self.conn = conn
+        self.streaming = streaming
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        self.conn.queries.append((query, params))
+        if self.streaming:
+            self.rows = list(self.conn.logs)
+        elif 'COUNT(*)' in query:
+            self.rows = [{'n': len(self.conn.logs)}]
+        elif 'FROM log_archives' in query:
+            self.rows = [{'month': m, 'file': f} for m, f in self.conn.archived]
+        elif 'FROM users' in query:
+            self.rows = [{'id': i, 'username': n, 'area': 'Bodega'} for i, n in self.conn.users.items()]
+        else:
+            self.rows = []
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, logs=(), archived=(), users=None):
+        self.logs = list(logs)
+        self.archived = list(archived)
+        self.users = users or {}
+        self.queries = []
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self, streaming=cursorclass is not None)
+
+    def commit(self):
+        pass
+
+
+class FakeArchiveCursor:
+    """Runs archive_month's statements against FakeArchiveDatabase."""
+
+    def __init__(self, db, streaming=False):
+        self.db = db
+        self.streaming = streaming
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        db = self.db
+        self.rows = []
+        if self.streaming:
+            if db.during_export:
+                db.during_export()
+            self.rows = list(db.tables[re.search(r'FROM (\w+) AS logs', query).group(1)])
+        elif 'FROM log_archives' in query:
+            self.rows = [db.archives[params[0]]] if params[0] in db.archives else []
+        elif 'information_schema.PARTITIONS' in query:
+            self.rows = [{'name': n, 'estimated_rows': len(r)} for n, r in db.partitions.items()]
+        elif 'information_schema.TABLES' in query:
+            self.rows = [{'1': 1}] if params[0] in db.tables else []
+        elif query.startswith('SELECT COUNT(*)'):
+            self.rows = [{'n': len(db.tables[query.split()[-1]])}]
+        elif query.startswith('DROP TABLE'):
+            db.tables.pop(query.split()[-1], None)
+        elif query.startswith('CREATE TABLE'):
+            db.tables[query.split()[2]] = []
+        elif 'EXCHANGE PARTITION' in query:
+            name, table = re.search(r'PARTITION (\w+) WITH TABLE (\w+)', query).groups()
+            db.partitions[name], db.tables[table] = db.tables[table], db.partitions[name]
+        elif 'REORGANIZE PARTITION' in query:
+            name = re.search(r'p_old, (\w+)', query).group(1)
+            db.partitions['p_old'] += db.partitions.pop(name)
+        elif query.startswith('INSERT INTO log_archives'):
+            db.archives[params[0]] = {'rows': params[2], 'dropped': 0}
+        elif query.startswith('UPDATE log_archives'):
+            db.archives[params[0]]['dropped'] = 1
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeArchiveDatabase:
+    """Partitions, tables and log_archives of a partitioned logs, in memory."""
+
+    def __init__(self, month_rows):
+        self.partitions = {'p_old': [], 'p202305': list(month_rows), 'p202306': [], 'p_future': []}
+        self.tables = {}
+        self.archives = {}
+        self.during_export = None
+
+    def cursor(self, cursorclass=None):
+        return FakeArchiveCursor(self, streaming=cursorclass is not None)
+
+    def commit(self):
+        pass
+
+
+class TestPartitionHelpers(unittest.TestCase):
+    def test_add_months_crosses_years(self):
+        self.assertEqual(add_months(date(2024, 11, 1), 3), date(2025, 2, 1))
+        self.assertEqual(add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+
+    def test_partition_definitions(self):
+        clauses = partition_definitions(date(2024, 12, 1), date(2025, 1, 1))
+        self.assertEqual(clauses,
+                         "PARTITION p202412 VALUES LESS THAN ('2025-01-01'), "
+                         "PARTITION p202501 VALUES LESS THAN ('2025-02-01'), "
+                         "PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+        # The table's own lower bound, below the first month
+        self.assertTrue(partition_definitions(date(2024, 12, 1), date(2025, 1, 1), old=True).startswith(
+            "PARTITION p_old VALUES LESS THAN ('2024-12-01'), PARTITION p202412 "))
+
+
+class TestArchiveFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_with_filters(self):
+        logs = [
+            (3, 2, 'gone_user', 'exit', datetime(2023, 5, 31, 17, 0)),
+            (2, 1, 'old_name', 'entry', datetime(2023, 5, 2, 8, 0)),
+            (1, 1, 'old_name', 'exit', datetime(2023, 5, 1, 17, 0)),
+        ]
+        path = os.path.join(self.directory, 'logs-2023-05.csv.gz')
+        self.assertEqual(_export_table(FakeConnection(logs), 'logs_archive_202305', path), 3)
+        self.assertEqual(os.listdir(self.directory), ['logs-2023-05.csv.gz'])
+
+        # User 1 was renamed since, user 2 deleted
+        conn = FakeConnection(archived=[(date(2023, 5, 1), 'logs-2023-05.csv.gz')], users={1: 'Ana'})
+        rows = list(iter_archived(conn, {'date_from': '2023-05-01', 'date_to': '2023-05-31'}, self.directory))
+        self.assertEqual(rows, [
+            (3, 'gone_user', 'exit', datetime(2023, 5, 31, 17, 0)),
+            (2, 'Ana', 'entry', datetime(2023, 5, 2, 8, 0)),
+            (1, 'Ana', 'exit', datetime(2023, 5, 1, 17, 0)),
+        ])
+        rows = list(iter_archived(conn, {'username': 'an', 'action_type': 'exit', 'date_from': '2023-05-01',
+                                         'date_to': '2023-05-01'}, self.directory))
+        self.assertEqual([r[0] for r in rows], [1])
+
+    def test_scan_backdated_during_the_export_is_kept(self):
+        month_rows = [(2, 1, 'ana', 'exit', datetime(2023, 5, 2, 17, 0)),
+                      (1, 1, 'ana', 'entry', datetime(2023, 5, 2, 8, 0))]
+        db = FakeArchiveDatabase(month_rows)
+        stray = (9, 1, 'ana', 'entry', datetime(2023, 5, 20, 8, 0))
+        db.during_export = lambda: db.partitions['p202305'].append(stray)
+
+        self.assertEqual(archive_month(db, date(2023, 5, 1), self.directory), 2)
+        with gzip.open(os.path.join(self.directory, 'logs-2023-05.csv.gz'), 'rt') as f:
+            self.assertEqual([line.split(',')[0] for line in f.read().splitlines()[1:]], ['2', '1'])
+        # Not in the archive, but still live in p_old
+        self.assertEqual(db.partitions['p_old'], [stray])
+        self.assertNotIn('p202305', db.partitions)
+        self.assertEqual(db.archives[date(2023, 5, 1)], {'rows': 2, 'dropped': 1})
+        self.assertEqual(db.tables, {})
+        self.assertIsNone(archive_month(db, date(2023, 5, 1), self.directory))
+
+    def test_nothing_read_without_archived_months(self):
+        conn = FakeConnection()
+        self.assertEqual(list(iter_archived(conn, {'date_from': '2024-01-01'}, self.directory)), [])
+        # Only log_archives was asked
+        self.assertEqual(len(conn.queries), 1)
+        self.assertIn('month >= %s', conn.queries[0][0])
+
+
+class TestLogPartitions(MySQLTestCase):
+    """Partition maintenance against MySQL (skipped without a server)."""
+
+    def test_future_partitions_are_kept_ahead(self):
+        with self.conn.cursor() as cursor:
+            ensure_future(cursor, 2)
+            months = monthly_partitions(cursor)
+            self.assertIn(add_months(date.today().replace(day=1), 2), months)
+            self.assertEqual(ensure_future(cursor, 2), [])
+            self.assertIsInstance(archived_months(cursor), list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import os
+import tempfile
+import unittest
+
+from metrics import Metrics, process_token
+
+# No process has this pid (above pid_max)
+DEAD_PID = 2 ** 22 + 1
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.metrics = Metrics(self.dir, write_interval=60, buckets=(0.1, 1))
+
+    def dead_worker(self, value):
+        snapshot = {'pid': DEAD_PID,
+                    'counters': [['scans_total', [['action', 'entry'], ['result', 'created']], value]],
+                    'gauges': [['http_requests_in_flight', [['endpoint', 'log_scan']], 3]],
+                    'histograms': [['http_request_duration_seconds', [['endpoint', 'log_scan']], [1, 0], 0.05, 1]]}
+        with open(os.path.join(self.dir, f'worker-{DEAD_PID}.json'), 'w') as f:
+            json.dump(snapshot, f)
+
+    def test_render_histogram_and_counters(self):
+        m = self.metrics
+        m.observe('http_request_duration_seconds', 0.05, {'endpoint': 'log_scan'})
+        m.observe('http_request_duration_seconds', 0.5, {'endpoint': 'log_scan'})
+        m.observe('http_request_duration_seconds', 7, {'endpoint': 'log_scan'})
+        m.inc('scans_total', {'action': 'entry', 'result': 'created'})
+        text = m.render()
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="log_scan",le="0.1"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="log_scan",le="1.0"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="log_scan",le="+Inf"} 3', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="log_scan"} 3', text)
+        self.assertIn('scans_total{action="entry",result="created"} 1', text)
+        self.assertIn('# TYPE http_requests_in_flight gauge', text)
+
+    def test_dead_workers_keep_counters_but_not_gauges(self):
+        self.dead_worker(5)
+        self.metrics.inc('scans_total', {'action': 'entry', 'result': 'created'}, 2)
+        self.metrics.gauge_add('http_requests_in_flight', {'endpoint': 'log_scan'})
+        text = self.metrics.render()
+        self.assertIn('scans_total{action="entry",result="created"} 7', text)
+        self.assertIn('http_requests_in_flight{endpoint="log_scan"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{endpoint="log_scan"} 1', text)
+        # Folded into dead.json: nothing counted twice or lost
+        self.assertTrue(os.path.exists(os.path.join(self.dir, 'dead.json')))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, f'worker-{DEAD_PID}.json')))
+        self.dead_worker(1)
+        self.metrics._fold_dead()
+        self.assertIn('scans_total{action="entry",result="created"} 8', self.metrics.render())
+
+    @unittest.skipIf(process_token(os.getpid()) is None, "needs /proc")
+    def test_reused_pid_does_not_take_over_a_dead_workers_file(self):
+        # Written before a restart by a process that had this worker's pid
+        snapshot = {'pid': os.getpid(), 'process': f'{os.getpid()}-00000000-1',
+                    'counters': [['scans_total', [['action', 'exit'], ['result', 'created']], 4]],
+                    'gauges': [], 'histograms': []}
+        with open(os.path.join(self.dir, f"worker-{snapshot['process']}.json"), 'w') as f:
+            json.dump(snapshot, f)
+        self.metrics.inc('scans_total', {'action': 'exit', 'result': 'created'})
+        self.assertIn('scans_total{action="exit",result="created"} 5', self.metrics.render())
+        self.assertFalse(os.path.exists(os.path.join(self.dir, f"worker-{snapshot['process']}.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+from datetime import date, datetime
+
+from payroll import colombian_holidays, easter_sunday, is_sunday_or_holiday, payroll_summary, user_summary
+
+
+def log(kind, ts, username='ana'):
+    return {'username': username, 'type': kind, 'timestamp': datetime.strptime(ts, '%Y-%m-%d %H:%M')}
+
+
+class TestHolidays(unittest.TestCase):
+    def test_easter(self):
+        self.assertEqual(easter_sunday(2024), date(2024, 3, 31))
+        self.assertEqual(easter_sunday(2025), date(2025, 4, 20))
+        self.assertEqual(easter_sunday(2038), date(2038, 4, 25))
+
+    def test_2024_calendar(self):
+        # The list export_logs_pdf used to hardcode, plus Epiphany (moved to Jan 8)
+        expected = {
+            '2024-01-01', '2024-01-08', '2024-03-25', '2024-03-28', '2024-03-29', '2024-05-01',
+            '2024-05-13', '2024-06-03', '2024-06-10', '2024-07-01', '2024-07-20',
+            '2024-08-07', '2024-08-19', '2024-10-14', '2024-11-04', '2024-11-11',
+            '2024-12-08', '2024-12-25',
+        }
+        self.assertEqual({d.isoformat() for d in colombian_holidays(2024)}, expected)
+
+    def test_emiliani_moves_to_monday(self):
+        holidays = colombian_holidays(2025)
+        self.assertIn(date(2025, 1, 6), holidays)    # Already a Monday
+        self.assertIn(date(2025, 3, 24), holidays)   # Mar 19 (Wed)
+        self.assertIn(date(2025, 11, 17), holidays)  # Nov 11 (Tue)
+        self.assertNotIn(date(2025, 3, 19), holidays)
+        # Sacred Heart and Saints Peter and Paul both land on June 30
+        self.assertIn(date(2025, 6, 30), holidays)
+        self.assertEqual(len(holidays), 17)
+
+    def test_memoized_per_year(self):
+        self.assertIs(colombian_holidays(2030), colombian_holidays(2030))
+
+    def test_sunday_or_holiday(self):
+        self.assertTrue(is_sunday_or_holiday(date(2024, 3, 3)))              # Sunday
+        self.assertTrue(is_sunday_or_holiday(datetime(2024, 12, 25, 9, 0)))  # Christmas
+        self.assertFalse(is_sunday_or_holiday(date(2024, 3, 4)))
+
+
+class TestPayroll(unittest.TestCase):
+    def test_lunch_is_not_paid(self):
+        summary = user_summary([
+            log('entry', '2024-03-04 08:00'),
+            log('start_lunch', '2024-03-04 12:00'),
+            log('end_lunch', '2024-03-04 13:00'),
+            log('exit', '2024-03-04 17:30'),
+        ])
+        self.assertEqual(summary, {'total_hours': 8.5, 'sunday_holiday_hours': 0, 'overtime_hours': 0.5})
+
+    def test_overtime_is_per_day_not_per_session(self):
+        summary = user_summary([
+            log('entry', '2024-03-04 06:00'), log('exit', '2024-03-04 11:00'),
+            log('entry', '2024-03-04 13:00'), log('exit', '2024-03-04 18:00'),
+            log('entry', '2024-03-05 08:00'), log('exit', '2024-03-05 15:00'),
+        ])
+        self.assertEqual(summary['total_hours'], 17)
+        self.assertEqual(summary['overtime_hours'], 2)
+
+    def test_session_spanning_midnight_is_split(self):
+        # Saturday 20:00 to Sunday 06:00: 4h on Saturday, 6h on Sunday
+        summary = user_summary([log('entry', '2024-03-02 20:00'), log('exit', '2024-03-03 06:00')])
+        self.assertEqual(summary, {'total_hours': 10, 'sunday_holiday_hours': 6, 'overtime_hours': 0})
+
+    def test_lunch_across_midnight(self):
+        summary = user_summary([
+            log('entry', '2024-03-04 18:00'),
+            log('start_lunch', '2024-03-04 23:30'),
+            log('end_lunch', '2024-03-05 00:30'),
+            log('exit', '2024-03-05 04:00'),
+        ])
+        self.assertEqual(summary['total_hours'], 9)
+        self.assertEqual(summary['overtime_hours'], 0)
+
+    def test_unpaired_events_are_ignored(self):
+        summary = user_summary([
+            log('exit', '2024-03-04 07:00'),         # No open session
+            log('end_lunch', '2024-03-04 07:30'),    # No open session
+            log('entry', '2024-03-04 08:00'),
+            log('end_lunch', '2024-03-04 09:00'),    # Not on lunch
+            log('exit', '2024-03-04 12:00'),
+            log('entry', '2024-03-05 08:00'),        # Never closed
+        ])
+        self.assertEqual(summary['total_hours'], 4)
+
+    def test_repeated_entry_restarts_session(self):
+        # Forgotten exit on Monday: the Tuesday entry starts a new session
+        summary = user_summary([
+            log('entry', '2024-03-04 08:00'),
+            log('entry', '2024-03-05 08:00'),
+            log('exit', '2024-03-05 16:00'),
+        ])
+        self.assertEqual(summary['total_hours'], 8)
+
+    def test_exit_during_lunch_closes_session(self):
+        summary = user_summary([
+            log('entry', '2024-03-04 08:00'),
+            log('start_lunch', '2024-03-04 12:00'),
+            log('exit', '2024-03-04 13:00'),
+        ])
+        self.assertEqual(summary['total_hours'], 4)
+
+    def test_holiday_hours(self):
+        summary = user_summary([log('entry', '2024-12-25 08:00'), log('exit', '2024-12-25 12:00')])
+        self.assertEqual(summary['sunday_holiday_hours'], 4)
+
+    def test_groups_users_and_accepts_descending_order(self):
+        logs = [
+            log('exit', '2024-03-04 17:00', 'ana'),
+            log('exit', '2024-03-04 16:00', 'luis'),
+            log('entry', '2024-03-04 08:00', 'luis'),
+            log('entry', '2024-03-04 07:00', 'ana'),
+        ]
+        summary = payroll_summary(logs)
+        self.assertEqual(summary['ana']['total_hours'], 10)
+        self.assertEqual(summary['ana']['overtime_hours'], 2)
+        self.assertEqual(summary['luis']['total_hours'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
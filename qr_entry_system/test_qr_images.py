@@ -0,0 +1,65 @@
+import re
+import unittest
+
+import qrcode
+
+from qr_images import BORDER, QRImageCache, qr_version, render_png, render_svg
+
+DATA = 'user:ana:1a2b3c4d'
+
+
+def svg_matrix(svg):
+    """Rebuild the module matrix from the horizontal runs render_svg writes."""
+    size = int(re.search(rb'viewBox="0 0 (\d+) \d+"', svg).group(1))
+    matrix = [[False] * size for _ in range(size)]
+    for x, y, width in re.findall(rb'M(\d+) (\d+)h(\d+)', svg):
+        for i in range(int(x), int(x) + int(width)):
+            matrix[int(y)][i] = True
+    return matrix
+
+
+class TestRender(unittest.TestCase):
+    def test_svg_has_the_same_modules_as_qrcode(self):
+        qr = qrcode.QRCode(border=BORDER)
+        qr.add_data(DATA)
+        qr.make(fit=True)
+        self.assertEqual(svg_matrix(render_svg(DATA)), qr.get_matrix())
+
+    def test_png(self):
+        self.assertTrue(render_png(DATA).startswith(b'\x89PNG'))
+
+
+class TestQRImageCache(unittest.TestCase):
+    def test_hit_after_first_render(self):
+        cache = QRImageCache()
+        first, etag = cache.get(DATA, 'svg')
+        second, same_etag = cache.get(DATA, 'svg')
+        self.assertIs(first, second)
+        self.assertEqual(etag, same_etag)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_etag_follows_data_and_format(self):
+        cache = QRImageCache()
+        _, png = cache.get(DATA, 'png')
+        _, svg = cache.get(DATA, 'svg')
+        _, other = cache.get('user:ana:ffffffff', 'png')
+        self.assertEqual(len({png, svg, other}), 3)
+        self.assertIn(qr_version(DATA), png)
+
+    def test_lru_bound_and_invalidate(self):
+        cache = QRImageCache(size=2)
+        cache.get('a', 'svg')
+        cache.get('b', 'svg')
+        cache.get('a', 'svg')          # 'b' is now least recently used
+        cache.get('c', 'svg')
+        self.assertEqual(len(cache._images), 2)
+        cache.get('b', 'svg')
+        self.assertEqual(cache.misses, 4)
+
+        cache.invalidate('b')
+        cache.get('b', 'svg')
+        self.assertEqual(cache.misses, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
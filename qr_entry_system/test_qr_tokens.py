@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from qr_tokens import InvalidToken, KeystoreError, QRTokens, REVOKE_ALL, is_signed, load_keys, parse_keys
+
+KEYS = {'k1': b'first-secret', 'k2': b'second-secret'}
+
+
+class FakeRevocations:
+    """Stands in for a connection: serves qr_revocations rows to QRTokens.sync."""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, user_id, before):
+        self.rows.append({'id': len(self.rows) + 1, 'user_id': user_id, 'revoked_before': before})
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        self._result = [r for r in self.rows if r['id'] > params[0]]
+
+    def fetchall(self):
+        return self._result
+
+
+class TestQRTokens(unittest.TestCase):
+    def test_round_trip(self):
+        tokens = QRTokens('k1', KEYS)
+        token = tokens.issue(42, issued_at=1700000000000)
+        self.assertTrue(is_signed(token))
+        self.assertFalse(is_signed('user:ana:1a2b3c4d'))
+        self.assertEqual(tokens.verify(token), (42, 1700000000000, 'k1'))
+
+    def test_tampering_is_rejected(self):
+        tokens = QRTokens('k1', KEYS)
+        prefix, kid, payload, signature = tokens.issue(42).split('.')
+        other_payload = tokens.issue(43).split('.')[2]
+        for bad in (f'{prefix}.{kid}.{other_payload}.{signature}',
+                    f'{prefix}.k2.{payload}.{signature}',
+                    f'{prefix}.k9.{payload}.{signature}',
+                    f'{prefix}.{kid}.{payload}.{signature[:-2]}',
+                    f'{prefix}.{kid}.{payload}',
+                    f'{prefix}.{kid}.!!.{signature}',
+                    'user:ana:1a2b3c4d'):
+            with self.assertRaises(InvalidToken, msg=bad):
+                tokens.verify(bad)
+
+    def test_rotation_keeps_old_tokens_valid(self):
+        old = QRTokens('k1', {'k1': KEYS['k1']}).issue(7)
+        rotated = QRTokens(*parse_keys('k2:second-secret, k1:first-secret'))
+        self.assertEqual(rotated.verify(old)[0], 7)
+        self.assertEqual(rotated.verify(rotated.issue(7))[2], 'k2')
+        # Once k1 is retired its tokens no longer verify
+        with self.assertRaises(InvalidToken):
+            QRTokens(*parse_keys('k2:second-secret')).verify(old)
+
+    def test_revocation_sync(self):
+        tokens = QRTokens('k1', KEYS)
+        db = FakeRevocations()
+        old, new = tokens.issue(5, issued_at=1000), tokens.issue(5, issued_at=2000)
+        other = tokens.issue(6, issued_at=1000)
+
+        db.add(5, 2000)
+        tokens.sync(db)
+        with self.assertRaises(InvalidToken):
+            tokens.verify(old)
+        self.assertEqual(tokens.verify(new)[0], 5)
+        self.assertEqual(tokens.verify(other)[0], 6)
+
+        db.add(5, REVOKE_ALL)
+        tokens.sync(db)
+        with self.assertRaises(InvalidToken):
+            tokens.verify(new)
+
+    def test_ensure_current_throttles_sync(self):
+        tokens = QRTokens('k1', KEYS, sync_interval=60)
+        db = FakeRevocations()
+        tokens.ensure_current(db)
+        db.add(5, REVOKE_ALL)
+        token = tokens.issue(5)
+        tokens.ensure_current(db)           # within the interval: not synced yet
+        self.assertEqual(tokens.verify(token)[0], 5)
+        tokens.sync_interval = 0
+        with self.assertRaises(InvalidToken):
+            tokens.ensure_current(db).verify(token)
+
+
+class TestKeys(unittest.TestCase):
+    def test_parse_keys(self):
+        self.assertEqual(parse_keys('a:x,b:y'), ('a', {'a': b'x', 'b': b'y'}))
+        for spec in ('', 'nosecret', 'a b:x', 'a:'):
+            with self.assertRaises(ValueError):
+                parse_keys(spec)
+
+    def test_generated_key_file_is_reused(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {'QR_SIGNING_KEYS': ''}):
+            path = os.path.join(tmp, 'instance', 'keys.json')
+            first = load_keys(path)
+            self.assertEqual(load_keys(path), first)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_bad_keys_raise_keystore_error(self):
+        with mock.patch.dict(os.environ, {'QR_SIGNING_KEYS': 'nosecret'}):
+            with self.assertRaises(KeystoreError):
+                QRTokens().issue(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
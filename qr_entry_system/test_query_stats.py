@@ -0,0 +1,66 @@
+import unittest
+
+from flask import Flask
+
+from db import QueryBudgetExceeded, QueryStats, TimedCursorMixin, fingerprint, query_stats
+
+app = Flask(__name__)
+
+
+class FakeCursor:
+    def execute(self, query, args=None):
+        return 1
+
+
+class Timed(TimedCursorMixin, FakeCursor):
+    pass
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_literals_and_lists_fold(self):
+        self.assertEqual(fingerprint("SELECT id FROM users WHERE id IN (%s, %s)\n  AND role = 'admin'"),
+                         'SELECT id FROM users WHERE id IN (...) AND role = ?')
+        self.assertEqual(fingerprint("INSERT INTO logs (user_id, type) VALUES (1, 'entry'), (2, 'exit')"),
+                         fingerprint("INSERT INTO logs (user_id, type) VALUES (%s, %s)"))
+
+
+class TestQueryStats(unittest.TestCase):
+    def test_totals_and_request_tally(self):
+        stats = QueryStats(slow_ms=0)
+        with app.test_request_context():
+            for user_id in range(3):
+                stats.record(None, 'SELECT * FROM users WHERE id = %s', (user_id,), 0.002)
+            self.assertEqual(stats.request_tally()[0], 3)
+        with app.test_request_context():
+            self.assertEqual(stats.request_tally(), (0, 0.0))
+        # Outside a request only the totals move
+        stats.record(None, 'SELECT NOW()', None, 0.001)
+        top = stats.stats()['top']
+        self.assertEqual([(t['statement'], t['count']) for t in top],
+                         [('SELECT * FROM users WHERE id = ?', 3), ('SELECT NOW()', 1)])
+
+    def test_budget_catches_n_plus_one(self):
+        stats = QueryStats(slow_ms=0, budget=5)
+        with app.test_request_context():
+            for user_id in range(5):
+                stats.record(None, 'SELECT * FROM logs WHERE user_id = %s', (user_id,), 0.001)
+            with self.assertRaisesRegex(QueryBudgetExceeded, r'6x SELECT \* FROM logs WHERE user_id = \?'):
+                stats.record(None, 'SELECT * FROM logs WHERE user_id = %s', (5,), 0.001)
+
+    def test_slow_statements_are_logged(self):
+        stats = QueryStats(slow_ms=10)
+        with self.assertLogs('db.slow', 'WARNING') as logs:
+            stats.record(Timed(), "INSERT INTO logs (user_id) VALUES (1)", None, 0.05)
+        self.assertIn('50 ms: INSERT INTO logs (user_id) VALUES (...)', logs.output[0])
+        self.assertEqual(stats.slow, 1)
+
+    def test_cursor_mixin_records(self):
+        before = query_stats.stats(top=1000)['top']
+        count = sum(t['count'] for t in before if t['statement'] == 'SELECT ? FROM dual')
+        Timed().execute('SELECT 1 FROM dual')
+        after = query_stats.stats(top=1000)['top']
+        self.assertEqual(sum(t['count'] for t in after if t['statement'] == 'SELECT ? FROM dual'), count + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
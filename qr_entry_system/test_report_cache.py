@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+import log_export
+from db_testing import MySQLTestCase
+from log_queries import build_log_where, log_filters
+from report_cache import ReportCache, cache_key, normalize_filters, pdf_watermark, watermark
+from test_log_export import FakeStreamingConnection
+
+
+class FakeSnapshotCursor:
+    """DictCursor stand-in for the snapshot + watermark queries."""
+
+    def __init__(self, mark):
+        self.mark = mark
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchone(self):
+        return dict(zip(('n', 'max_id', 'id_xor'), self.mark))
+
+    def fetchall(self):
+        return []                   # no archived months
+
+
+class FakeCachingConnection(FakeStreamingConnection):
+    def __init__(self, count, mark):
+        super().__init__(count)
+        self.mark = mark
+
+    def cursor(self, cursorclass=None):
+        return self.cursor_obj if cursorclass else FakeSnapshotCursor(self.mark)
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        return self.conn
+
+    def release(self, conn, discard=False):
+        pass
+
+
+class TestReportCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = ReportCache(self.tmp, max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def put(self, key, size):
+        with self.cache.writer(key, 'csv') as f:
+            f.write(b'x' * size)
+
+    def test_equivalent_filters_share_a_key(self):
+        a = log_filters({'username': ' Ana ', 'date_from': '2024-03-01'})
+        b = log_filters({'username': 'ana', 'date_from': '2024-03-01', 'date_to': ''})
+        self.assertEqual(normalize_filters(a), normalize_filters(b))
+        self.assertEqual(cache_key(a, 'csv', [3, 10, 7]), cache_key(b, 'csv', [3, 10, 7]))
+
+    def test_watermark_and_format_change_the_key(self):
+        filters = log_filters({'date_from': '2024-03-01'})
+        key = cache_key(filters, 'csv', [3, 10, 7])
+        self.assertNotEqual(key, cache_key(filters, 'csv', [4, 11, 13]))
+        self.assertNotEqual(key, cache_key(filters, 'pdf', [3, 10, 7]))
+
+    def test_writer_publishes_only_complete_files(self):
+        with self.assertRaises(RuntimeError):
+            with self.cache.writer('a' * 64, 'csv') as f:
+                f.write(b'partial')
+                raise RuntimeError('client went away')
+        self.assertIsNone(self.cache.get('a' * 64, 'csv'))
+        self.assertEqual(os.listdir(self.tmp), [])
+
+        self.put('b' * 64, 10)
+        with open(self.cache.get('b' * 64, 'csv'), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 10)
+
+    def test_evicts_least_recently_used(self):
+        self.put('a' * 64, 100)
+        self.put('b' * 64, 100)
+        # Make 'a' older on disk, then touch it with a hit so 'b' is the LRU entry
+        past = time.time() - 60
+        os.utime(self.cache.path('a' * 64, 'csv'), (past, past))
+        os.utime(self.cache.path('b' * 64, 'csv'), (past + 1, past + 1))
+        self.assertIsNotNone(self.cache.get('a' * 64, 'csv'))
+        self.put('c' * 64, 100)
+        self.assertIsNotNone(self.cache.get('a' * 64, 'csv'))
+        self.assertIsNone(self.cache.get('b' * 64, 'csv'))
+        self.assertIsNotNone(self.cache.get('c' * 64, 'csv'))
+
+    def test_oversized_entry_survives_its_own_write(self):
+        self.put('a' * 64, 100)
+        self.put('b' * 64, 400)
+        self.assertIsNone(self.cache.get('a' * 64, 'csv'))
+        self.assertIsNotNone(self.cache.get('b' * 64, 'csv'))
+        # Evicted by the next write like any other entry
+        past = time.time() - 60
+        os.utime(self.cache.path('b' * 64, 'csv'), (past, past))
+        self.put('c' * 64, 10)
+        self.assertIsNone(self.cache.get('b' * 64, 'csv'))
+
+    def test_open_entry_outlives_eviction(self):
+        self.put('a' * 64, 10)
+        with self.cache.open('a' * 64, 'csv') as f:
+            self.cache.clear()
+            self.assertIsNone(self.cache.open('a' * 64, 'csv'))
+            self.assertEqual(f.read(), b'x' * 10)
+
+    def test_csv_stream_is_cached_under_snapshot_watermark(self):
+        filters = log_filters({'date_from': '2024-03-01'})
+        where, params = build_log_where(filters)
+        original_pool, original_cache = log_export.pool, log_export.report_cache
+        log_export.pool = FakePool(FakeCachingConnection(25, [25, 99, 5]))
+        log_export.report_cache = cache = ReportCache(self.tmp)
+        try:
+            body = ''.join(log_export.stream_logs_csv(where, params, filters=filters, chunk_size=10))
+        finally:
+            log_export.pool, log_export.report_cache = original_pool, original_cache
+        with open(cache.get(cache_key(filters, 'csv', [25, 99, 5]), 'csv'), 'rb') as f:
+            self.assertEqual(f.read().decode('utf-8'), body)
+
+
+class TestWatermark(MySQLTestCase):
+    """Watermark against MySQL (skipped without a server)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user_id = cls.create_user('cache_user', 'cache:qr')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.delete_users('cache_user')
+        super().tearDownClass()
+
+    def mark(self):
+        where, params = build_log_where(log_filters({'username': 'cache_user', 'date_from': '2024-03-01',
+                                                     'date_to': '2024-03-31'}))
+        with self.conn.cursor() as cursor:
+            return watermark(cursor, where, params)
+
+    def add(self, ts):
+        with self.conn.cursor() as cursor:
+            cursor.execute("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, 'entry', %s)", (self.user_id, ts))
+            log_id = cursor.lastrowid
+        self.conn.commit()
+        return log_id
+
+    def test_any_change_in_range_moves_the_watermark(self):
+        first = self.add(datetime(2024, 3, 5, 8))
+        self.add(datetime(2024, 3, 6, 8))
+        before = self.mark()
+
+        self.add(datetime(2024, 4, 1, 8))            # Out of range
+        self.assertEqual(self.mark(), before)
+
+        with self.conn.cursor() as cursor:           # Delete one, insert another: same count
+            cursor.execute("DELETE FROM logs WHERE id = %s", (first,))
+        self.conn.commit()
+        self.add(datetime(2024, 3, 7, 8))
+        after = self.mark()
+        self.assertEqual(after[0], before[0])
+        self.assertNotEqual(after, before)
+
+    def test_pdf_watermark_follows_the_rollup(self):
+        filters = log_filters({'username': 'cache_user', 'date_from': '2024-03-10', 'date_to': '2024-03-10',
+                               'action_type': 'entry'})
+        self.add(datetime(2024, 3, 10, 8))
+        with self.conn.cursor() as cursor:
+            cursor.execute("DELETE FROM work_days WHERE user_id = %s", (self.user_id,))
+            cursor.execute("INSERT INTO work_days (user_id, work_date, worked_seconds) VALUES (%s, '2024-03-10', 3600)",
+                           (self.user_id,))
+            before = pdf_watermark(cursor, filters)
+            # An exit outside the action filter closes the shift: only the rollup changes
+            cursor.execute("UPDATE work_days SET worked_seconds = 7200 WHERE user_id = %s", (self.user_id,))
+            after = pdf_watermark(cursor, filters)
+        self.conn.commit()
+        self.assertEqual(after[:3], before[:3])
+        self.assertNotEqual(after, before)
+
+
+if __name__ == '__main__':
+    unittest.main()
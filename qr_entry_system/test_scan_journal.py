@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+
+from scan_journal import DEAD_DIR, SUFFIX, ScanJournal
+
+
+class Recorder:
+    """Stands in for write_records: keeps the batches instead of writing them to MySQL."""
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+        self.poison = set()         # user ids whose scans cannot be written
+
+    def __call__(self, records):
+        if self.fail:
+            raise ConnectionError('MySQL down')
+        if any(r['u'] in self.poison for r in records):
+            raise ValueError('bad scan')
+        self.batches.append(list(records))
+        return len(records)
+
+    @property
+    def records(self):
+        return [r for batch in self.batches for r in batch]
+
+
+class TestScanJournal(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        # Cleanups run last-in first-out: journals close before the directory goes
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.recorder = Recorder()
+
+    def journal(self, **kwargs):
+        kwargs.setdefault('flush_ms', 60000)
+        journal = ScanJournal(self.dir, write=self.recorder, **kwargs)
+        self.addCleanup(journal.close)
+        return journal
+
+    def segments(self):
+        return [n for n in os.listdir(self.dir) if n.endswith(SUFFIX)]
+
+    def test_scans_are_on_disk_before_the_flush(self):
+        journal = self.journal()
+        record = journal.append(7, 'entry', datetime(2024, 3, 4, 7, 0, 0, 500))
+        self.assertEqual(record['t'], '2024-03-04 07:00:00')
+        [segment] = self.segments()
+        with open(os.path.join(self.dir, segment)) as f:
+            self.assertEqual(json.loads(f.readline()), record)
+        self.assertEqual(self.recorder.batches, [])
+
+        journal.append(8, 'exit')
+        self.assertEqual(journal.flush(), 2)
+        self.assertEqual([r['u'] for r in self.recorder.records], [7, 8])
+        # The flushed segment is gone; only the new, empty one is left
+        self.assertNotIn(segment, self.segments())
+        self.assertEqual(journal.stats()['pending'], 0)
+
+    def test_flusher_writes_in_batches(self):
+        journal = self.journal(flush_rows=50)
+        for i in range(120):
+            journal.append(i, 'entry')
+        journal.close()
+        self.assertEqual(len(self.recorder.records), 120)
+        self.assertLess(len(self.recorder.batches), 120)
+        self.assertEqual(self.segments(), [])
+
+    def test_concurrent_appends_share_fsyncs(self):
+        journal = self.journal()
+        threads = [threading.Thread(target=lambda: [journal.append(1, 'entry') for _ in range(50)])
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = journal.stats()
+        self.assertEqual(stats['appended'], 400)
+        self.assertLessEqual(stats['fsyncs'], 400)
+        journal.flush()
+        self.assertEqual(len({r['k'] for r in self.recorder.records}), 400)
+
+    def test_failed_write_is_retried(self):
+        journal = self.journal()
+        journal.append(1, 'entry')
+        self.recorder.fail = True
+        self.assertEqual(journal.flush(), 0)
+        self.assertEqual(journal.stats()['errors'], 1)
+        journal.append(2, 'exit')
+        self.recorder.fail = False
+        self.assertEqual(journal.flush(), 2)
+        self.assertEqual([r['u'] for r in self.recorder.records], [1, 2])
+
+    def test_flusher_survives_os_errors(self):
+        journal = self.journal(flush_ms=20)
+        journal.start()
+        open_segment = journal._open_segment
+        failures = []
+
+        def out_of_descriptors():
+            if not failures:
+                failures.append(1)
+                raise OSError(24, 'Too many open files')
+            open_segment()
+
+        journal._open_segment = out_of_descriptors
+        with self.assertLogs('scan_journal', 'ERROR'):
+            journal.append(7, 'entry')
+            deadline = time.monotonic() + 5
+            while not self.recorder.records and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual([r['u'] for r in self.recorder.records], [7])
+        self.assertEqual(journal.stats()['errors'], 1)
+
+    def test_poison_scan_is_dead_lettered(self):
+        journal = self.journal(max_attempts=2)
+        for user_id in (1, 2, 3):
+            journal.append(user_id, 'entry')
+        self.recorder.poison = {2}
+        self.assertEqual(journal.flush(), 0)
+        # Outages do not count towards the attempts
+        self.recorder.fail = True
+        self.assertEqual(journal.flush(), 0)
+        self.recorder.fail = False
+        with self.assertLogs('scan_journal', 'ERROR'):
+            self.assertEqual(journal.flush(), 2)
+        self.assertEqual([r['u'] for r in self.recorder.records], [1, 3])
+        self.assertEqual(journal.stats()['dead_lettered'], 1)
+        [dead] = os.listdir(os.path.join(self.dir, DEAD_DIR))
+        with open(os.path.join(self.dir, DEAD_DIR, dead)) as f:
+            self.assertEqual(json.loads(f.readline())['record']['u'], 2)
+        # The scans behind it are no longer held back
+        journal.append(4, 'exit')
+        self.assertEqual(journal.flush(), 1)
+
+    def test_orphaned_segment_is_replayed(self):
+        # What a killed worker leaves behind: an unlocked segment, last line torn
+        lines = [json.dumps({'k': f'j-{i}', 'u': i, 'a': 'entry', 't': '2024-03-04 07:00:00'}) for i in range(3)]
+        with open(os.path.join(self.dir, 'scans-1-dead' + SUFFIX), 'w') as f:
+            f.write('\n'.join(lines) + '\n{"k": "j-3", "u"')
+
+        journal = self.journal()
+        journal.start()
+        self.assertEqual(journal.stats()['replayed'], 3)
+        journal.flush()
+        self.assertEqual([r['k'] for r in self.recorder.records], ['j-0', 'j-1', 'j-2'])
+        self.assertNotIn('scans-1-dead' + SUFFIX, self.segments())
+
+    def test_live_segments_are_not_replayed(self):
+        first = self.journal()
+        first.append(1, 'entry')
+        second = self.journal()
+        # Same process, separate open file: the flock still excludes it
+        second.start()
+        self.assertEqual(second.stats()['replayed'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from db_testing import MySQLTestCase
+from qr_tokens import qr_tokens
+from scans import RecentScans, parse_client_timestamp, parse_item, record_batch, record_scan
+from user_status import InvalidTransition
+
+NOW = datetime(2024, 3, 4, 12, 0)
+
+
+class TestParse(unittest.TestCase):
+    def test_client_timestamp(self):
+        self.assertEqual(parse_client_timestamp('2024-03-04T07:30:15.250'), datetime(2024, 3, 4, 7, 30, 15))
+        utc = datetime(2024, 3, 4, 12, 0, tzinfo=timezone.utc)
+        self.assertEqual(parse_client_timestamp('2024-03-04T12:00:00Z'), utc.astimezone().replace(tzinfo=None))
+        for bad in ('ayer', 1709539200, ''):
+            with self.assertRaises(ValueError):
+                parse_client_timestamp(bad)
+
+    def test_item(self):
+        ref, action, ts, key = parse_item(
+            {'username': ' Ana ', 'action_type': 'entry', 'client_timestamp': '2024-03-04T07:00:00',
+             'idempotency_key': 'kiosk1:42'}, NOW)
+        self.assertEqual((ref, action, ts, key), (('username', 'ana'), 'entry', datetime(2024, 3, 4, 7), 'kiosk1:42'))
+        self.assertEqual(parse_item({'qr_data': 'user:ana:01', 'action_type': 'exit'}, NOW)[0::2],
+                         (('qr', 'user:ana:01'), NOW))
+        token = qr_tokens.issue(42)
+        self.assertEqual(parse_item({'qr_data': token, 'action_type': 'exit'}, NOW)[0], ('id', 42))
+
+    def test_invalid_items(self):
+        for item in ({'username': 'ana', 'action_type': 'nap'},
+                     {'action_type': 'entry'},
+                     {'qr_data': 'qr1.k1.AAAA.BBBB', 'action_type': 'entry'},
+                     {'username': 'ana', 'action_type': 'entry', 'client_timestamp': '2024-03-04T13:00:00'},
+                     {'username': 'ana', 'action_type': 'entry', 'client_timestamp': '2024-01-01T08:00:00'},
+                     {'username': 'ana', 'action_type': 'entry', 'idempotency_key': 'x' * 65},
+                     'ana'):
+            with self.assertRaises(ValueError, msg=item):
+                parse_item(item, NOW)
+
+
+class TestRecentScans(unittest.TestCase):
+    def test_repeat_inside_window(self):
+        recent = RecentScans(window=60)
+        first = {'username': 'ana', 'action_type': 'entry'}
+        self.assertIsNone(recent.original(1, 'entry'))
+        recent.remember(1, 'entry', None, first)
+        self.assertIs(recent.original(1, 'entry'), first)
+        self.assertIsNone(recent.original(1, 'exit'))
+        self.assertIsNone(recent.original(2, 'entry'))
+        # A new key goes to the database, which records it against the first scan
+        self.assertIsNone(recent.original(1, 'entry', 'kiosk1:8'))
+        with mock.patch('scans.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(recent.original(1, 'entry'))
+        self.assertEqual(recent.suppressed, 1)
+
+    def test_idempotency_key_outlives_window(self):
+        recent = RecentScans(window=0)
+        first = {'username': 'ana', 'action_type': 'entry'}
+        recent.remember(1, 'entry', 'kiosk1:7', first)
+        self.assertIsNone(recent.original(1, 'entry'))
+        self.assertIs(recent.original(1, 'exit', 'kiosk1:7'), first)
+
+    def test_bounded(self):
+        recent = RecentScans(size=2, window=60)
+        for user_id in range(5):
+            recent.remember(user_id, 'entry', f'k{user_id}', {})
+        self.assertEqual((len(recent._scans), len(recent._keys)), (2, 2))
+        self.assertIsNone(recent.original(0, 'entry', 'k0'))
+
+
+class TestRecordBatch(MySQLTestCase):
+    """Batch uploads against MySQL (skipped without a server)."""
+
+    def setUp(self):
+        self.clear_keys()
+        self.user_id = self.create_user('batch_user', 'batch:qr')
+        self.base = datetime.now().replace(microsecond=0) - timedelta(hours=10)
+
+    def tearDown(self):
+        self.delete_users('batch_user')
+        self.clear_keys()
+
+    def clear_keys(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("DELETE FROM scan_idempotency WHERE idempotency_key LIKE %s", ('test-batch-%',))
+        self.conn.commit()
+
+    def at(self, hours):
+        return (self.base + timedelta(hours=hours)).isoformat()
+
+    def logs(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT type, timestamp FROM logs WHERE user_id = %s ORDER BY timestamp", (self.user_id,))
+            return [(r['type'], r['timestamp']) for r in cursor.fetchall()]
+
+    def test_batch_honors_client_time_and_keys(self):
+        scans = [
+            {'qr_data': 'batch:qr', 'action_type': 'entry', 'client_timestamp': self.at(0),
+             'idempotency_key': 'test-batch-1'},
+            {'username': 'BATCH_USER', 'action_type': 'exit', 'client_timestamp': self.at(8),
+             'idempotency_key': 'test-batch-2'},
+            {'username': 'nadie', 'action_type': 'exit'},
+            {'username': 'batch_user', 'action_type': 'exit', 'client_timestamp': self.at(9),
+             'idempotency_key': 'test-batch-2'},
+        ]
+        results = record_batch(self.conn, scans)
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'error', 'duplicate'])
+        self.assertEqual(results[3]['timestamp'], results[1]['timestamp'])
+        self.assertEqual(self.logs(), [('entry', self.base), ('exit', self.base + timedelta(hours=8))])
+
+        # Replaying the same upload changes nothing
+        again = record_batch(self.conn, scans[:2])
+        self.assertEqual([r['status'] for r in again], ['duplicate', 'duplicate'])
+        self.assertEqual(len(self.logs()), 2)
+
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT SUM(worked_seconds) AS s FROM work_days WHERE user_id = %s", (self.user_id,))
+            self.assertEqual(int(cursor.fetchone()['s']), 8 * 3600)
+
+
+    def test_live_scans_are_debounced(self):
+        with self.conn.cursor() as cursor:
+            first, created, _ = record_scan(cursor, self.user_id, 'entry')
+            self.assertTrue(created)
+            again, created, _ = record_scan(cursor, self.user_id, 'entry')
+            self.assertEqual((again, created), (first, False))
+            self.assertTrue(record_scan(cursor, self.user_id, 'exit')[1])
+            # Outside the window the scan counts again
+            cursor.execute("UPDATE scan_dedupe SET scanned_at = scanned_at - INTERVAL 1 HOUR WHERE user_id = %s",
+                           (self.user_id,))
+            self.assertTrue(record_scan(cursor, self.user_id, 'entry')[1])
+            # A known idempotency key returns the original scan
+            ts, _, _ = record_scan(cursor, self.user_id, 'start_lunch', 'test-batch-live')
+            self.assertEqual(record_scan(cursor, self.user_id, 'end_lunch', 'test-batch-live'), (ts, False, None))
+            # A keyed scan that was debounced, retried after the window: still that one scan
+            self.assertEqual(record_scan(cursor, self.user_id, 'start_lunch', 'test-batch-retry'), (ts, False, None))
+            cursor.execute("UPDATE scan_dedupe SET scanned_at = scanned_at - INTERVAL 1 HOUR WHERE user_id = %s",
+                           (self.user_id,))
+            self.assertEqual(record_scan(cursor, self.user_id, 'start_lunch', 'test-batch-retry'), (ts, False, None))
+        self.conn.commit()
+        self.assertEqual([t for t, _ in self.logs()].count('entry'), 2)
+        self.assertEqual(len(self.logs()), 4)
+
+    def test_out_of_sequence_scans(self):
+        with self.conn.cursor() as cursor:
+            with self.assertRaises(InvalidTransition):
+                record_scan(cursor, self.user_id, 'exit', reject=True)
+            self.conn.rollback()
+            _, created, problem = record_scan(cursor, self.user_id, 'exit')
+            self.assertTrue(created)
+            self.assertEqual(problem, 'exit con estado fuera')
+            self.assertIsNone(record_scan(cursor, self.user_id, 'entry')[2])
+            cursor.execute("SELECT state, last_action, flag FROM user_status WHERE user_id = %s", (self.user_id,))
+            self.assertEqual(cursor.fetchone(), {'state': 'in', 'last_action': 'entry', 'flag': None})
+        self.conn.commit()
+        results = record_batch(self.conn, [{'username': 'batch_user', 'action_type': 'end_lunch'}])
+        self.assertEqual(results[0]['warning'], 'end_lunch con estado dentro')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from user_cache import UserCache
+
+
+class FakeUsers:
+    """Stands in for a connection: answers the counters and users lookups UserCache runs."""
+
+    def __init__(self, users):
+        self.users = users              # id -> (username, qr_code_data)
+        self.version = 0
+        self.lookups = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=()):
+        if 'FROM counters' in query:
+            self._row = {'value': self.version}
+            return
+        self.lookups += 1
+        column = query.rsplit('WHERE ', 1)[1].split(' ')[0]
+        index = {'id': None, 'username': 0, 'qr_code_data': 1}[column]
+        self._row = None
+        for user_id, fields in self.users.items():
+            if (user_id if index is None else fields[index]) == params[0]:
+                self._row = {'id': user_id, 'username': fields[0]}
+
+    def fetchone(self):
+        return self._row
+
+    def change(self, user_id, username, qr):
+        self.users[user_id] = (username, qr)
+        self.version += 1
+
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeUsers({1: ('ana', 'user:ana:01'), 2: ('luis', 'user:luis:02')})
+
+    def test_hits_after_first_lookup_under_every_key(self):
+        cache = UserCache(check_interval=0)
+        self.assertEqual(cache.get(self.db, 'qr', 'user:ana:01'), {'id': 1, 'username': 'ana'})
+        self.assertEqual(cache.get(self.db, 'qr', 'user:ana:01')['id'], 1)
+        self.assertEqual(cache.get(self.db, 'id', 1)['username'], 'ana')
+        self.assertEqual(cache.get(self.db, 'username', 'ana')['id'], 1)
+        self.assertEqual(self.db.lookups, 1)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        self.assertEqual(cache.stats()['hit_rate'], 0.75)
+
+    def test_unknown_users_are_not_cached(self):
+        cache = UserCache(check_interval=0)
+        self.assertIsNone(cache.get(self.db, 'username', 'nadie'))
+        self.db.users[3] = ('nadie', 'user:nadie:03')
+        self.assertEqual(cache.get(self.db, 'username', 'nadie')['id'], 3)
+
+    def test_version_bump_from_another_worker_clears(self):
+        cache = UserCache(check_interval=0)
+        cache.get(self.db, 'id', 1)
+        self.db.change(1, 'ana maria', 'user:ana:01')
+        self.assertEqual(cache.get(self.db, 'id', 1)['username'], 'ana maria')
+        self.assertEqual(cache.invalidations, 1)
+
+    def test_version_checked_at_most_every_interval(self):
+        cache = UserCache(check_interval=60)
+        cache.get(self.db, 'id', 1)
+        self.db.change(1, 'ana maria', 'user:ana:01')
+        self.assertEqual(cache.get(self.db, 'id', 1)['username'], 'ana')
+        cache.clear()                   # what the worker that made the change does
+        self.assertEqual(cache.get(self.db, 'id', 1)['username'], 'ana maria')
+
+    def test_ttl_and_size(self):
+        cache = UserCache(size=3, ttl=0, check_interval=0)
+        cache.get(self.db, 'id', 1)
+        cache.get(self.db, 'id', 1)
+        self.assertEqual(self.db.lookups, 2)
+
+        cache = UserCache(size=3, check_interval=0)
+        cache.get(self.db, 'qr', 'user:ana:01')
+        cache.get(self.db, 'qr', 'user:luis:02')
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_row_read_before_a_clear_is_not_stored(self):
+        cache = UserCache(check_interval=0)
+        generation = cache._generation
+        cache.clear()
+        cache._store(generation, {('id', 1)}, {'id': 1, 'username': 'old'}, 0)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+from datetime import datetime, timedelta
+
+from user_status import StatusMirror, transition_problem, update_status
+
+T = datetime(2024, 3, 4, 8, 0)
+
+
+class FakeStatus:
+    """Stands in for a connection: one user_status table joined to users."""
+
+    def __init__(self, users):
+        self.users = users              # id -> (username, area)
+        self.rows = {}                  # user_id -> row
+        self.now = T
+        self.tick = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=()):
+        if query.startswith('SELECT NOW'):
+            self._result = [{'now': self.now}]
+        elif query.startswith('INSERT INTO user_status'):
+            self.rows.setdefault(params[0], {'state': 'out', 'last_action': None, 'last_at': None, 'flag': None})
+            self._touch(params[0])
+        elif query.startswith('SELECT state'):
+            self._result = [dict(self.rows[params[0]])]
+        elif query.startswith('UPDATE user_status'):
+            state, last_action, last_at, flag, user_id = params
+            self.rows[user_id].update(state=state, last_action=last_action, last_at=last_at, flag=flag)
+            self._touch(user_id)
+        else:
+            since = params[0] if params else None
+            self._result = [dict(row, user_id=user_id, username=self.users[user_id][0], area=self.users[user_id][1])
+                            for user_id, row in self.rows.items()
+                            if user_id in self.users and (since is None or row['updated_at'] > since)]
+
+    def _touch(self, user_id):
+        self.tick += 1
+        self.rows[user_id]['updated_at'] = T + timedelta(minutes=self.tick)
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class TestTransitions(unittest.TestCase):
+    def test_problems(self):
+        self.assertIsNone(transition_problem('out', None, 'entry', T))
+        self.assertIsNone(transition_problem('lunch', T, 'exit', T))
+        self.assertEqual(transition_problem(None, None, 'exit', T), 'exit con estado fuera')
+        self.assertEqual(transition_problem('in', T, 'entry', T), 'entry con estado dentro')
+        # A stay older than MAX_SHIFT is over: entering again is fine
+        self.assertIsNone(transition_problem('in', T, 'entry', T + timedelta(days=1)))
+
+    def test_update_status_flags_and_ignores_late_scans(self):
+        db = FakeStatus({1: ('ana', 'Bodega')})
+        problems = update_status(db, 1, [('exit', T + timedelta(hours=8)), ('entry', T)])
+        self.assertEqual(problems, [None, None])
+        self.assertEqual(db.rows[1]['state'], 'out')
+        self.assertEqual(update_status(db, 1, [('exit', T + timedelta(hours=9))]), ['exit con estado fuera'])
+        self.assertEqual(db.rows[1]['flag'], 'exit con estado fuera')
+        # Older than the last scan: not checked, state unchanged
+        self.assertEqual(update_status(db, 1, [('start_lunch', T + timedelta(hours=1))]), [None])
+        self.assertEqual((db.rows[1]['state'], db.rows[1]['last_action']), ('out', 'exit'))
+        update_status(db, 1, [('entry', T + timedelta(hours=20))])
+        self.assertIsNone(db.rows[1]['flag'])
+
+
+class TestStatusMirror(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeStatus({1: ('ana', 'Bodega'), 2: ('luis', 'Bodega'), 3: ('eva', 'Oficina')})
+        for user_id, action in ((1, 'entry'), (2, 'entry'), (3, 'entry'), (2, 'start_lunch')):
+            update_status(self.db, user_id, [(action, T + timedelta(minutes=user_id))])
+
+    def test_occupancy_and_present(self):
+        mirror = StatusMirror(sync_interval=0)
+        mirror.ensure_current(self.db)
+        areas, totals = mirror.occupancy()
+        self.assertEqual(areas, {'Bodega': {'in': 1, 'lunch': 1}, 'Oficina': {'in': 1, 'lunch': 0}})
+        self.assertEqual(totals, {'in': 2, 'lunch': 1})
+        self.assertEqual([p['username'] for p in mirror.present('Bodega')], ['ana', 'luis'])
+
+        mirror.apply(3, 'exit', T + timedelta(hours=8))
+        self.assertEqual(mirror.occupancy()[1], {'in': 1, 'lunch': 1})
+        self.assertEqual(mirror.problem(3, 'exit', T + timedelta(hours=9)), 'exit con estado fuera')
+
+    def test_sync_picks_up_other_workers_and_expires_stays(self):
+        mirror = StatusMirror(sync_interval=0)
+        mirror.sync(self.db)
+        update_status(self.db, 1, [('exit', T + timedelta(hours=8))])
+        mirror.sync(self.db)
+        self.assertEqual(mirror.occupancy()[1], {'in': 1, 'lunch': 1})
+        # Nobody scanned out a day later: they are no longer counted
+        self.db.now = T + timedelta(days=1)
+        mirror.sync(self.db)
+        self.assertEqual(mirror.occupancy(), ({}, {'in': 0, 'lunch': 0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from datetime import date, datetime
+
+from db_testing import MySQLTestCase
+from log_queries import build_work_day_where, log_filters
+from payroll import payroll_summary
+from rebuild_work_days import month_windows, rebuild
+from work_days import payroll_from_rollup, refresh_after_scan, refresh_around
+
+
+class TestRollupHelpers(unittest.TestCase):
+    def test_month_windows(self):
+        windows = list(month_windows(date(2024, 1, 15), date(2024, 3, 2)))
+        self.assertEqual(windows, [
+            (date(2024, 1, 15), date(2024, 1, 31)),
+            (date(2024, 2, 1), date(2024, 2, 29)),
+            (date(2024, 3, 1), date(2024, 3, 2)),
+        ])
+
+    def test_work_day_where_is_inclusive_and_ignores_action(self):
+        where, params = build_work_day_where(log_filters(
+            {'date_from': '2024-03-01', 'date_to': '2024-03-31', 'action_type': 'exit'}))
+        self.assertIn('work_days.work_date >= %s', where)
+        self.assertIn('work_days.work_date <= %s', where)
+        self.assertNotIn('logs.type', where)
+        self.assertEqual(params, [date(2024, 3, 1), date(2024, 3, 31)])
+
+
+class TestWorkDays(MySQLTestCase):
+    """Rollup against MySQL (skipped without a server)."""
+
+    def setUp(self):
+        self.user_id = self.create_user('rollup_user', 'rollup:qr')
+
+    def tearDown(self):
+        self.delete_users('rollup_user')
+
+    def scan(self, action_type, ts):
+        with self.conn.cursor() as cursor:
+            timestamp = datetime.strptime(ts, '%Y-%m-%d %H:%M')
+            cursor.execute("INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)",
+                           (self.user_id, action_type, timestamp))
+            log_id = cursor.lastrowid
+            refresh_after_scan(cursor, self.user_id, action_type, timestamp)
+        self.conn.commit()
+        return log_id
+
+    def rollup(self):
+        with self.conn.cursor() as cursor:
+            return payroll_from_rollup(cursor, "users.id = %s", [self.user_id]).get('rollup_user')
+
+    def raw(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT %s AS username, type, timestamp FROM logs WHERE user_id = %s",
+                           ('rollup_user', self.user_id))
+            return payroll_summary(cursor.fetchall()).get('rollup_user')
+
+    def test_scans_keep_rollup_in_step(self):
+        self.scan('entry', '2024-03-02 20:00')          # Saturday night shift
+        self.scan('start_lunch', '2024-03-03 00:00')
+        self.scan('end_lunch', '2024-03-03 00:30')
+        self.scan('exit', '2024-03-03 06:30')
+        self.scan('entry', '2024-03-04 07:00')
+        self.scan('exit', '2024-03-04 17:00')
+        self.assertEqual(self.rollup(), self.raw())
+        self.assertEqual(self.rollup(), {'total_hours': 20, 'sunday_holiday_hours': 6, 'overtime_hours': 2})
+
+    def test_delete_log_corrects_rollup(self):
+        self.scan('entry', '2024-03-04 07:00')
+        lunch = self.scan('start_lunch', '2024-03-04 12:00')
+        self.scan('end_lunch', '2024-03-04 13:00')
+        self.scan('exit', '2024-03-04 17:00')
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT timestamp FROM logs WHERE id = %s", (lunch,))
+            ts = cursor.fetchone()['timestamp']
+            cursor.execute("DELETE FROM logs WHERE id = %s", (lunch,))
+            refresh_around(cursor, self.user_id, ts)
+        self.conn.commit()
+        self.assertEqual(self.rollup(), self.raw())
+
+    def test_rebuild_matches_raw_logs(self):
+        with self.conn.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO logs (user_id, type, timestamp) VALUES (%s, %s, %s)",
+                [(self.user_id, 'entry', datetime(2024, 1, 31, 22)), (self.user_id, 'exit', datetime(2024, 2, 1, 7)),
+                 (self.user_id, 'entry', datetime(2024, 5, 1, 8)), (self.user_id, 'exit', datetime(2024, 5, 1, 18))])
+        self.conn.commit()
+        self.assertIsNone(self.rollup())
+        rebuild(self.conn, user_id=self.user_id)
+        self.assertEqual(self.rollup(), self.raw())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Per-worker cache of scan lookups: QR data, username or id -> user row.
+
+Entries live for TTL seconds at most, least recently used first out once
+there are CACHE_SIZE of them. Anything that changes a username or QR code
+calls record_user_change() in its transaction, which bumps the 'users'
+counter; every worker compares that counter with the one it last saw (at
+most every CHECK_INTERVAL seconds, a primary key read) and drops all of its
+entries when it moved. The worker that made the change clears its own
+entries right away with clear().
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+# Seconds between version checks against the counters table (0: every lookup)
+CHECK_INTERVAL = float(os.environ.get('USER_CACHE_CHECK_INTERVAL', 1))
+
+LOOKUPS = {
+    'qr': "SELECT id, username FROM users WHERE qr_code_data = %s",
+    'username': "SELECT id, username FROM users WHERE username = %s",
+    'id': "SELECT id, username FROM users WHERE id = %s",
+}
+
+
+def record_user_change(cursor):
+    """Invalidate every worker's user cache once the current transaction commits."""
+    cursor.execute("UPDATE counters SET value = value + 1 WHERE name = 'users'")
+
+
+def users_version(cursor):
+    cursor.execute("SELECT value FROM counters WHERE name = 'users'")
+    row = cursor.fetchone()
+    return int(row['value']) if row else 0
+
+
+class UserCache:
+    def __init__(self, size=CACHE_SIZE, ttl=TTL, check_interval=CHECK_INTERVAL):
+        self.size = size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()   # (kind, key) -> (user row, expires_at)
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        # Bumped by every clear: a row read before a clear is not stored after it
+        self._generation = 0
+        self.hits = self.misses = self.invalidations = 0
+
+    def get(self, db, kind, key):
+        """{'id', 'username'} for the user with this QR data / username / id, or None."""
+        now = time.monotonic()
+        with db.cursor() as cursor:
+            self._check_version(cursor, now)
+            with self._lock:
+                entry = self._entries.get((kind, key))
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end((kind, key))
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+                generation = self._generation
+            cursor.execute(LOOKUPS[kind], (key,))
+            user = cursor.fetchone()
+        # Unknown users are not cached: a registration would have to find them
+        if user is not None:
+            self._store(generation, {(kind, key), ('id', user['id']), ('username', user['username'])}, user, now)
+        return user
+
+    def _store(self, generation, keys, user, now):
+        with self._lock:
+            if generation != self._generation:
+                return
+            for cache_key in keys:
+                self._entries[cache_key] = (user, now + self.ttl)
+                self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _check_version(self, cursor, now):
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        version = users_version(cursor)
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                if self._version is not None:
+                    self._clear()
+                self._version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._generation += 1
+        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'ttl': self.ttl,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+
+
+user_cache = UserCache()
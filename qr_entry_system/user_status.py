@@ -0,0 +1,204 @@
+"""Who is inside right now: each user's current state, kept up to date by every scan.
+
+user_status holds one row per user (state, last action and its time),
+updated in the same transaction as the scan, under the row's lock. Each
+worker mirrors it in memory (StatusMirror) with a count per area and
+state, so the occupancy endpoints never touch logs.
+
+A scan that does not follow from the current state (an exit without an
+entry, two entries in a row) is flagged on the row and reported back to
+the scanner; with SCAN_TRANSITIONS=reject, live scans like that are
+refused instead. A state older than MAX_SHIFT (someone who never scanned
+out) counts as out.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+STATES = ('out', 'in', 'lunch')
+NEXT_STATE = {'entry': 'in', 'end_lunch': 'in', 'start_lunch': 'lunch', 'exit': 'out'}
+ALLOWED = {
+    'out': ('entry',),
+    'in': ('start_lunch', 'exit'),
+    'lunch': ('end_lunch', 'exit'),
+}
+STATE_LABELS = {'out': 'fuera', 'in': 'dentro', 'lunch': 'en almuerzo'}
+
+MAX_SHIFT = timedelta(hours=float(os.environ.get('STATUS_MAX_SHIFT_HOURS', 16)))
+# 'flag' records and reports invalid transitions, 'reject' refuses live ones
+POLICY = os.environ.get('SCAN_TRANSITIONS', 'flag')
+SYNC_INTERVAL = float(os.environ.get('STATUS_SYNC_INTERVAL', 2))
+# Full reload (picks up deleted users) every this many seconds
+FULL_SYNC_INTERVAL = float(os.environ.get('STATUS_FULL_SYNC_INTERVAL', 300))
+# Incremental syncs re-read this far back: updated_at is set before commit
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class InvalidTransition(ValueError):
+    """A live scan refused under SCAN_TRANSITIONS=reject."""
+
+
+def effective_state(state, last_at, now):
+    if state != 'out' and last_at is not None and now - last_at > MAX_SHIFT:
+        return 'out'
+    return state
+
+
+def transition_problem(state, last_at, action_type, ts):
+    """Why action_type cannot follow the state at ts, or None if it can."""
+    current = effective_state(state or 'out', last_at, ts)
+    if action_type in ALLOWED[current]:
+        return None
+    return f'{action_type} con estado {STATE_LABELS[current]}'
+
+
+def update_status(cursor, user_id, events):
+    """Apply (action_type, timestamp) scans of user_id; returns the problem of each, in order.
+
+    Holds the user's row lock until commit. A scan older than the last one
+    recorded (a late upload) is not checked and does not change the state.
+    """
+    # Creates the row if needed; either way it is locked from here on
+    cursor.execute(
+        "INSERT INTO user_status (user_id, state) VALUES (%s, 'out') ON DUPLICATE KEY UPDATE user_id = user_id",
+        (user_id,))
+    cursor.execute(
+        "SELECT state, last_action, last_at, flag FROM user_status WHERE user_id = %s FOR UPDATE", (user_id,))
+    row = cursor.fetchone()
+    state, last_action, last_at, flag = row['state'], row['last_action'], row['last_at'], row['flag']
+
+    problems = [None] * len(events)
+    changed = False
+    for i in sorted(range(len(events)), key=lambda i: events[i][1]):
+        action_type, ts = events[i]
+        if last_at is not None and ts < last_at:
+            continue
+        problems[i] = transition_problem(state, last_at, action_type, ts)
+        if problems[i]:
+            flag = problems[i]
+        elif action_type == 'entry':
+            # A clean start of a new stay clears the last flag
+            flag = None
+        state, last_action, last_at = NEXT_STATE[action_type], action_type, ts
+        changed = True
+    if changed:
+        cursor.execute(
+            "UPDATE user_status SET state = %s, last_action = %s, last_at = %s, flag = %s WHERE user_id = %s",
+            (state, last_action, last_at, flag, user_id))
+    return problems
+
+
+def touch_status(cursor, user_id):
+    """Make workers re-read user_id's row (e.g. its area changed)."""
+    cursor.execute("UPDATE user_status SET updated_at = NOW(6) WHERE user_id = %s", (user_id,))
+
+
+class StatusMirror:
+    """Per-worker copy of user_status with per-(area, state) counts."""
+
+    def __init__(self, sync_interval=SYNC_INTERVAL, full_sync_interval=FULL_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self._lock = threading.Lock()
+        self._users = {}            # user_id -> dict(state, last_at, flag, username, area)
+        self._counts = Counter()    # (area, state) -> users
+        self._since = None          # highest updated_at seen
+        self.synced_at = None
+        self.full_synced_at = None
+
+    def _set(self, user_id, entry):
+        old = self._users.get(user_id)
+        if old is not None:
+            self._counts[(old['area'], old['state'])] -= 1
+        if entry is None:
+            self._users.pop(user_id, None)
+        else:
+            self._users[user_id] = entry
+            self._counts[(entry['area'], entry['state'])] += 1
+
+    def apply(self, user_id, action_type, ts, flag=None):
+        """Reflect a scan this worker just committed (or journaled)."""
+        with self._lock:
+            old = self._users.get(user_id)
+            if old is None:
+                # Area and name unknown here: the next sync brings the row
+                self.synced_at = None
+                return
+            if old['last_at'] is not None and ts < old['last_at']:
+                return
+            entry = dict(old, state=NEXT_STATE[action_type], last_at=ts)
+            if flag:
+                entry['flag'] = flag
+            elif action_type == 'entry':
+                entry['flag'] = None
+            self._set(user_id, entry)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._set(user_id, None)
+
+    def problem(self, user_id, action_type, ts):
+        """transition_problem against the mirrored state (write-behind scans)."""
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None:
+            return transition_problem('out', None, action_type, ts)
+        return transition_problem(entry['state'], entry['last_at'], action_type, ts)
+
+    def sync(self, db):
+        now = time.monotonic()
+        full = self.full_synced_at is None or now - self.full_synced_at > self.full_sync_interval
+        with db.cursor() as cursor:
+            cursor.execute("SELECT NOW(6) AS now")
+            db_now = cursor.fetchone()['now']
+            query = ("SELECT user_status.user_id, user_status.state, user_status.last_at, user_status.flag, "
+                     "user_status.updated_at, users.username, users.area "
+                     "FROM user_status JOIN users ON users.id = user_status.user_id")
+            if full or self._since is None:
+                cursor.execute(query)
+            else:
+                cursor.execute(query + " WHERE user_status.updated_at > %s", (self._since - SYNC_OVERLAP,))
+            rows = cursor.fetchall()
+        with self._lock:
+            if full:
+                for user_id in list(self._users):
+                    self._set(user_id, None)
+            for row in rows:
+                self._set(row['user_id'], {'state': row['state'], 'last_at': row['last_at'], 'flag': row['flag'],
+                                           'username': row['username'], 'area': row['area'] or ''})
+                if self._since is None or row['updated_at'] > self._since:
+                    self._since = row['updated_at']
+            # Stays past MAX_SHIFT become out (the scan out was forgotten)
+            for user_id, entry in list(self._users.items()):
+                if effective_state(entry['state'], entry['last_at'], db_now) != entry['state']:
+                    self._set(user_id, dict(entry, state='out'))
+            self.synced_at = now
+            if full:
+                self.full_synced_at = now
+
+    def ensure_current(self, db):
+        if self.synced_at is None or time.monotonic() - self.synced_at > self.sync_interval:
+            self.sync(db)
+        return self
+
+    def occupancy(self):
+        """{area: {'in': n, 'lunch': n}} for areas with someone in, plus the totals."""
+        with self._lock:
+            areas = {}
+            for (area, state), n in self._counts.items():
+                if state != 'out' and n:
+                    areas.setdefault(area, {'in': 0, 'lunch': 0})[state] = n
+        totals = {state: sum(a[state] for a in areas.values()) for state in ('in', 'lunch')}
+        return areas, totals
+
+    def present(self, area=None):
+        """Users inside or at lunch (optionally in one area), longest there first."""
+        with self._lock:
+            people = [dict(entry, id=user_id) for user_id, entry in self._users.items()
+                      if entry['state'] != 'out' and (area is None or entry['area'] == area)]
+        return sorted(people, key=lambda p: p['last_at'])
+
+
+status_mirror = StatusMirror()
@@ -31,6 +31,8 @@ class TestScannerAPI(unittest.TestCase):
             db = get_db()
             with db.cursor() as cursor:
                 cursor.execute("DELETE FROM users WHERE username = 'test_admin'")
+                cursor.execute("DELETE logs FROM logs JOIN users ON users.id = logs.user_id "
+                               "WHERE users.username = 'test_scan_user'")
                 cursor.execute("DELETE FROM users WHERE username = 'test_scan_user'")
                 db.commit()
 
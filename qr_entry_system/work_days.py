@@ -0,0 +1,96 @@
+from datetime import datetime, time, timedelta
+
+from payroll import ONE_DAY, daily_seconds, day_totals
+
+# Scans that close a worked interval; entry and end_lunch only open one
+CLOSING_EVENTS = ('exit', 'start_lunch')
+# Read logs this far past the last refreshed day so a shift still open at
+# midnight gets its closing scan
+LOOKAHEAD = timedelta(days=1)
+
+
+def session_start(cursor, user_id, before):
+    """Where a replay has to begin to know the session state at `before`.
+
+    That is the entry of a session still open at that moment, or `before`
+    itself when the user was out.
+    """
+    cursor.execute(
+        "SELECT type, timestamp FROM logs "
+        "WHERE user_id = %s AND timestamp < %s AND type IN ('entry', 'exit') "
+        "ORDER BY timestamp DESC, id DESC LIMIT 1",
+        (user_id, before))
+    row = cursor.fetchone()
+    if row and row['type'] == 'entry':
+        return row['timestamp']
+    return before
+
+
+def refresh_days(cursor, user_id, first_day, last_day):
+    """Recompute user_id's work_days rows for [first_day, last_day] from the raw logs."""
+    start = datetime.combine(first_day, time())
+    end = datetime.combine(last_day + ONE_DAY, time())
+    cursor.execute(
+        "SELECT type, timestamp FROM logs "
+        "WHERE user_id = %s AND timestamp >= %s AND timestamp < %s "
+        "ORDER BY timestamp, id",
+        (user_id, session_start(cursor, user_id, start), end + LOOKAHEAD))
+
+    rows = []
+    for day, seconds in daily_seconds(cursor.fetchall()).items():
+        if first_day <= day <= last_day:
+            hours, holiday_hours, overtime_hours = day_totals(day, seconds)
+            rows.append((user_id, day, round(hours * 3600), round(holiday_hours * 3600),
+                         round(overtime_hours * 3600)))
+
+    cursor.execute(
+        "DELETE FROM work_days WHERE user_id = %s AND work_date BETWEEN %s AND %s",
+        (user_id, first_day, last_day))
+    if rows:
+        cursor.executemany(
+            "INSERT INTO work_days "
+            "(user_id, work_date, worked_seconds, sunday_holiday_seconds, overtime_seconds) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            rows)
+    return len(rows)
+
+
+def refresh_around(cursor, user_id, timestamp):
+    """Refresh the days a scan at timestamp can affect (added or deleted).
+
+    From the start of the session it belongs to through the following day;
+    older history is left to rebuild_work_days.py.
+    """
+    return refresh_span(cursor, user_id, timestamp, timestamp)
+
+
+def refresh_span(cursor, user_id, first, last):
+    """Refresh the days scans added between timestamps first and last can affect."""
+    first_day = session_start(cursor, user_id, first).date()
+    return refresh_days(cursor, user_id, first_day, last.date() + ONE_DAY)
+
+
+def refresh_after_scan(cursor, user_id, action_type, timestamp):
+    """Keep the rollup current after a new scan (same transaction as the insert)."""
+    if action_type not in CLOSING_EVENTS:
+        return 0
+    return refresh_around(cursor, user_id, timestamp)
+
+
+def payroll_from_rollup(cursor, where, params):
+    """{username: totals} summed from work_days, one row per employee."""
+    cursor.execute(
+        f"SELECT users.username, SUM(work_days.worked_seconds) AS worked, "
+        f"SUM(work_days.sunday_holiday_seconds) AS sunday_holiday, "
+        f"SUM(work_days.overtime_seconds) AS overtime "
+        f"FROM work_days JOIN users ON work_days.user_id = users.id "
+        f"WHERE {where} GROUP BY work_days.user_id, users.username ORDER BY users.username",
+        tuple(params))
+    return {
+        row['username']: {
+            'total_hours': round(float(row['worked']) / 3600, 2),
+            'sunday_holiday_hours': round(float(row['sunday_holiday']) / 3600, 2),
+            'overtime_hours': round(float(row['overtime']) / 3600, 2),
+        }
+        for row in cursor.fetchall()
+    }